@@ -0,0 +1,105 @@
+from collections import Counter
+from contextvars import ContextVar
+from flask import Flask, Response, g, request
+from functools import wraps
+import logging
+import time
+
+
+# Storage method calls and outbound HTTP requests made while handling the
+# current request, by name
+_calls: ContextVar[Counter|None] = ContextVar('calls', default=None)
+
+logger = logging.getLogger('libraryserver.access')
+
+# Request body fields replaced when bodies are logged
+REDACTED_FIELDS = {'name', 'email'}
+
+
+def recordCall(name: str):
+    """Counts one call against the request being handled, if any. Note that
+    for storage these are Database method calls, each of which may make any
+    number of Firestore RPCs (or none, if served from the replica).
+    """
+    calls = _calls.get()
+    if calls is not None:
+        calls[name] += 1
+
+
+class CountingProxy:
+    """Wraps an object (like the Database) so that every call to one of its
+    public methods is counted with `recordCall`, as "<kind>.<method>".
+
+    Only calls made through the proxy are counted, so a method that calls
+    others on the same object counts once.
+    """
+
+    def __init__(self, target, kind: str):
+        self._target = target
+        self._kind = kind
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def counted(*args, **kwargs):
+            recordCall('%s.%s' % (self._kind, name))
+            return attr(*args, **kwargs)
+
+        return counted
+
+    def unwrap(self):
+        return self._target
+
+
+def _redact(body):
+    if isinstance(body, dict):
+        return {k: '[redacted]' if k in REDACTED_FIELDS else _redact(v)
+                for k, v in body.items()}
+    if isinstance(body, list):
+        return [_redact(v) for v in body]
+    return body
+
+
+def install(app: Flask, log_bodies: bool = False):
+    """Logs every request `app` handles: when, what route and parameters,
+    who called it, the status, how long it took and what storage and HTTP
+    calls it made. The details are structured fields of the record, which
+    the JSON log format writes at the top level, so each line carries what
+    `bench.replay` needs to re-send it.
+
+    JSON request bodies are only logged if `log_bodies` is set (replays of
+    logs without them send no body), with names and emails redacted.
+    """
+
+    @app.before_request
+    def startRequest():
+        g.access_start = time.monotonic()
+        g.access_calls = Counter()
+        g.access_token = _calls.set(g.access_calls)
+
+    @app.after_request
+    def logRequest(response: Response) -> Response:
+        if 'access_start' not in g:
+            return response
+        latency = time.monotonic() - g.access_start
+        _calls.reset(g.access_token)
+        user = getattr(request, 'user', None)
+        entry = {
+            "time": time.time(),
+            "method": request.method,
+            "route": request.url_rule.rule if request.url_rule else None,
+            "path": request.path,
+            "query": request.query_string.decode('utf-8', 'replace'),
+            "body": _redact(request.get_json(silent=True)) if log_bodies else None,
+            "caller": user.id if user is not None else None,
+            "status": response.status_code,
+            "latency_ms": round(latency * 1000, 3),
+            "method_calls": dict(g.access_calls),
+            "total_method_calls": sum(g.access_calls.values())
+        }
+        logger.info('%s %s %d', request.method, request.path,
+                    response.status_code, extra={'fields': entry})
+        return response
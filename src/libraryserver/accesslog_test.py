@@ -0,0 +1,115 @@
+from flask import Flask, request
+import logging
+import unittest
+
+from libraryserver import accesslog
+from libraryserver.accesslog import CountingProxy, recordCall
+
+
+class FakeStore:
+
+    def __init__(self):
+        self.name = 'store'
+
+    def getBook(self, isbn):
+        return self._lookup(isbn)
+
+    def _lookup(self, isbn):
+        return 'book %s' % isbn
+
+
+class CapturingHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def emit(self, record):
+        self.entries.append(record.fields)
+
+
+class TestAccessLog(unittest.TestCase):
+
+    def setUp(self):
+        self.store = CountingProxy(FakeStore(), 'db')
+        self.app = Flask(__name__)
+        accesslog.install(self.app)
+
+        @self.app.route('/books/<isbn>', methods=['GET', 'POST'])
+        def getBook(isbn):
+            request.user = type('User', (), {'id': '1234'})()
+            self.store.getBook(isbn)
+            self.store.getBook(isbn)
+            recordCall('http.example.com')
+            return self.store.getBook(isbn), 200
+
+        self.handler = CapturingHandler()
+        accesslog.logger.addHandler(self.handler)
+        accesslog.logger.setLevel(logging.INFO)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        accesslog.logger.removeHandler(self.handler)
+
+    def test_logsRequest(self):
+        res = self.client.get('/books/isbn1?fields=title')
+
+        self.assertEqual(res.data, b'book isbn1')
+        entry = self.handler.entries[0]
+        self.assertEqual(entry['method'], 'GET')
+        self.assertEqual(entry['route'], '/books/<isbn>')
+        self.assertEqual(entry['path'], '/books/isbn1')
+        self.assertEqual(entry['query'], 'fields=title')
+        self.assertEqual(entry['caller'], '1234')
+        self.assertEqual(entry['status'], 200)
+        self.assertGreaterEqual(entry['latency_ms'], 0)
+
+    def test_logsCallCounts(self):
+        self.client.get('/books/isbn1')
+
+        entry = self.handler.entries[0]
+        self.assertEqual(entry['method_calls'], {'db.getBook': 3, 'http.example.com': 1})
+        self.assertEqual(entry['total_method_calls'], 4)
+
+    def test_omitsBodyByDefault(self):
+        self.client.post('/books/isbn1', json={'user_id': 1234})
+
+        self.assertIsNone(self.handler.entries[0]['body'])
+
+    def test_logsRedactedBody(self):
+        app = Flask(__name__)
+        accesslog.install(app, log_bodies=True)
+        app.add_url_rule('/users', 'users', lambda: ('ok', 200), methods=['POST'])
+
+        app.test_client().post('/users', json={'user': {'name': 'Jane Doe',
+                                                         'email': 'jane@example.com'},
+                                               'user_id': 1234})
+
+        self.assertEqual(self.handler.entries[0]['body'],
+                         {'user': {'name': '[redacted]', 'email': '[redacted]'},
+                          'user_id': 1234})
+
+    def test_logsUnmatchedRoute(self):
+        self.client.get('/nothing')
+
+        entry = self.handler.entries[0]
+        self.assertIsNone(entry['route'])
+        self.assertEqual(entry['status'], 404)
+
+    def test_recordCall_outsideRequest(self):
+        # Must not fail, e.g. for calls made by background threads
+        recordCall('db.getBook')
+
+
+class TestCountingProxy(unittest.TestCase):
+
+    def test_passesThroughAttributes(self):
+        proxy = CountingProxy(FakeStore(), 'db')
+
+        self.assertEqual(proxy.name, 'store')
+        self.assertEqual(proxy.getBook('isbn1'), 'book isbn1')
+        self.assertIsInstance(proxy.unwrap(), FakeStore)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+from collections.abc import Callable
+from flask import Response, make_response
+from functools import wraps
+import math
+import threading
+from typing import TypeVar
+
+
+a = TypeVar("a")
+
+class AdmissionPool:
+    """Caps how many requests for one class of routes run at once.
+
+    Up to `limit` requests run concurrently. Up to `queue` more may wait, for
+    at most `max_wait` seconds each, for one of them to finish. Anything
+    beyond that is turned away immediately, so a burst on one pool can't
+    pile up threads (and Firestore calls) that slow every other route down.
+    """
+
+    def __init__(self, name: str, limit: int, queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.max_wait = max_wait
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    def retryAfter(self) -> int:
+        """Seconds a rejected caller should wait before trying again."""
+        return max(1, math.ceil(self.max_wait))
+
+    def acquire(self) -> bool:
+        """Takes a slot, waiting in the queue if needed. Returns False if the
+        queue is full or the wait timed out.
+        """
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._lock:
+            if self._waiting >= self.queue:
+                return False
+            self._waiting += 1
+        try:
+            return self._slots.acquire(timeout=self.max_wait)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self):
+        self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            waiting = self._waiting
+        return {"name": self.name, "limit": self.limit, "queue": self.queue,
+                "waiting": waiting}
+
+
+def admitted(pool: AdmissionPool):
+    """Runs the route only if `pool` has room, and returns 503 with a
+    Retry-After header otherwise.
+
+    Should go before any decorator that does real work (like
+    @user_authenticated), so rejected requests stay cheap. For streamed
+    responses, the slot is held until the response is closed.
+    """
+
+    def decorator(func: Callable[..., int]) -> Callable[..., int]:
+
+        @wraps(func)
+        def decorated_function(*args: a, **kwargs: a) -> a:
+            if not pool.acquire():
+                return Response(status=503,
+                                response="Server is busy, try again later",
+                                headers={"Retry-After": str(pool.retryAfter())})
+            try:
+                response = make_response(func(*args, **kwargs))
+            except BaseException:
+                pool.release()
+                raise
+            if response.is_streamed:
+                # The real work happens as the body is read
+                response.call_on_close(pool.release)
+            else:
+                pool.release()
+            return response
+
+        # Lets tests check which pool each route is in
+        decorated_function.admission_pool = pool
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,113 @@
+from flask import Flask, Response, stream_with_context
+import threading
+import unittest
+
+from libraryserver.admission import AdmissionPool, admitted
+
+
+class TestAdmissionPool(unittest.TestCase):
+
+    def test_acquire_withinLimit(self):
+        pool = AdmissionPool('test', 2, 0, 0)
+
+        self.assertTrue(pool.acquire())
+        self.assertTrue(pool.acquire())
+        self.assertFalse(pool.acquire())
+
+    def test_acquire_afterRelease(self):
+        pool = AdmissionPool('test', 1, 0, 0)
+        pool.acquire()
+        pool.release()
+
+        self.assertTrue(pool.acquire())
+
+    def test_acquire_waitsInQueue(self):
+        pool = AdmissionPool('test', 1, 1, 5)
+        pool.acquire()
+        threading.Timer(0.05, pool.release).start()
+
+        self.assertTrue(pool.acquire())
+
+    def test_acquire_queueTimeout(self):
+        pool = AdmissionPool('test', 1, 1, 0.01)
+        pool.acquire()
+
+        self.assertFalse(pool.acquire())
+        self.assertEqual(pool.stats()['waiting'], 0)
+
+    def test_acquire_queueFull(self):
+        pool = AdmissionPool('test', 1, 1, 5)
+        pool.acquire()
+        waiter = threading.Thread(target=pool.acquire)
+        waiter.start()
+        while pool.stats()['waiting'] == 0:
+            pass
+
+        self.assertFalse(pool.acquire())
+        pool.release()
+        waiter.join()
+
+    def test_retryAfter(self):
+        self.assertEqual(AdmissionPool('test', 1, 1, 0).retryAfter(), 1)
+        self.assertEqual(AdmissionPool('test', 1, 1, 2.5).retryAfter(), 3)
+
+
+class TestAdmitted(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = AdmissionPool('test', 1, 0, 0)
+        self.app = Flask(__name__)
+
+        @self.app.route('/ok')
+        @admitted(self.pool)
+        def ok():
+            return "ok", 200
+
+        @self.app.route('/fail')
+        @admitted(self.pool)
+        def fail():
+            raise ValueError()
+
+        @self.app.route('/stream')
+        @admitted(self.pool)
+        def stream():
+            def rows():
+                yield "a"
+                yield "b"
+            return Response(stream_with_context(rows()))
+
+        self.client = self.app.test_client()
+
+    def test_admitted_recordsPool(self):
+        self.assertIs(self.app.view_functions['ok'].admission_pool, self.pool)
+
+    def test_admitted_runsRoute(self):
+        res = self.client.get('/ok')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(self.pool.acquire())
+
+    def test_admitted_saturated(self):
+        self.pool.acquire()
+
+        res = self.client.get('/ok')
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+    def test_admitted_releasesOnError(self):
+        res = self.client.get('/fail')
+
+        self.assertEqual(res.status_code, 500)
+        self.assertTrue(self.pool.acquire())
+
+    def test_admitted_holdsUntilStreamed(self):
+        res = self.client.get('/stream')
+
+        self.assertEqual(res.data, b'ab')
+        res.close()
+        self.assertTrue(self.pool.acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
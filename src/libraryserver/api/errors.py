@@ -12,3 +12,29 @@ class InvalidStateException(Exception):
         super().__init__(self.message)
 
 
+class AlreadyExistsException(Exception):
+
+    def __init__(self, message = ''):
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidTokenException(Exception):
+
+    def __init__(self, message = ''):
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidImageException(Exception):
+
+    def __init__(self, message = ''):
+        self.message = message
+        super().__init__(self.message)
+
+
+class DeadlineExceededException(Exception):
+
+    def __init__(self, message = ''):
+        self.message = message
+        super().__init__(self.message)
@@ -35,3 +35,59 @@ class LogEntry:
     action: Action  # What the activity was
     user_id: int|None  # The User that performed this action, if any
     user_name: str|None  # The name of the user (if any), for convenience
+
+@dataclass(frozen=True)
+class CirculationStats:
+    checkouts: int  # Number of times checked out
+    returns: int  # Number of completed loans (checkouts that were returned)
+    total_loan_secs: float  # Combined duration of all completed loans
+    avg_loan_secs: float  # Mean duration of a completed loan (0 if none)
+    last_activity: str  # Timestamp of the latest checkout or return
+
+@dataclass(frozen=True)
+class Loan:
+    book_id: str  # ID of the book that is checked out
+    isbn: str  # ISBN of the book
+    owner_id: int  # user_id of the User whose library the book is from
+    title: str  # Full title of the book
+    author: str  # Full name of the author
+    user_id: int  # The User who has the book
+    checkout_time: str  # Timestamp of checkout
+
+@dataclass(frozen=True)
+class CatalogHolding:
+    owner_id: int  # user_id of the User who owns these copies
+    owner_name: str  # The name of the owner, for convenience
+    book_ids: list[str]  # IDs of the owner's copies
+    available: int  # How many of those copies are not checked out
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    isbn: str  # ISBN shared by every copy
+    title: str  # Full title of the book
+    author: str  # Full name of the author
+    holdings: list[CatalogHolding]  # Copies of this book, grouped by owner
+    available: bool  # True if any copy is not checked out
+
+@dataclass(frozen=True)
+class RankedBook:
+    book_id: str  # ID of the ranked book
+    isbn: str  # ISBN of the book
+    owner_id: int  # user_id of the User whose library the book is in
+    title: str  # Full title of the book
+    author: str  # Full name of the author
+    checkouts: int = 0  # Checkouts within the window (not set in 'recent')
+    last_checkout: str = ''  # Timestamp of the latest checkout (only in 'recent')
+
+@dataclass(frozen=True)
+class Rankings:
+    updated: str  # When these rankings were computed ('' if never)
+    windows: dict[str, list[RankedBook]]  # Most borrowed, by window ('7d', 'all', ...)
+    recent: list[RankedBook]  # Most recently borrowed, latest first
+
+@dataclass(frozen=True)
+class BookChanges:
+    token: str  # Sync token to pass next time, to get changes after these
+    reset: bool  # True if `books` is the whole library, not just changes
+    more: bool  # True if there are more changes to fetch right away
+    books: list[Book]  # Current state of every book that changed
@@ -1,11 +1,21 @@
 from abc import ABC, abstractmethod
 
-from libraryserver.api.models import Book, User, LogEntry
+from libraryserver.api.models import Book, User, LogEntry, CirculationStats, Loan, CatalogEntry, Rankings
 
 class BookService(ABC):
 
     @abstractmethod
-    def getBook(self, isbn: str) -> Book:
+    def getBook(self, isbn: str, owner_id: int|None = None) -> Book:
+        """
+        Fetches a book by ISBN, preferring owner_id's copy if given.
+        """
+        pass
+
+    @abstractmethod
+    def getBooks(self, book_ids: list[str]) -> list[Book]:
+        """
+        Fetches many books by their book_id. Missing books are omitted.
+        """
         pass
 
     @abstractmethod
@@ -19,16 +29,30 @@ class BookService(ABC):
         """
         pass
 
+    @abstractmethod
+    def listLoans(self, min_days: int = 0) -> list[Loan]:
+        """
+        Lists checked-out books across all libraries, oldest loan first.
+        """
+        pass
+
+    @abstractmethod
+    def searchCatalog(self, query: str) -> list[CatalogEntry]:
+        """
+        Searches books across all libraries by ISBN, or by title and author.
+        """
+        pass
+
     @abstractmethod
     def createBook(self, book: Book):
         pass
 
     @abstractmethod
-    def checkoutBook(self, isbn: str, user: User):
+    def checkoutBook(self, isbn: str, user: User, owner_id: int|None = None):
         pass
 
     @abstractmethod
-    def returnBook(self, isbn: str):
+    def returnBook(self, isbn: str, owner_id: int|None = None):
         pass
 
     @abstractmethod
@@ -39,6 +63,22 @@ class BookService(ABC):
     def listUserCheckoutHistory(self, user_id: int) -> list[LogEntry]:
         pass
 
+    @abstractmethod
+    def getBookStats(self, book_id: str) -> CirculationStats:
+        pass
+
+    @abstractmethod
+    def getUserStats(self, user_id: int) -> CirculationStats:
+        pass
+
+    @abstractmethod
+    def getRankings(self, owner_id: int|None = None) -> Rankings:
+        """
+        Gets the most borrowed books in this owner's library, or across all
+        libraries if owner_id is None.
+        """
+        pass
+
 
 class UserService(ABC):
 
@@ -51,6 +91,10 @@ class UserService(ABC):
         pass
 
     @abstractmethod
-    def listUsers(self) -> list[User]:
+    def listUsers(self, prefix: str|None = None) -> list[User]:
+        """
+        Lists all users, optionally only those whose name (or any word of it)
+        starts with 'prefix'.
+        """
         pass
 
@@ -1,20 +1,36 @@
 from dataclasses import asdict
 import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from firebase_admin import credentials, firestore, initialize_app
 import logging
 import os
+import requests
 
-from libraryserver.api.errors import InvalidStateException, NotFoundException
+from libraryserver.api.errors import (
+    DeadlineExceededException, InvalidImageException, InvalidStateException,
+    InvalidTokenException, NotFoundException)
 from libraryserver.api.models import Book, User
+from libraryserver import accesslog, deadline, logconfig
+from libraryserver.accesslog import CountingProxy
+from libraryserver.admission import AdmissionPool, admitted
 from libraryserver.auth import user_authenticated
 from libraryserver.config import APP_CONFIG
+from libraryserver.events import sse
+from libraryserver.events.bus import EventBus
+from libraryserver.events.relay import FirestoreRelay
+from libraryserver.export.formats import FORMATS
 from libraryserver.keys.keymanager import KeyManager
 from libraryserver.lookup.lookup import LookupService
+from libraryserver.notifs.coalescer import CoalescingEmail
+from libraryserver.notifs.mailgun_client import Email
+from libraryserver.search.suggest import SuggestIndex
 from libraryserver.storage.local import LocalBookService, LocalUserService
-from libraryserver.storage.firestore_client import Database
+from libraryserver.storage.firestore_client import Database, connect
+from libraryserver.storage.replica import ReplicatedDatabase
+from libraryserver.storage.userdir import UserDirectory
 from libraryserver.thirdparty.middleware import jwt_authenticated
+from libraryserver.thumbnails.cache import ThumbnailCache
+from libraryserver.warmup import Warmup
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -22,19 +38,78 @@ _ORIGINS = ["http://localhost:4200",
             "https://library-ui-869102415447.us-central1.run.app",
             "https://library.mcswiggen.me"]
 CORS(app, resources={r"*": {"origins": _ORIGINS}})
+logconfig.configure(APP_CONFIG.log_file(), APP_CONFIG.log_level(),
+                    APP_CONFIG.debug_log_sample_rate(),
+                    APP_CONFIG.debug_log_max_per_sec())
+logconfig.install(app)
+accesslog.install(app, APP_CONFIG.access_log_bodies())
+deadline.install(app, APP_CONFIG.request_deadline_secs(),
+                 APP_CONFIG.route_deadline_secs())
 
 # Initialize Firestore DB
-if APP_CONFIG.firestore_apikey_file():
-    cred = credentials.Certificate(APP_CONFIG.firestore_apikey_file())
-    initialize_app(cred)
+if APP_CONFIG.replicate_reads():
+    store = ReplicatedDatabase(connect())
 else:
-    # use application default credentials
-    initialize_app()
-db = Database(firestore.client())
+    store = Database(connect())
+# Counts storage calls made by each request, for the access log
+db = CountingProxy(store, 'db')
+keys = KeyManager()
+users_dir = UserDirectory(db)
+thumbnails = ThumbnailCache(APP_CONFIG.thumbnail_cache_dir())
+suggestions = SuggestIndex(db)
+# Book status changes, for /v0/events. The relay picks up changes made by
+# other instances.
+events = EventBus()
+if APP_CONFIG.relay_events():
+    relay = FirestoreRelay(store, events)
+    relay.start()
+if APP_CONFIG.email_coalesce_secs() > 0:
+    notifier = CoalescingEmail(keys, APP_CONFIG.email_coalesce_secs())
+else:
+    notifier = None
+
+# Separate concurrency limits for cheap, expensive, write and third-party-bound
+# routes, so a burst of expensive requests or writes can't starve the cheap ones
+pools = {name: AdmissionPool(name, limit, queue, APP_CONFIG.admission_max_wait_secs())
+         for name, (limit, queue) in APP_CONFIG.admission_pools().items()}
+
+
+def _waitForReplica():
+    if isinstance(store, ReplicatedDatabase) and not store.isServing():
+        raise RuntimeError('Replica has not finished its initial sync')
+
+def _warmHotBooks():
+    # Builds the suggest index for, and caches the covers of, the books
+    # people are borrowing right now
+    rankings = LocalBookService(db, email=notifier).getRankings()
+    hot = {b.book_id: b for b in rankings.recent}
+    for ranked in rankings.windows.values():
+        hot.update((b.book_id, b) for b in ranked)
+    for owner_id in {b.owner_id for b in hot.values()}:
+        suggestions.suggest(owner_id, '')
+    for book in db.getBooksById(list(hot)):
+        if book.get("img"):
+            try:
+                thumbnails.prefetch(book.get("img"))
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    'Could not prefetch thumbnail for %s', book.id, exc_info=e)
+
+# Runs in the background at startup. Until it's done, /v0/ready reports 503,
+# so traffic is only routed to this instance once it's warm
+warmup = Warmup([
+    ('firestore', db.getUsersVersion),
+    ('replica', _waitForReplica),
+    ('keys', lambda: keys.prefetch([LookupService.API_KEY_NAME, Email.API_KEY_NAME])),
+    ('users', users_dir.listUsers),
+    ('hot_books', _warmHotBooks),
+])
+warmup.start()
 
 
 # Meta-API
 @app.route('/v0/check', methods=['GET'])
+@admitted(pools['cheap'])
 @jwt_authenticated
 @user_authenticated(db)
 def check():
@@ -45,22 +120,116 @@ def check():
     user = User(request.user.id, request.user.get("name"), request.user.get("email"))
     return jsonify(user), 200
 
+@app.route('/v0/ready', methods=['GET'])
+def ready():
+    """
+        ready() : Readiness probe. Returns 200 once this instance has finished
+        warming up, and 503 until then. Does not require authentication.
+        With read replication on, also reports the Firestore read time the
+        replica is consistent with, which is how stale its reads can be.
+    """
+    status = {'ready': warmup.isReady(), 'steps': warmup.status()}
+    if isinstance(store, ReplicatedDatabase):
+        watermark = store.watermark()
+        status['replica'] = {
+            'serving': store.isServing(),
+            'watermark': watermark.isoformat() if watermark else None,
+        }
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/v0/events', methods=['GET'])
+@admitted(pools['stream'])
+@jwt_authenticated
+@user_authenticated(db)
+def streamEvents():
+    """
+        streamEvents() : Stream status changes (create, checkout, return) of
+        books in the library of user_id, or of the calling user if not
+        specified, as server-sent events. Sends the standard Last-Event-ID
+        header to resume after a dropped connection. Needs the usual
+        Authorization header, so browsers must use a fetch-based client
+        rather than EventSource.
+    """
+    user_id = request.args.get('user_id', default=request.user.id)
+    last_event_id = request.headers.get('Last-Event-ID')
+    return Response(stream_with_context(sse.stream(events, user_id, last_event_id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
 # Books API
 @app.route('/v0/books/<book_id>', methods=['GET'])
+@admitted(pools['cheap'])
 @jwt_authenticated
 @user_authenticated(db)
 def getBook(book_id):
     """
-        getBook() : Retrieve book by ID (currently, ISBN)
+        getBook() : Retrieve book by ID (currently, ISBN). The caller's own
+        copy is preferred over other libraries'.
     """
     try:
-        book = LocalBookService(db).getBook(book_id)
+        book = LocalBookService(db).getBook(book_id, int(request.user.id))
     except NotFoundException:
         return "Book with ID '%s' not found" % book_id, 404
     else:
         return jsonify(asdict(book)), 200
 
+@app.route('/v0/books/batch', methods=['GET'])
+@admitted(pools['expensive'])
+@jwt_authenticated
+@user_authenticated(db)
+def getBooks():
+    """
+        getBooks() : Retrieve many books at once, by book_id (not ISBN).
+        'ids' is a comma-separated list of at most 100 IDs. Books that don't
+        exist are left out. Otherwise, results are in the order requested.
+    """
+    ids = [i for i in request.args.get('ids', default='').split(',') if i]
+    if not ids:
+        return "Missing 'ids' parameter", 400
+    if len(ids) > 100:
+        return "At most 100 IDs may be requested at once", 400
+
+    books = LocalBookService(db).getBooks(ids)
+    return jsonify(list(map(asdict, books))), 200
+
+@app.route('/v0/books/changes', methods=['GET'])
+@admitted(pools['expensive'])
+@jwt_authenticated
+@user_authenticated(db)
+def listBookChanges():
+    """
+        listBookChanges() : List the caller's books that were added, checked
+        out or returned since the sync token 'since' was issued, along with
+        a new token. Without 'since', or if the token is too old, lists the
+        whole library and sets 'reset'. If 'more' is set, call again with the
+        new token straight away to get the rest.
+    """
+    since = request.args.get('since')
+    try:
+        changes = LocalBookService(db).listChanges(request.user.id, since)
+    except InvalidTokenException as e:
+        return e.message, 400
+    return jsonify(asdict(changes)), 200
+
+@app.route('/v0/books/suggest', methods=['GET'])
+@admitted(pools['cheap'])
+@jwt_authenticated
+@user_authenticated(db)
+def suggestBooks():
+    """
+        suggestBooks() : Autocomplete for the search box. Returns up to 'k'
+        (default 10) titles and authors with a word starting with 'prefix',
+        ignoring case and accents. Searches the library of user_id, or of the
+        calling user if user_id is not specified.
+    """
+    prefix = request.args.get('prefix', default='')
+    k = request.args.get('k', default=10, type=int)
+    user_id = request.args.get('user_id', default=request.user.id)
+    return jsonify(suggestions.suggest(user_id, prefix, k)), 200
+
 @app.route('/v0/books', methods=['GET'])
+@admitted(pools['expensive'])
 @jwt_authenticated
 @user_authenticated(db)
 def listBooks():
@@ -88,7 +257,55 @@ def listBooks():
 
     return jsonify(list(map(asdict, books))), 200
 
+@app.route('/v0/loans', methods=['GET'])
+@admitted(pools['expensive'])
+@jwt_authenticated
+@user_authenticated(db)
+def listLoans():
+    """
+        listLoans() : List books that are currently checked out, across all
+        libraries, oldest loan first. If 'min_days' is specified, only
+        includes loans that have been out for at least that many days.
+    """
+    min_days = request.args.get('min_days', default=0, type=int)
+    loans = LocalBookService(db).listLoans(min_days)
+    return jsonify(list(map(asdict, loans))), 200
+
+@app.route('/v0/rankings', methods=['GET'])
+@admitted(pools['cheap'])
+@jwt_authenticated
+@user_authenticated(db)
+def getRankings():
+    """
+        getRankings() : Get the most borrowed books over the last 7, 30 and 90
+        days and of all time, plus the most recently borrowed. Ranks the
+        library of user_id (or of the calling user if not specified), or
+        every library if 'global' is 1. Rankings are recomputed periodically,
+        so may be a little behind.
+    """
+    if request.args.get('global', default=0, type=int):
+        owner_id = None
+    else:
+        owner_id = request.args.get('user_id', default=request.user.id)
+    res = LocalBookService(db).getRankings(owner_id)
+    return jsonify(asdict(res)), 200
+
+@app.route('/v0/catalog', methods=['GET'])
+@admitted(pools['expensive'])
+@jwt_authenticated
+@user_authenticated(db)
+def searchCatalog():
+    """
+        searchCatalog() : Search for books across all libraries, by ISBN or by
+        words of the title and author. Results are grouped by ISBN, then by
+        owner, with how many of each owner's copies are available.
+    """
+    query = request.args.get('query', default='')
+    entries = LocalBookService(db).searchCatalog(query)
+    return jsonify(list(map(asdict, entries))), 200
+
 @app.route('/v0/books', methods=['POST'])
+@admitted(pools['write'])
 @jwt_authenticated
 @user_authenticated(db)
 def createBook():
@@ -97,22 +314,25 @@ def createBook():
     """
     try: 
         json = request.json['book']
-        book = Book(None, json['isbn'], request.user.id, json['title'],
+        book = Book(None, json['isbn'], int(request.user.id), json['title'],
                     json['author'], json['category'], json['year'],
                     json['thumbnail'])
     except KeyError:
         return "Missing property", 400
     else:
-        LocalBookService(db).createBook(book)
+        LocalBookService(db, thumbnails, suggest=suggestions,
+                         events=events).createBook(book)
         return "Book created", 200
 
 @app.route('/v0/books/<book_id>/checkout', methods=['POST'])
+@admitted(pools['write'])
 @jwt_authenticated
 @user_authenticated(db)
 def checkoutBook(book_id):
     """
-        checkoutBook() : Mark this book as checked out by a given user. Book
-        must not be currently checked out.
+        checkoutBook() : Mark this book as checked out by a given user. Some
+        copy of the book (the caller's own, if they have one) must not be
+        currently checked out.
     """
     if 'user_id' not in request.json:
         return "Missing 'user_id' property", 400
@@ -122,28 +342,37 @@ def checkoutBook(book_id):
     user = LocalUserService(db).getUser(user_id)
 
     try:
-        LocalBookService(db).checkoutBook(book_id, user)
+        LocalBookService(db, email=notifier, events=events).checkoutBook(
+            book_id, user, int(request.user.id))
+    except NotFoundException:
+        return "Book with ID '%s' not found" % book_id, 404
     except InvalidStateException:
         return "Book with ISBN %s already out" % book_id, 400
     else:
         return "Checked out", 200
 
 @app.route('/v0/books/<book_id>/return', methods=['POST'])
+@admitted(pools['write'])
 @jwt_authenticated
 @user_authenticated(db)
 def returnBook(book_id):
     """
         returnBook() : Mark this book as returned, by whoever checked it out.
-        Book must be currently checked out.
+        Some copy of the book (the caller's own, if they have one) must be
+        currently checked out.
     """
     try:
-        LocalBookService(db).returnBook(book_id)
+        LocalBookService(db, email=notifier, events=events).returnBook(
+            book_id, int(request.user.id))
+    except NotFoundException:
+        return "Book with ID '%s' not found" % book_id, 404
     except InvalidStateException:
         return "Book with ISBN %s not checked out" % book_id, 400
     else:
         return "Returned", 200
 
 @app.route('/v0/books/<book_id>/history', methods=['GET'])
+@admitted(pools['expensive'])
 @jwt_authenticated
 @user_authenticated(db)
 def listBookCheckoutHistory(book_id):
@@ -154,8 +383,77 @@ def listBookCheckoutHistory(book_id):
     logs = LocalBookService(db).listBookCheckoutHistory(book_id)
     return jsonify(list(map(asdict, logs))), 200
 
+@app.route('/v0/books/<book_id>/thumbnail', methods=['GET'])
+@admitted(pools['outbound'])
+@jwt_authenticated
+@user_authenticated(db)
+def getThumbnail(book_id):
+    """
+        getThumbnail() : Cover image for this book (by ISBN), served from the
+        local thumbnail cache. 'size' may be 'small', 'medium' (default) or
+        'large'. Supports conditional requests via ETag.
+    """
+    size = request.args.get('size', default='medium')
+    if size not in ThumbnailCache.SIZES:
+        return "Unknown size '%s'" % size, 400
+    try:
+        book = LocalBookService(db).getBook(book_id)
+    except NotFoundException:
+        return "Book with ID '%s' not found" % book_id, 404
+    if not book.thumbnail:
+        return "Book with ID '%s' has no thumbnail" % book_id, 404
+
+    try:
+        data, etag = thumbnails.get(book.thumbnail, size)
+    except NotFoundException:
+        return "Book with ID '%s' has no thumbnail" % book_id, 404
+    except (requests.RequestException, InvalidImageException):
+        return "Could not fetch thumbnail", 502
+    except DeadlineExceededException:
+        return "Timed out fetching thumbnail", 504
+    resp = Response(data, mimetype='image/jpeg')
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 30 * 24 * 60 * 60
+    return resp.make_conditional(request)
+
+@app.route('/v0/books/<book_id>/stats', methods=['GET'])
+@admitted(pools['cheap'])
+@jwt_authenticated
+@user_authenticated(db)
+def getBookStats(book_id):
+    """
+        getBookStats() : Circulation counters for this book: number of
+        checkouts, total and average loan duration, and last activity.
+    """
+    stats = LocalBookService(db).getBookStats(book_id)
+    return jsonify(asdict(stats)), 200
+
+@app.route('/v0/export', methods=['GET'])
+@admitted(pools['expensive'])
+@jwt_authenticated
+@user_authenticated(db)
+def exportBooks():
+    """
+        exportBooks() : Download a full copy of a library: every book with its
+        current status and complete history. 'format' may be 'csv' (default)
+        or 'ndjson'. Exports the library of user_id, or of the calling user
+        if user_id is not specified. The response is streamed as it's read.
+    """
+    fmt = request.args.get('format', default='csv')
+    if fmt not in FORMATS:
+        return "Unsupported format '%s'" % fmt, 400
+    mimetype, ext, writer = FORMATS[fmt]
+
+    user_id = request.args.get('user_id', default=request.user.id)
+    rows = LocalBookService(db).exportBooks(user_id)
+    headers = {'Content-Disposition': 'attachment; filename=library.%s' % ext}
+    return Response(stream_with_context(writer(rows)), mimetype=mimetype,
+                    headers=headers)
+
 # Users API
 @app.route('/v0/users/<int:user_id>', methods=['GET'])
+@admitted(pools['cheap'])
 @jwt_authenticated
 @user_authenticated(db)
 def getUser(user_id):
@@ -166,17 +464,24 @@ def getUser(user_id):
     return jsonify(user), 200
 
 @app.route('/v0/users', methods=['GET'])
+@admitted(pools['cheap'])
 @jwt_authenticated
 @user_authenticated(db)
 def listUsers():
     """
-        listUsers() : List all users.
+        listUsers() : List all users. If 'prefix' is specified, returns only
+        users whose name (or any word of it) starts with 'prefix'. If
+        'compact' is 1, returns only the 'user_id' and 'name' of each user.
     """
-    users = LocalUserService(db).listUsers()
+    prefix = request.args.get('prefix')
+    users = LocalUserService(db, users_dir).listUsers(prefix)
 
+    if bool(int(request.args.get('compact', 0))):
+        return jsonify([{'user_id': u.user_id, 'name': u.name} for u in users]), 200
     return jsonify(list(map(asdict, users))), 200
 
 @app.route('/v0/users/<int:user_id>', methods=['PATCH'])
+@admitted(pools['write'])
 @jwt_authenticated
 @user_authenticated(db)
 def updateUser(user_id):
@@ -193,10 +498,11 @@ def updateUser(user_id):
     except KeyError:
         return "Missing property", 400
     else:
-        LocalUserService(db).updateUser(user_id, name)
+        LocalUserService(db, users_dir).updateUser(user_id, name)
         return "User updated", 200
 
 @app.route('/v0/users/<int:user_id>/history', methods=['GET'])
+@admitted(pools['expensive'])
 @jwt_authenticated
 @user_authenticated(db)
 def listUserCheckoutHistory(user_id):
@@ -207,19 +513,35 @@ def listUserCheckoutHistory(user_id):
     logs = LocalBookService(db).listUserCheckoutHistory(user_id)
     return jsonify(list(map(asdict, logs))), 200
 
+@app.route('/v0/users/<int:user_id>/stats', methods=['GET'])
+@admitted(pools['cheap'])
+@jwt_authenticated
+@user_authenticated(db)
+def getUserStats(user_id):
+    """
+        getUserStats() : Circulation counters for this user: number of
+        checkouts, total and average loan duration, and last activity.
+    """
+    stats = LocalBookService(db).getUserStats(user_id)
+    return jsonify(asdict(stats)), 200
+
 # Lookup API
 @app.route('/v0/lookup/<isbn>', methods=['GET'])
+@admitted(pools['lookup'])
 @jwt_authenticated
 @user_authenticated(db)
 def lookupBookDetails(isbn):
     """
-        lookupBookDetails() : Fetch details on this book from Google Books API
+        lookupBookDetails() : Fetch details on this book from the configured
+        lookup providers (Google Books, then Open Library)
     """
-    lookup = LookupService(KeyManager())
+    lookup = LookupService(keys)
     try:
         book = lookup.lookupIsbn(isbn)
     except NotFoundException:
         return "No books found with ISBN %s" % isbn, 404
+    except requests.RequestException:
+        return "Book lookup is unavailable", 502
     return jsonify(asdict(book)), 200
 
 
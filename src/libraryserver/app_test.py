@@ -3,6 +3,7 @@ import json
 import os
 import requests
 import unittest
+from unittest import mock
 
 # must be done before project imports
 # TODO: maybe start emulator here?
@@ -10,7 +11,7 @@ LOCAL_EMULATOR = "localhost:8287"
 os.environ["FIRESTORE_EMULATOR_HOST"] = LOCAL_EMULATOR
 
 from libraryserver.storage.firestore_client import Database
-from libraryserver.app import app
+from libraryserver.app import app, warmup
 
 class TestApp(unittest.TestCase):
 
@@ -26,6 +27,36 @@ class TestApp(unittest.TestCase):
         )
         requests.delete(del_url)
 
+    # Meta-API
+    def test_ready(self):
+        warmup.join(30)
+
+        res = self.client.get("/v0/ready")
+
+        data = json.loads(res.data.decode('UTF-8'))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['ready'], True)
+
+    def test_admissionPools(self):
+        expected = {
+            'check': 'cheap', 'streamEvents': 'stream', 'getBook': 'cheap',
+            'getBooks': 'expensive', 'listBookChanges': 'expensive',
+            'suggestBooks': 'cheap', 'listBooks': 'expensive',
+            'listLoans': 'expensive', 'getRankings': 'cheap',
+            'searchCatalog': 'expensive', 'createBook': 'write',
+            'checkoutBook': 'write', 'returnBook': 'write',
+            'listBookCheckoutHistory': 'expensive', 'getThumbnail': 'outbound',
+            'getBookStats': 'cheap', 'exportBooks': 'expensive',
+            'getUser': 'cheap', 'listUsers': 'cheap', 'updateUser': 'write',
+            'listUserCheckoutHistory': 'expensive', 'getUserStats': 'cheap',
+            'lookupBookDetails': 'lookup',
+        }
+        pools = {name: view.admission_pool.name
+                 for name, view in app.view_functions.items()
+                 if hasattr(view, 'admission_pool')}
+
+        self.assertEqual(pools, expected)
+
     # Books API
     def test_getBook_exists(self):
         self.db.putBook('1234', 'A Book', 'Somebody', 'cat', 'year', 'img')
@@ -60,6 +91,31 @@ class TestApp(unittest.TestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['title'], 'Sequel')
 
+    def test_createBook_readBackByOwner(self):
+        self.db.putUser(1234, 'owner', 'owner-email')
+        self.db.setUserTokenUid(1234, 'owner-uid')
+        # A copy in another library, created before owner IDs were ints
+        self.db.books_ref.document('legacy').set({
+            'isbn': '9780062060624', 'owner_id': '5678', 'title': 'Theirs',
+            'author': '', 'category': '', 'year': '', 'img': ''})
+        headers = {'Authorization': 'Bearer token'}
+        book = {'isbn': '9780062060624', 'title': 'Mine', 'author': 'R.F. Kuang',
+                'category': 'Fiction', 'year': '2022', 'thumbnail': ''}
+
+        with mock.patch('firebase_admin.auth.verify_id_token',
+                        return_value={'uid': 'owner-uid'}):
+            self.client.post("/v0/books", json={'book': book}, headers=headers)
+            res = self.client.get("/v0/books/9780062060624", headers=headers)
+
+        data = json.loads(res.data.decode('UTF-8'))
+        self.assertEqual(data['title'], 'Mine')
+        self.assertEqual(data['owner_id'], 1234)
+        # Found by the query used for books that haven't been rekeyed
+        self.assertEqual([b.get('title') for b in self.db._queryBooks('9780062060624', 1234)],
+                         ['Mine'])
+        self.assertEqual([b.id for b in self.db._queryBooks('9780062060624', 5678)],
+                         ['legacy'])
+
     # Users API
     def test_listUserCheckoutHistory(self):
         self.db.putBook('1234', 'A Book', 'Somebody', 'cat', 'year', 'img')
@@ -5,6 +5,7 @@ from flask import request, Response
 from functools import wraps
 from typing import TypeVar
 
+from libraryserver.api.errors import AlreadyExistsException
 from libraryserver.storage.firestore_client import Database
 
 
@@ -30,7 +31,10 @@ def user_authenticated(db: Database):
                 user = db.getUserByEmail(email)
                 if user is None:
                     return Response(status=403, response=f"No user with email {email}")
-                db.setUserTokenUid(user.id, uid)
+                try:
+                    db.setUserTokenUid(user.id, uid)
+                except AlreadyExistsException:
+                    return Response(status=403, response="Account already linked to another user")
 
             request.user = user
             return func(*args, **kwargs)
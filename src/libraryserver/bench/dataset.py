@@ -0,0 +1,216 @@
+"""Generates a synthetic library (users, books and their checkout history)
+and loads it into the Firestore emulator, for load testing.
+
+Every book gets a realistic log chain: a CREATE, then checkouts each
+followed by a return some days later, spread over the past `history_days`.
+Some books end the chain still checked out. Stats counters, the out-book
+index, the catalog and the user index are filled in to match, so every route
+sees the data as if it had built up through the API.
+
+    python -m libraryserver.bench.dataset --users 50 --books-per-owner 200 \\
+        --loans-per-book 10 --reset
+"""
+
+import argparse
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+import logging
+import os
+import random
+
+import requests
+
+from libraryserver.api.models import Action
+from libraryserver.constants import MIN_USER_ID, MAX_USER_ID
+from libraryserver.isbn import bookKey, toIsbn13
+from libraryserver.search import catalog
+from libraryserver.storage.firestore_client import Database, connect
+
+# Token UIDs of generated users are this plus the user ID
+TOKEN_UID_PREFIX = 'load-'
+
+_FIRST_NAMES = ['Ada', 'Brian', 'Chidi', 'Dana', 'Elena', 'Farid', 'Grace',
+                'Hiro', 'Ines', 'Jonas', 'Kemi', 'Luis', 'Mira', 'Nadia']
+_LAST_NAMES = ['Abbott', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia',
+               'Haddad', 'Ito', 'Jensen', 'Kowalski', 'Lopez', 'Moreau']
+_TITLE_WORDS = ['secret', 'history', 'river', 'night', 'garden', 'empire',
+                'silent', 'glass', 'winter', 'machine', 'ocean', 'stranger',
+                'city', 'light', 'fire', 'kingdom', 'letters', 'memory',
+                'station', 'orchard', 'atlas', 'harbor', 'echo', 'summer']
+_CATEGORIES = ['Fiction', 'History', 'Science', 'Fantasy', 'Biography',
+               'Poetry', 'Travel', 'Cooking']
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Dataset:
+    users: list[dict]  # user_id, name, email, token_uid
+    books: list[dict]  # book_id plus the fields of a book document
+    logs: list[dict]  # book_id, timestamp, action, user_id; oldest first per book
+
+
+def _randomIsbn(rng: random.Random) -> str:
+    digits = '978' + ''.join(rng.choice('0123456789') for _ in range(9))
+    return next(digits + d for d in '0123456789' if toIsbn13(digits + d))
+
+
+def generate(users: int, books_per_owner: int, loans_per_book: int,
+             seed: int = 0, now: datetime|None = None,
+             history_days: int = 365) -> Dataset:
+    """Generates `users` users, each owning `books_per_owner` books with up to
+    `loans_per_book` loans each. The same seed always gives the same data.
+    About half of all books are also owned by someone else, so the catalog has
+    shared entries.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(UTC)
+    start = now - timedelta(days=history_days)
+
+    user_ids = rng.sample(range(MIN_USER_ID, MAX_USER_ID + 1), users)
+    user_list = [{
+        'user_id': user_id,
+        'name': '%s %s' % (rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)),
+        'email': 'load%d@example.com' % user_id,
+        'token_uid': TOKEN_UID_PREFIX + str(user_id)
+    } for user_id in user_ids]
+
+    pool = []
+    for _ in range(max(books_per_owner, users * books_per_owner // 2)):
+        words = rng.sample(_TITLE_WORDS, rng.randint(1, 3))
+        pool.append({
+            'isbn': _randomIsbn(rng),
+            'title': 'The ' + ' '.join(w.capitalize() for w in words),
+            'author': '%s %s' % (rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)),
+            'category': rng.choice(_CATEGORIES),
+            'year': str(rng.randint(1950, 2024)),
+            'img': ''
+        })
+
+    books, logs = [], []
+    for owner_id in user_ids:
+        borrowers = [u for u in user_ids if u != owner_id] or [owner_id]
+        for details in rng.sample(pool, books_per_owner):
+            book_id = bookKey(owner_id, details['isbn'])
+            books.append(dict(details, book_id=book_id, owner_id=owner_id,
+                              copy=1, copies=1))
+            t = start + timedelta(seconds=rng.uniform(0, history_days * 86400 / 2))
+            logs.append({'book_id': book_id, 'timestamp': t,
+                         'action': Action.CREATE, 'user_id': 0})
+            for _ in range(rng.randint(0, loans_per_book)):
+                t += timedelta(days=rng.uniform(0.5, 20))
+                if t >= now:
+                    break
+                borrower = rng.choice(borrowers)
+                logs.append({'book_id': book_id, 'timestamp': t,
+                             'action': Action.CHECKOUT, 'user_id': borrower})
+                t += timedelta(days=rng.uniform(1, 30))
+                if t >= now:
+                    break  # Still out
+                logs.append({'book_id': book_id, 'timestamp': t,
+                             'action': Action.RETURN, 'user_id': borrower})
+    return Dataset(user_list, books, logs)
+
+
+def load(db: Database, dataset: Dataset, batch_size: int = 500):
+    """Writes `dataset` to Firestore, as the API would have left it."""
+    # Users go through the Database, which maintains their index claims and
+    # the users version along with them
+    for user in dataset.users:
+        db.putUser(user['user_id'], user['name'], user['email'])
+        db.setUserTokenUid(user['user_id'], user['token_uid'])
+
+    writes = []
+
+    books = {}
+    for book in dataset.books:
+        vals = {k: v for k, v in book.items() if k != 'book_id'}
+        books[book['book_id']] = vals
+        writes.append((db.books_ref.document(book['book_id']), vals))
+
+    by_book = defaultdict(list)
+    for log in dataset.logs:
+        by_book[log['book_id']].append(log)
+        writes.append((db.logs_ref.document(), {
+            'book_id': log['book_id'], 'timestamp': log['timestamp'],
+            'action': log['action'].value, 'user_id': log['user_id'],
+            'owner_id': int(books[log['book_id']]['owner_id'])}))
+
+    book_stats = defaultdict(lambda: {'checkouts': 0, 'returns': 0, 'total_loan_secs': 0})
+    user_stats = defaultdict(lambda: {'checkouts': 0, 'returns': 0, 'total_loan_secs': 0})
+    entries = {}
+    for book_id, chain in by_book.items():
+        book = books[book_id]
+        checkout = None
+        for log in chain:
+            stats = [book_stats[book_id], user_stats[str(log['user_id'])]]
+            if log['action'] == Action.CHECKOUT:
+                checkout = log
+                for s in stats:
+                    s['checkouts'] += 1
+                    s['last_activity'] = log['timestamp']
+            elif log['action'] == Action.RETURN:
+                loan_secs = (log['timestamp'] - checkout['timestamp']).total_seconds()
+                for s in stats:
+                    s['returns'] += 1
+                    s['total_loan_secs'] += loan_secs
+                    s['last_activity'] = log['timestamp']
+                checkout = None
+        is_out = checkout is not None
+        if is_out:
+            writes.append((db.outbooks_ref.document(book_id), {
+                'owner_id': book['owner_id'], 'isbn': book['isbn'],
+                'title': book['title'], 'author': book['author'],
+                'user_id': checkout['user_id'],
+                'checkout_time': checkout['timestamp'], 'reminded': None}))
+        entry = entries.setdefault(book['isbn'], {
+            'isbn': book['isbn'], 'title': book['title'], 'author': book['author'],
+            'tokens': catalog.catalogTokens(book['title'], book['author']),
+            'copies': {}})
+        entry['copies'][book_id] = {'owner_id': book['owner_id'], 'is_out': is_out}
+
+    for book_id, stats in book_stats.items():
+        if stats['checkouts']:
+            writes.append((db.bookstats_ref.document(book_id), stats))
+    for user_id, stats in user_stats.items():
+        if stats['checkouts']:
+            writes.append((db.userstats_ref.document(user_id), stats))
+    for isbn, entry in entries.items():
+        writes.append((db.catalog_ref.document(isbn), entry))
+
+    for i in range(0, len(writes), batch_size):
+        batch = db.cli.batch()
+        for ref, vals in writes[i:i + batch_size]:
+            batch.set(ref, vals)
+        batch.commit()
+    # Every checked-out book above has its outbooks entry
+    db.markOutBooksComplete()
+    logger.info('Wrote %d users and %d other documents', len(dataset.users), len(writes))
+
+
+def resetEmulator(project: str = 'demo-project'):
+    """Deletes everything in the Firestore emulator."""
+    host = os.environ['FIRESTORE_EMULATOR_HOST']
+    requests.delete('http://%s/emulator/v1/projects/%s/databases/(default)/documents'
+                    % (host, project)).raise_for_status()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--books-per-owner', type=int, default=100)
+    parser.add_argument('--loans-per-book', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reset', action='store_true',
+                        help='clear the emulator before loading')
+    args = parser.parse_args()
+
+    if 'FIRESTORE_EMULATOR_HOST' not in os.environ:
+        parser.error('FIRESTORE_EMULATOR_HOST must be set; this only loads into the emulator')
+    logging.basicConfig(level=logging.INFO)
+    if args.reset:
+        resetEmulator()
+    data = generate(args.users, args.books_per_owner, args.loans_per_book, args.seed)
+    load(Database(connect()), data)
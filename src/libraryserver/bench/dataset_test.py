@@ -0,0 +1,84 @@
+from datetime import datetime, UTC
+import unittest
+from unittest import mock
+
+from libraryserver.api.models import Action
+from libraryserver.bench.dataset import generate, load
+from libraryserver.constants import MIN_USER_ID, MAX_USER_ID
+from libraryserver.isbn import bookKey, toIsbn13
+
+NOW = datetime(2024, 6, 1, tzinfo=UTC)
+
+
+class TestGenerate(unittest.TestCase):
+
+    def test_sizes(self):
+        data = generate(5, 10, 3, now=NOW)
+
+        self.assertEqual(len(data.users), 5)
+        self.assertEqual(len(data.books), 50)
+        for user in data.users:
+            self.assertTrue(MIN_USER_ID <= user['user_id'] <= MAX_USER_ID)
+
+    def test_deterministic(self):
+        self.assertEqual(generate(3, 5, 3, seed=7, now=NOW),
+                         generate(3, 5, 3, seed=7, now=NOW))
+        self.assertNotEqual(generate(3, 5, 3, seed=7, now=NOW).books,
+                            generate(3, 5, 3, seed=8, now=NOW).books)
+
+    def test_booksKeyedByOwnerAndIsbn(self):
+        data = generate(3, 10, 0, now=NOW)
+
+        for book in data.books:
+            self.assertIsNotNone(toIsbn13(book['isbn']))
+            self.assertEqual(book['book_id'], bookKey(book['owner_id'], book['isbn']))
+        self.assertEqual(len({b['book_id'] for b in data.books}), 30)
+
+    def test_logChains(self):
+        data = generate(4, 20, 5, now=NOW)
+        chains = {}
+        for log in data.logs:
+            chains.setdefault(log['book_id'], []).append(log)
+
+        self.assertEqual(len(chains), 80)
+        for chain in chains.values():
+            self.assertEqual(chain[0]['action'], Action.CREATE)
+            times = [log['timestamp'] for log in chain]
+            self.assertEqual(times, sorted(times))
+            self.assertLess(times[-1], NOW)
+            # Checkouts and returns alternate, each return by the borrower
+            for prev, log in zip(chain[1:], chain[2:]):
+                self.assertNotEqual(prev['action'], log['action'])
+                if log['action'] == Action.RETURN:
+                    self.assertEqual(prev['user_id'], log['user_id'])
+            self.assertLessEqual(len(chain), 11)
+
+    def test_historyHasLoans(self):
+        data = generate(4, 20, 5, now=NOW)
+
+        actions = {log['action'] for log in data.logs}
+
+        self.assertIn(Action.CHECKOUT, actions)
+        self.assertIn(Action.RETURN, actions)
+
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_usersGoThroughDatabase(self):
+        data = generate(2, 1, 1, now=NOW)
+        db = mock.MagicMock()
+
+        load(db, data)
+
+        self.assertCountEqual(
+            [c.args for c in db.putUser.call_args_list],
+            [(u['user_id'], u['name'], u['email']) for u in data.users])
+        self.assertCountEqual(
+            [c.args for c in db.setUserTokenUid.call_args_list],
+            [(u['user_id'], u['token_uid']) for u in data.users])
+        db.markOutBooksComplete.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
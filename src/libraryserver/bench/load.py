@@ -0,0 +1,196 @@
+"""Load test: measures how the read routes scale with the amount of data.
+
+For each size given by --books-per-owner, clears the Firestore emulator,
+loads a synthetic dataset of that size (see bench.dataset), and sends
+--requests requests from a fixed mix of read routes with --concurrency in
+flight. Reports throughput and latency percentiles per route at each size,
+then the scaling curves (each of those by size). Save the results with
+--save and pass them to a later run with --compare to track releases.
+
+The server under test must use the same emulators, with
+FIREBASE_AUTH_EMULATOR_HOST set so that it accepts the unsigned tokens sent
+here. Restart it between runs if it replicates reads (ReplicateReads), as
+clearing the emulator doesn't reach its replica.
+
+    python -m libraryserver.bench.load --base-url http://localhost:8080 \\
+        --users 20 --books-per-owner 10,100,1000 --save after.json
+"""
+
+import argparse
+import base64
+from collections.abc import Callable
+import json
+import logging
+import os
+import random
+import time
+
+from libraryserver.bench.dataset import Dataset, generate, load, resetEmulator
+from libraryserver.bench.replay import httpSender, replay
+from libraryserver.bench.stats import formatTable
+from libraryserver.storage.firestore_client import Database, connect
+
+logger = logging.getLogger(__name__)
+
+
+def _entry(route: str, path: str, caller: int, query: str = '') -> dict:
+    # Shaped like an access log entry, so bench.replay can send it
+    return {'time': 0, 'method': 'GET', 'route': route, 'path': path,
+            'query': query, 'body': None, 'caller': caller}
+
+
+def _listBooks(rng, data):
+    return _entry('/v0/books', '/v0/books', rng.choice(data.users)['user_id'])
+
+
+def _searchBooks(rng, data):
+    book = rng.choice(data.books)
+    word = rng.choice(book['title'].split()[1:])
+    return _entry('/v0/books?query', '/v0/books', book['owner_id'], 'query=%s' % word)
+
+
+def _getBook(rng, data):
+    book = rng.choice(data.books)
+    return _entry('/v0/books/<book_id>', '/v0/books/%s' % book['isbn'],
+                  book['owner_id'])
+
+
+def _bookHistory(rng, data):
+    book = rng.choice(data.books)
+    return _entry('/v0/books/<book_id>/history',
+                  '/v0/books/%s/history' % book['book_id'], book['owner_id'])
+
+
+def _userHistory(rng, data):
+    user_id = rng.choice(data.users)['user_id']
+    return _entry('/v0/users/<int:user_id>/history',
+                  '/v0/users/%d/history' % user_id, user_id)
+
+
+def _searchCatalog(rng, data):
+    word = rng.choice(rng.choice(data.books)['title'].split()[1:])
+    return _entry('/v0/catalog', '/v0/catalog', rng.choice(data.users)['user_id'],
+                  'query=%s' % word)
+
+
+def _listLoans(rng, data):
+    return _entry('/v0/loans', '/v0/loans', rng.choice(data.users)['user_id'])
+
+
+# (weight, request generator). Read-only, so every run sees the same data.
+ROUTE_MIX: list[tuple[int, Callable[[random.Random, Dataset], dict]]] = [
+    (30, _listBooks),
+    (15, _searchBooks),
+    (20, _getBook),
+    (10, _bookHistory),
+    (10, _userHistory),
+    (10, _searchCatalog),
+    (5, _listLoans),
+]
+
+
+def requestMix(data: Dataset, count: int, seed: int = 0) -> list[dict]:
+    """Generates `count` requests against `data`, drawn from ROUTE_MIX."""
+    rng = random.Random(seed)
+    weights = [w for w, _ in ROUTE_MIX]
+    makers = rng.choices([m for _, m in ROUTE_MIX], weights=weights, k=count)
+    return [make(rng, data) for make in makers]
+
+
+def emulatorToken(uid: str, project: str = 'demo-project') -> str:
+    """Returns an unsigned ID token for `uid`, which the Auth emulator (and a
+    server using it) accepts.
+    """
+    def encode(vals: dict) -> str:
+        raw = json.dumps(vals, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+    now = int(time.time())
+    claims = {
+        'iss': 'https://securetoken.google.com/%s' % project, 'aud': project,
+        'sub': uid, 'user_id': uid, 'iat': now, 'auth_time': now,
+        'exp': now + 3600, 'firebase': {'sign_in_provider': 'custom'}
+    }
+    return '%s.%s.' % (encode({'alg': 'none', 'typ': 'JWT'}), encode(claims))
+
+
+def formatCurves(results: dict[str, dict[str, dict]], metric: str) -> str:
+    """Formats one metric (e.g. 'p99_ms') of each route's summary across
+    dataset sizes, as a table with a column per size.
+    """
+    sizes = sorted(results, key=int)
+    routes = sorted({route for summaries in results.values() for route in summaries})
+    lines = ['%-45s' % metric + ''.join(' %10s' % size for size in sizes)]
+    for route in routes:
+        cells = []
+        for size in sizes:
+            row = results[size].get(route)
+            cells.append(' %10.1f' % row[metric] if row else ' %10s' % '-')
+        lines.append('%-45s' % route[:45] + ''.join(cells))
+    return '\n'.join(lines)
+
+
+def runSize(db: Database, base_url: str, users: int, books_per_owner: int,
+            loans_per_book: int, requests: int, concurrency: int,
+            warmup: int, project: str, seed: int = 0) -> dict[str, dict]:
+    """Loads a fresh dataset of this size and runs the route mix against it.
+    Returns the per-route summaries.
+    """
+    resetEmulator(project)
+    data = generate(users, books_per_owner, loans_per_book, seed)
+    load(db, data)
+    tokens = {str(u['user_id']): emulatorToken(u['token_uid'], project)
+              for u in data.users}
+    send = httpSender(base_url, tokens)
+
+    if warmup:
+        replay(requestMix(data, warmup, seed + 1), send, 0, concurrency)
+    return replay(requestMix(data, requests, seed), send, 0, concurrency)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8080')
+    parser.add_argument('--project', default='demo-project')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--books-per-owner', default='10,100,1000',
+                        help='comma-separated dataset sizes to test')
+    parser.add_argument('--loans-per-book', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='requests to send at each size')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='unmeasured requests to send first at each size')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='results saved by an earlier run, to diff against')
+    args = parser.parse_args()
+
+    if 'FIRESTORE_EMULATOR_HOST' not in os.environ:
+        parser.error('FIRESTORE_EMULATOR_HOST must be set; this clears the database')
+    logging.basicConfig(level=logging.INFO)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['sizes']
+
+    db = Database(connect())
+    results = {}
+    for size in args.books_per_owner.split(','):
+        size = size.strip()
+        logger.info('Testing %s users x %s books', args.users, size)
+        results[size] = runSize(db, args.base_url, args.users, int(size),
+                                args.loans_per_book, args.requests,
+                                args.concurrency, args.warmup, args.project,
+                                args.seed)
+        print('\n%s books per owner' % size)
+        print(formatTable(results[size], baseline.get(size)))
+
+    for metric in ['rps', 'p50_ms', 'p95_ms', 'p99_ms']:
+        print()
+        print(formatCurves(results, metric))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'users': args.users, 'loans_per_book': args.loans_per_book,
+                       'sizes': results}, f, indent=2)
@@ -0,0 +1,55 @@
+import base64
+import json
+import unittest
+
+from libraryserver.bench.dataset import generate
+from libraryserver.bench.load import emulatorToken, formatCurves, requestMix
+from libraryserver.bench.replay import routeKey
+from libraryserver.bench.stats import summarize
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_requestMix(self):
+        data = generate(3, 10, 2)
+        owners = {u['user_id'] for u in data.users}
+
+        entries = requestMix(data, 500)
+
+        self.assertEqual(len(entries), 500)
+        routes = {routeKey(e) for e in entries}
+        self.assertIn('GET /v0/books', routes)
+        self.assertIn('GET /v0/books/<book_id>/history', routes)
+        for e in entries:
+            self.assertIn(e['caller'], owners)
+            self.assertTrue(e['path'].startswith('/v0/'))
+
+    def test_requestMix_deterministic(self):
+        data = generate(3, 10, 2)
+
+        self.assertEqual(requestMix(data, 50, seed=1), requestMix(data, 50, seed=1))
+
+    def test_emulatorToken(self):
+        header, payload, signature = emulatorToken('load-123', 'proj').split('.')
+
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        self.assertEqual(signature, '')
+        self.assertEqual(claims['sub'], 'load-123')
+        self.assertEqual(claims['aud'], 'proj')
+
+    def test_formatCurves(self):
+        results = {
+            '10': {'GET /v0/books': summarize([5, 5], 1)},
+            '100': {'GET /v0/books': summarize([50, 50], 1),
+                    'GET /v0/loans': summarize([7], 1)},
+        }
+
+        lines = formatCurves(results, 'p50_ms').split('\n')
+
+        self.assertEqual(lines[0].split(), ['p50_ms', '10', '100'])
+        self.assertEqual(lines[1].split(), ['GET', '/v0/books', '5.0', '50.0'])
+        self.assertEqual(lines[2].split(), ['GET', '/v0/loans', '-', '7.0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
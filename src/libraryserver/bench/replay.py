@@ -0,0 +1,164 @@
+"""Replays a captured access log against a running server, and reports
+throughput and latency percentiles per route.
+
+The access log is what the app writes to its configured LogPath. Replay it
+against a local instance backed by the Firestore emulator, never against
+production, since writes (checkouts, new books) are replayed too. Writes
+are only replayed with their bodies if the log was captured with
+AccessLogBodies on:
+
+    python -m libraryserver.bench.replay library.log \\
+        --base-url http://localhost:8080 --tokens tokens.json --speed 4 \\
+        --save after.json --compare before.json
+
+`--tokens` maps each caller's user ID to an ID token to send on their
+behalf (with the auth emulator, any unsigned token for that user works);
+`--token` sends the same token for everyone.
+"""
+
+import argparse
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from libraryserver.bench.stats import formatTable, summarize
+
+# Summary key for all routes combined
+ALL_ROUTES = '*'
+
+logger = logging.getLogger(__name__)
+
+
+def loadLog(path: str) -> list[dict]:
+    """Reads access log entries from `path`, oldest first. Lines that aren't
+    access log entries are skipped.
+    """
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and 'path' in entry and 'time' in entry:
+                entries.append(entry)
+    entries.sort(key=lambda e: e['time'])
+    return entries
+
+
+def schedule(entries: list[dict], speed: float) -> list[tuple[float, dict]]:
+    """Pairs each entry with when to send it, in seconds from the start of the
+    replay. `speed` scales the original gaps (2 replays twice as fast); 0
+    sends everything at once.
+    """
+    if not entries:
+        return []
+    start = entries[0]['time']
+    return [((e['time'] - start) / speed if speed > 0 else 0, e) for e in entries]
+
+
+def routeKey(entry: dict) -> str:
+    return '%s %s' % (entry['method'], entry.get('route') or entry['path'])
+
+
+def replay(entries: list[dict], send: Callable[[dict], int],
+           speed: float = 1, concurrency: int = 16) -> dict[str, dict]:
+    """Sends every entry with `send` (which returns the response status) on
+    the original schedule, scaled by `speed`. Returns a summary per route,
+    plus one for ALL_ROUTES.
+    """
+    lock = threading.Lock()
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+
+    def run(entry: dict):
+        key = routeKey(entry)
+        start = time.monotonic()
+        try:
+            failed = send(entry) >= 500
+        except requests.RequestException as e:
+            logger.debug('%s failed: %s', key, e)
+            failed = True
+        latency = (time.monotonic() - start) * 1000
+        with lock:
+            latencies.setdefault(key, []).append(latency)
+            errors[key] = errors.get(key, 0) + failed
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, entry in schedule(entries, speed):
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, entry)
+    elapsed = time.monotonic() - start
+
+    summaries = {key: summarize(lat, elapsed, errors[key])
+                 for key, lat in latencies.items()}
+    summaries[ALL_ROUTES] = summarize(
+        [l for lat in latencies.values() for l in lat], elapsed,
+        sum(errors.values()))
+    return summaries
+
+
+def httpSender(base_url: str, tokens: dict[str, str],
+               default_token: str|None = None,
+               timeout: float = 30) -> Callable[[dict], int]:
+    """Returns a `send` function for `replay` that re-sends entries to the
+    server at `base_url`, authenticated as the original caller.
+    """
+    session = requests.Session()
+
+    def send(entry: dict) -> int:
+        url = base_url.rstrip('/') + entry['path']
+        if entry.get('query'):
+            url += '?' + entry['query']
+        headers = {}
+        token = tokens.get(str(entry.get('caller')), default_token)
+        if token:
+            headers['Authorization'] = 'Bearer %s' % token
+        resp = session.request(entry['method'], url, json=entry.get('body'),
+                               headers=headers, timeout=timeout)
+        return resp.status_code
+
+    return send
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='access log to replay')
+    parser.add_argument('--base-url', default='http://localhost:8080')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='replay speed relative to the original (0 = all at once)')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='maximum requests in flight')
+    parser.add_argument('--token', help='ID token to send for every caller')
+    parser.add_argument('--tokens', help='JSON file mapping user IDs to ID tokens')
+    parser.add_argument('--save', help='write the per-route summaries to this JSON file')
+    parser.add_argument('--compare', help='summaries saved by an earlier run, to diff against')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tokens = {}
+    if args.tokens:
+        with open(args.tokens) as f:
+            tokens = json.load(f)
+    entries = loadLog(args.log)
+    logger.info('Replaying %d requests', len(entries))
+    summaries = replay(entries, httpSender(args.base_url, tokens, args.token),
+                       args.speed, args.concurrency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(formatTable(summaries, baseline))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summaries, f, indent=2)
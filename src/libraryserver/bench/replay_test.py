@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import unittest
+
+import requests
+
+from libraryserver.bench.replay import ALL_ROUTES, loadLog, replay, schedule
+
+
+def entry(t, path, route=None, method='GET'):
+    return {'time': t, 'method': method, 'path': path, 'route': route,
+            'query': '', 'body': None, 'caller': '1234'}
+
+
+class TestReplay(unittest.TestCase):
+
+    def test_loadLog_sortsAndSkipsOtherLines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'access.log')
+            with open(path, 'w') as f:
+                f.write(json.dumps(entry(2, '/b')) + '\n')
+                f.write('Some other log line\n')
+                f.write(json.dumps(entry(1, '/a')) + '\n')
+
+            res = loadLog(path)
+
+        self.assertEqual([e['path'] for e in res], ['/a', '/b'])
+
+    def test_schedule_scalesGaps(self):
+        entries = [entry(100, '/a'), entry(102, '/b'), entry(106, '/c')]
+
+        self.assertEqual([t for t, _ in schedule(entries, 1)], [0, 2, 6])
+        self.assertEqual([t for t, _ in schedule(entries, 2)], [0, 1, 3])
+        self.assertEqual([t for t, _ in schedule(entries, 0)], [0, 0, 0])
+
+    def test_replay_groupsByRoute(self):
+        entries = [entry(0, '/v0/books/1', '/v0/books/<book_id>'),
+                   entry(0, '/v0/books/2', '/v0/books/<book_id>'),
+                   entry(0, '/v0/check', '/v0/check')]
+        sent = []
+        def send(e):
+            sent.append(e['path'])
+            return 200
+
+        res = replay(entries, send, speed=0)
+
+        self.assertEqual(sorted(sent), ['/v0/books/1', '/v0/books/2', '/v0/check'])
+        self.assertEqual(res['GET /v0/books/<book_id>']['count'], 2)
+        self.assertEqual(res['GET /v0/check']['count'], 1)
+        self.assertEqual(res[ALL_ROUTES]['count'], 3)
+
+    def test_replay_countsErrors(self):
+        entries = [entry(0, '/a', '/a'), entry(0, '/b', '/b')]
+        def send(e):
+            if e['path'] == '/a':
+                return 503
+            raise requests.ConnectionError()
+
+        res = replay(entries, send, speed=0)
+
+        self.assertEqual(res['GET /a']['errors'], 1)
+        self.assertEqual(res['GET /b']['errors'], 1)
+        self.assertEqual(res[ALL_ROUTES]['errors'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
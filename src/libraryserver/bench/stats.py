@@ -0,0 +1,49 @@
+"""Summary statistics shared by the benchmarking tools."""
+
+from libraryserver.quantiles import percentile
+
+
+def summarize(latencies_ms: list[float], elapsed_secs: float,
+              errors: int = 0) -> dict:
+    """Summarizes one group of requests: count, errors, throughput (requests
+    per second over `elapsed_secs`) and latency percentiles.
+    """
+    count = len(latencies_ms)
+    return {
+        "count": count,
+        "errors": errors,
+        "rps": count / elapsed_secs if elapsed_secs > 0 else 0,
+        "mean_ms": sum(latencies_ms) / count if count else 0,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "max_ms": max(latencies_ms, default=0)
+    }
+
+
+def formatTable(rows: dict[str, dict], baseline: dict[str, dict]|None = None) -> str:
+    """Formats summaries (keyed by name, e.g. route) as a text table. If
+    `baseline` summaries are given, adds the change in p50 and p99.
+    """
+    header = '%-45s %7s %6s %8s %9s %9s %9s' % (
+        'route', 'count', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms')
+    if baseline is not None:
+        header += ' %9s %9s' % ('d_p50', 'd_p99')
+    lines = [header]
+    for name in sorted(rows):
+        row = rows[name]
+        line = '%-45s %7d %6d %8.1f %9.1f %9.1f %9.1f' % (
+            name[:45], row["count"], row["errors"], row["rps"],
+            row["p50_ms"], row["p95_ms"], row["p99_ms"])
+        if baseline is not None:
+            before = baseline.get(name)
+            if before:
+                line += ' %+8.1f%% %+8.1f%%' % (
+                    _change(before["p50_ms"], row["p50_ms"]),
+                    _change(before["p99_ms"], row["p99_ms"]))
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0
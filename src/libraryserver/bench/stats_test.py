@@ -0,0 +1,29 @@
+import unittest
+
+from libraryserver.bench.stats import formatTable, summarize
+
+
+class TestStats(unittest.TestCase):
+
+    def test_summarize(self):
+        res = summarize([10, 20, 30, 40], 2, errors=1)
+
+        self.assertEqual(res['count'], 4)
+        self.assertEqual(res['errors'], 1)
+        self.assertEqual(res['rps'], 2)
+        self.assertEqual(res['mean_ms'], 25)
+        self.assertEqual(res['p50_ms'], 20)
+        self.assertEqual(res['max_ms'], 40)
+
+    def test_formatTable_withBaseline(self):
+        after = {'GET /v0/books': summarize([10, 10], 1)}
+        before = {'GET /v0/books': summarize([20, 20], 1)}
+
+        res = formatTable(after, before)
+
+        self.assertIn('GET /v0/books', res)
+        self.assertIn('-50.0%', res)
+
+
+if __name__ == '__main__':
+    unittest.main()
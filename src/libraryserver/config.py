@@ -38,10 +38,69 @@ class AppConfig:
         paths = self.config['FirestoreApiKeyPath'].split(',')
         return os.path.join(self.root, *paths)
 
+    def thumbnail_cache_dir(self):
+        paths = self.config['ThumbnailCachePath'].split(',')
+        return os.path.join(self.root, *paths)
+
+    def access_log_bodies(self):
+        return self.config.getboolean('AccessLogBodies', fallback=False)
+
+    def thumbnail_hosts(self):
+        return {host.strip().lower() for host in self.config['ThumbnailHosts'].split(',')}
+
+    def replicate_reads(self):
+        return self.config.getboolean('ReplicateReads', fallback=False)
+
+    def relay_events(self):
+        return self.config.getboolean('RelayEvents', fallback=True)
+
+    def email_coalesce_secs(self):
+        return self.config.getfloat('EmailCoalesceSecs', fallback=0)
+
+    def admission_pools(self):
+        pools = {}
+        for spec in self.config['AdmissionPools'].split(','):
+            name, limit, queue = spec.strip().split(':')
+            pools[name] = (int(limit), int(queue))
+        return pools
+
+    def admission_max_wait_secs(self):
+        return self.config.getfloat('AdmissionMaxWaitSecs', fallback=2)
+
+    def lookup_providers(self):
+        return [name.strip() for name in self.config['LookupProviders'].split(',')]
+
+    def lookup_hedge_percentile(self):
+        return self.config.getfloat('LookupHedgePercentile', fallback=95)
+
+    def offline_isbn_db(self):
+        paths = self.config['OfflineIsbnDbPath'].split(',')
+        return os.path.join(self.root, *paths)
+
+    def request_deadline_secs(self):
+        return self.config.getfloat('RequestDeadlineSecs', fallback=10)
+
+    def route_deadline_secs(self):
+        routes = {}
+        for spec in self.config.get('RouteDeadlineSecs', fallback='').split(','):
+            if spec.strip():
+                name, secs = spec.strip().split(':')
+                routes[name] = float(secs)
+        return routes
+
     def log_file(self):
         paths = self.config['LogPath'].split(',')
         return os.path.join(self.root, *paths)
 
+    def log_level(self):
+        return self.config.get('LogLevel', fallback='INFO')
+
+    def debug_log_sample_rate(self):
+        return self.config.getfloat('DebugLogSampleRate', fallback=1)
+
+    def debug_log_max_per_sec(self):
+        return self.config.getfloat('DebugLogMaxPerSec', fallback=10)
+
 
 APP_CONFIG = AppConfig()
     
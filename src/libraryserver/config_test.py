@@ -33,6 +33,25 @@ class TestConfig(unittest.TestCase):
         ac = AppConfig(override_prod=True)
         self.assertIn('library.log', ac.log_file())
 
+    def test_thumbnailHosts(self):
+        ac = AppConfig()
+        self.assertIn('covers.openlibrary.org', ac.thumbnail_hosts())
+        self.assertIn('.archive.org', ac.thumbnail_hosts())
+
+    def test_admissionPools(self):
+        ac = AppConfig()
+        pools = ac.admission_pools()
+        self.assertEqual(set(pools), {'cheap', 'expensive', 'write', 'lookup', 'outbound', 'stream'})
+        self.assertGreater(pools['cheap'][0], pools['expensive'][0])
+
+    def test_lookupProviders(self):
+        ac = AppConfig()
+        self.assertEqual(ac.lookup_providers(), ['google', 'openlibrary'])
+
+    def test_replicateReads_default(self):
+        ac = AppConfig()
+        self.assertFalse(ac.replicate_reads())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+"""Per-request time budgets.
+
+Each request gets a deadline when it starts (see `install`). Everything done
+on its behalf checks it: Database RPCs, outbound HTTP calls and lookups cut
+their timeouts down to the time that's left, and raise
+DeadlineExceededException once there's none, which the app turns into a 504.
+Work done outside a request (background threads, batch jobs) has no deadline.
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+from flask import Flask, request
+from google.api_core.exceptions import DeadlineExceeded, RetryError
+
+from libraryserver.api.errors import DeadlineExceededException
+
+# time.monotonic() by which the current request must be done, if it has a
+# deadline
+_deadline: ContextVar[float|None] = ContextVar('deadline', default=None)
+
+
+def remaining() -> float|None:
+    """Returns the seconds left before the current deadline, or None if there
+    is no deadline.
+    """
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def bound(secs: float|None) -> float|None:
+    """Returns the timeout to use for an operation that would otherwise take
+    `secs` (None meaning no limit): the smaller of that and the time left.
+    Raises DeadlineExceededException if there's no time left.
+    """
+    left = remaining()
+    if left is None:
+        return secs
+    if left <= 0:
+        raise DeadlineExceededException('Request deadline exceeded')
+    return left if secs is None else min(secs, left)
+
+
+@contextmanager
+def scope(secs: float) -> Iterator[None]:
+    """Runs the enclosed code with a deadline `secs` from now, or the current
+    deadline if that's sooner.
+    """
+    at = time.monotonic() + secs
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def install(app: Flask, default_secs: float, route_secs: dict[str, float]):
+    """Gives every request handled by `app` a deadline of `default_secs`, or
+    `route_secs[<view function name>]` if set, where 0 means none. Requests
+    that run out of time get a 504.
+    """
+
+    @app.before_request
+    def startDeadline():
+        secs = route_secs.get(request.endpoint, default_secs)
+        _deadline.set(time.monotonic() + secs if secs > 0 else None)
+
+    # Firestore raises its own errors when an RPC runs out of time
+    @app.errorhandler(DeadlineExceededException)
+    @app.errorhandler(DeadlineExceeded)
+    @app.errorhandler(RetryError)
+    def deadlineExceeded(e):
+        return "Request took too long", 504
@@ -0,0 +1,87 @@
+from flask import Flask
+import time
+import unittest
+
+from google.api_core.exceptions import DeadlineExceeded
+
+from libraryserver import deadline
+from libraryserver.api.errors import DeadlineExceededException
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_noDeadline(self):
+        self.assertIsNone(deadline.remaining())
+        self.assertFalse(deadline.expired())
+        self.assertEqual(deadline.bound(5), 5)
+        self.assertIsNone(deadline.bound(None))
+
+    def test_boundCutsToRemaining(self):
+        with deadline.scope(1):
+            self.assertLessEqual(deadline.bound(5), 1)
+            self.assertLessEqual(deadline.bound(None), 1)
+            self.assertEqual(deadline.bound(0.5), 0.5)
+
+    def test_boundRaisesWhenExpired(self):
+        with deadline.scope(0):
+            self.assertTrue(deadline.expired())
+            with self.assertRaises(DeadlineExceededException):
+                deadline.bound(5)
+
+    def test_scopeKeepsSoonerDeadline(self):
+        with deadline.scope(1):
+            with deadline.scope(60):
+                self.assertLessEqual(deadline.remaining(), 1)
+        self.assertIsNone(deadline.remaining())
+
+
+class TestInstall(unittest.TestCase):
+
+    def setUp(self):
+        app = Flask(__name__)
+        deadline.install(app, 0.05, {'unlimited': 0, 'generous': 60})
+
+        @app.route('/remaining')
+        def remaining():
+            return str(deadline.remaining())
+
+        @app.route('/unlimited')
+        def unlimited():
+            return str(deadline.remaining())
+
+        @app.route('/generous')
+        def generous():
+            return str(deadline.remaining())
+
+        @app.route('/slow')
+        def slow():
+            time.sleep(0.1)
+            deadline.bound(1)
+            return 'done'
+
+        @app.route('/firestore')
+        def firestore():
+            raise DeadlineExceeded('Deadline Exceeded')
+
+        self.client = app.test_client()
+
+    def test_defaultBudget(self):
+        self.assertLessEqual(float(self.client.get('/remaining').text), 0.05)
+
+    def test_routeBudget(self):
+        self.assertGreater(float(self.client.get('/generous').text), 50)
+
+    def test_noBudget(self):
+        self.assertEqual(self.client.get('/unlimited').text, 'None')
+
+    def test_expired(self):
+        resp = self.client.get('/slow')
+
+        self.assertEqual(resp.status_code, 504)
+
+    def test_firestoreDeadline(self):
+        self.assertEqual(self.client.get('/firestore').status_code, 504)
+
+
+if __name__ == '__main__':
+    unittest.main()
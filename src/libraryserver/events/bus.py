@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import queue
+import threading
+
+
+@dataclass(frozen=True)
+class BookEvent:
+    event_id: str  # ID of the log entry behind this event
+    book_id: str  # ID of the book that changed
+    owner_id: int  # user_id of the User whose library the book is in
+    action: str  # 'create', 'checkout' or 'return'
+    user_id: int|None  # The User who checked the book out or returned it
+    timestamp: str  # When it happened
+
+
+class Subscription:
+    """One subscriber's queue of events for one library. Dropped (and
+    closed) by the bus if the subscriber falls too far behind, rather than
+    letting it hold everyone else up.
+    """
+
+    def __init__(self, owner_id: str, max_pending: int):
+        self.owner_id = owner_id
+        self.closed = False
+        self._queue: queue.Queue[BookEvent] = queue.Queue(max_pending)
+
+    def get(self, timeout: float) -> BookEvent|None:
+        """Waits up to `timeout` seconds for the next event."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _offer(self, event: BookEvent) -> bool:
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+
+class EventBus:
+    """In-process pub/sub for book status changes, keyed by library owner.
+
+    Each event is delivered at most once, however many times it's published
+    (e.g. once locally and again by the Firestore relay). The latest
+    `history` events are kept so reconnecting clients can catch up.
+    """
+
+    MAX_PENDING = 100
+    HISTORY = 1000
+
+    def __init__(self, max_pending: int = MAX_PENDING, history: int = HISTORY):
+        self.logger = logging.getLogger(__name__)
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._recent: OrderedDict[str, BookEvent] = OrderedDict()
+        self._history = history
+
+    def publish(self, event: BookEvent) -> bool:
+        """Delivers `event` to every subscriber for its library. Returns False
+        if it had already been published.
+        """
+        with self._lock:
+            if event.event_id in self._recent:
+                return False
+            self._recent[event.event_id] = event
+            if len(self._recent) > self._history:
+                self._recent.popitem(last=False)
+            subscriptions = list(self._subscriptions.get(str(event.owner_id), ()))
+        for sub in subscriptions:
+            if not sub._offer(event):
+                self.logger.warning('Dropping slow subscriber for %s', sub.owner_id)
+                self.unsubscribe(sub)
+        return True
+
+    def subscribe(self, owner_id) -> Subscription:
+        sub = Subscription(str(owner_id), self.max_pending)
+        with self._lock:
+            self._subscriptions.setdefault(sub.owner_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscriptions.get(sub.owner_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscriptions[sub.owner_id]
+
+    def since(self, owner_id, event_id: str) -> list[BookEvent]:
+        """Returns this library's events published after `event_id`, or an
+        empty list if that event is no longer (or was never) in the history.
+        """
+        with self._lock:
+            if event_id not in self._recent:
+                return []
+            events = list(self._recent.values())
+        after = events[[e.event_id for e in events].index(event_id) + 1:]
+        return [e for e in after if str(e.owner_id) == str(owner_id)]
+
+    def subscriberCount(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscriptions.values())
@@ -0,0 +1,78 @@
+import unittest
+
+from libraryserver.events.bus import BookEvent, EventBus
+
+
+def event(event_id, owner_id=1, action='checkout'):
+    return BookEvent(event_id, 'book1', owner_id, action, 1234, '2024-01-01')
+
+
+class TestEventBus(unittest.TestCase):
+
+    def test_publish_toOwnerSubscribers(self):
+        bus = EventBus()
+        mine = bus.subscribe(1)
+        theirs = bus.subscribe(2)
+
+        bus.publish(event('e1'))
+
+        self.assertEqual(mine.get(0).event_id, 'e1')
+        self.assertIsNone(theirs.get(0))
+
+    def test_publish_ownerIdTypesMatch(self):
+        bus = EventBus()
+        sub = bus.subscribe('1')
+
+        bus.publish(event('e1', owner_id=1))
+
+        self.assertEqual(sub.get(0).event_id, 'e1')
+
+    def test_publish_dropsDuplicates(self):
+        bus = EventBus()
+        sub = bus.subscribe(1)
+
+        self.assertTrue(bus.publish(event('e1')))
+        self.assertFalse(bus.publish(event('e1')))
+
+        sub.get(0)
+        self.assertIsNone(sub.get(0))
+
+    def test_publish_dropsSlowSubscriber(self):
+        bus = EventBus(max_pending=1)
+        sub = bus.subscribe(1)
+
+        bus.publish(event('e1'))
+        bus.publish(event('e2'))
+
+        self.assertTrue(sub.closed)
+        self.assertEqual(bus.subscriberCount(), 0)
+
+    def test_unsubscribe(self):
+        bus = EventBus()
+        sub = bus.subscribe(1)
+
+        bus.unsubscribe(sub)
+        bus.publish(event('e1'))
+
+        self.assertIsNone(sub.get(0))
+        self.assertEqual(bus.subscriberCount(), 0)
+
+    def test_since(self):
+        bus = EventBus()
+        for e in [event('e1'), event('e2'), event('e3', owner_id=2), event('e4')]:
+            bus.publish(e)
+
+        self.assertEqual([e.event_id for e in bus.since(1, 'e1')], ['e2', 'e4'])
+        self.assertEqual(bus.since(1, 'unknown'), [])
+
+    def test_since_historyLimit(self):
+        bus = EventBus(history=2)
+        for e in [event('e1'), event('e2'), event('e3')]:
+            bus.publish(e)
+
+        self.assertEqual(bus.since(1, 'e1'), [])
+        self.assertEqual([e.event_id for e in bus.since(1, 'e2')], ['e3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
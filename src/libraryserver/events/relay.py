@@ -0,0 +1,112 @@
+from datetime import datetime, UTC
+from google.cloud.firestore_v1.base_document import DocumentSnapshot
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.watch import ChangeType
+import logging
+import threading
+
+from libraryserver.api.models import Action
+from libraryserver.events.bus import BookEvent, EventBus
+from libraryserver.storage.firestore_client import Database
+
+
+def eventFromLog(log: DocumentSnapshot, owner_id) -> BookEvent|None:
+    """Returns the event for this log entry, or None if it isn't a status
+    change.
+    """
+    try:
+        action = Action(log.get("action"))
+    except ValueError:
+        return None
+    if action not in (Action.CREATE, Action.CHECKOUT, Action.RETURN):
+        return None
+    return BookEvent(log.id, log.get("book_id"), owner_id, action.name.lower(),
+                     log.get("user_id") or None, str(log.get("timestamp")))
+
+
+class FirestoreRelay:
+    """Publishes status changes made by other instances to the local bus, by
+    listening for new `actionlogs` entries. Changes this instance made are
+    already on the bus, so the bus drops them as duplicates.
+
+    The listener holds every log matching its query, and a reconnect delivers
+    them all again, so every `restart_secs` it's replaced by one starting from
+    the last snapshot's read time.
+    """
+
+    RESTART_SECS = 600
+
+    def __init__(self, db: Database, bus: EventBus, restart_secs: float = RESTART_SECS):
+        self.logger = logging.getLogger(__name__)
+        self.db = db
+        self.bus = bus
+        self.restart_secs = restart_secs
+        self._lock = threading.Lock()
+        self._watch = None
+        self._read_time = None  # of the newest snapshot from any listener
+        self._stop = threading.Event()
+
+    def start(self, since: datetime|None = None):
+        self._listen(since or datetime.now(UTC))
+        threading.Thread(target=self._runRestarts, name='event-relay',
+                         daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.unsubscribe()
+
+    def _listen(self, since: datetime):
+        # The new listener starts before the old one stops, so nothing falls
+        # in between; the bus drops anything both deliver
+        query = self.db.logs_ref.where(filter=FieldFilter("timestamp", ">=", since))
+        watch = query.on_snapshot(self._onSnapshot)
+        with self._lock:
+            old, self._watch = self._watch, watch
+        if old is not None:
+            old.unsubscribe()
+
+    def _runRestarts(self):
+        while not self._stop.wait(self.restart_secs):
+            with self._lock:
+                since = self._read_time
+            if since is None:
+                continue
+            try:
+                self._listen(since)
+            except Exception as e:
+                self.logger.warning('Could not restart event listener', exc_info=e)
+
+    def _onSnapshot(self, docs, changes, read_time):
+        if read_time is not None:
+            with self._lock:
+                if self._read_time is None or read_time > self._read_time:
+                    self._read_time = read_time
+        added = [c.document for c in changes if c.type == ChangeType.ADDED]
+        # Only logs from before logs recorded their owner need a lookup
+        legacy = {log.get("book_id") for log in added if _logOwner(log) is None}
+        owners = self._ownersOf(legacy) if legacy else {}
+        for log in added:
+            owner_id = _logOwner(log) or owners.get(log.get("book_id"))
+            if owner_id is None:
+                continue
+            event = eventFromLog(log, owner_id)
+            if event is not None:
+                self.bus.publish(event)
+
+    def _ownersOf(self, book_ids: set[str]) -> dict[str, object]:
+        try:
+            books = self.db.getBooksById(list(book_ids))
+        except Exception as e:
+            self.logger.warning('Could not look up books for events', exc_info=e)
+            return {}
+        return {book.id: book.get("owner_id") for book in books}
+
+
+def _logOwner(log: DocumentSnapshot):
+    try:
+        return log.get("owner_id")
+    except KeyError:
+        return None
@@ -0,0 +1,107 @@
+from google.cloud.firestore_v1.watch import ChangeType
+import time
+import unittest
+from unittest import mock
+
+from libraryserver.api.models import Action
+from libraryserver.events.bus import EventBus
+from libraryserver.events.relay import FirestoreRelay, eventFromLog
+
+
+class FakeDoc:
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+
+    def get(self, field):
+        return self.data[field]  # Raises KeyError, as snapshots do
+
+
+class FakeChange:
+
+    def __init__(self, doc, change_type=ChangeType.ADDED):
+        self.document = doc
+        self.type = change_type
+
+
+def log(log_id, book_id, action, user_id=0, owner_id=None):
+    data = {'book_id': book_id, 'action': action.value,
+            'user_id': user_id, 'timestamp': '2024-01-01'}
+    if owner_id is not None:
+        data['owner_id'] = owner_id
+    return FakeDoc(log_id, data)
+
+
+class TestRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.db.getBooksById.return_value = [FakeDoc('b1', {'owner_id': 1})]
+        self.bus = EventBus()
+        self.relay = FirestoreRelay(self.db, self.bus)
+        self.relay.start()
+        self.callback = self.db.logs_ref.where.return_value.on_snapshot.call_args[0][0]
+
+    def tearDown(self):
+        self.relay.close()
+
+    def test_publishesAddedLogs(self):
+        sub = self.bus.subscribe(1)
+
+        self.callback([], [FakeChange(log('l1', 'b1', Action.CHECKOUT, 1234))], None)
+
+        event = sub.get(0)
+        self.assertEqual((event.event_id, event.action, event.user_id),
+                         ('l1', 'checkout', 1234))
+
+    def test_ignoresOtherChanges(self):
+        sub = self.bus.subscribe(1)
+
+        self.callback([], [FakeChange(log('l1', 'b1', Action.RETURN), ChangeType.MODIFIED)], None)
+
+        self.assertIsNone(sub.get(0))
+
+    def test_usesLogOwner(self):
+        sub = self.bus.subscribe(2)
+
+        self.callback([], [FakeChange(log('l1', 'b2', Action.CHECKOUT, 1234, owner_id=2))], None)
+
+        self.assertEqual(sub.get(0).event_id, 'l1')
+        self.db.getBooksById.assert_not_called()
+
+    def test_legacyLogLooksUpOwner(self):
+        self.callback([], [FakeChange(log('l1', 'b1', Action.CHECKOUT)),
+                           FakeChange(log('l2', 'b2', Action.CHECKOUT, owner_id=2))], None)
+
+        self.db.getBooksById.assert_called_once_with(['b1'])
+
+    def test_restartsFromReadTime(self):
+        relay = FirestoreRelay(self.db, self.bus, restart_secs=0.01)
+        relay.start()
+        self.db.logs_ref.where.reset_mock()
+        watch = self.db.logs_ref.where.return_value.on_snapshot.return_value
+        relay._onSnapshot([], [], 'read-time')
+
+        deadline = time.monotonic() + 5
+        while not self.db.logs_ref.where.called and time.monotonic() < deadline:
+            time.sleep(0.01)
+        relay.close()
+
+        query_filter = self.db.logs_ref.where.call_args.kwargs['filter']
+        self.assertEqual(query_filter.value, 'read-time')
+        watch.unsubscribe.assert_called()
+
+    def test_skipsUnknownBooks(self):
+        self.db.getBooksById.return_value = []
+
+        self.callback([], [FakeChange(log('l1', 'gone', Action.CHECKOUT))], None)
+
+        self.assertEqual(self.bus.since(1, 'l1'), [])
+
+    def test_eventFromLog_unknownAction(self):
+        self.assertIsNone(eventFromLog(log('l1', 'b1', Action.UNKNOWN), 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
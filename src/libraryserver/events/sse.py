@@ -0,0 +1,37 @@
+from collections.abc import Iterator
+from dataclasses import asdict
+import json
+
+from libraryserver.events.bus import BookEvent, EventBus
+
+# Send a comment at least this often, so proxies don't close idle streams
+KEEPALIVE_SECS = 15
+
+
+def formatEvent(event: BookEvent) -> str:
+    return 'id: %s\nevent: %s\ndata: %s\n\n' % (
+        event.event_id, event.action, json.dumps(asdict(event)))
+
+
+def stream(bus: EventBus, owner_id, last_event_id: str|None = None,
+           keepalive: float = KEEPALIVE_SECS) -> Iterator[str]:
+    """Yields this library's events as server-sent events, until the client
+    goes away (or falls too far behind). Starts with any events after
+    `last_event_id` that the bus still remembers.
+    """
+    sub = bus.subscribe(owner_id)
+    try:
+        yield 'retry: 3000\n\n'
+        sent = set()
+        if last_event_id:
+            for event in bus.since(owner_id, last_event_id):
+                sent.add(event.event_id)
+                yield formatEvent(event)
+        while not sub.closed:
+            event = sub.get(keepalive)
+            if event is None:
+                yield ': keepalive\n\n'
+            elif event.event_id not in sent:
+                yield formatEvent(event)
+    finally:
+        bus.unsubscribe(sub)
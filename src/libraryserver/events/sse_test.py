@@ -0,0 +1,60 @@
+import json
+import unittest
+
+from libraryserver.events.bus import BookEvent, EventBus
+from libraryserver.events.sse import formatEvent, stream
+
+
+def event(event_id, owner_id=1):
+    return BookEvent(event_id, 'book1', owner_id, 'checkout', 1234, '2024-01-01')
+
+
+class TestSse(unittest.TestCase):
+
+    def test_formatEvent(self):
+        res = formatEvent(event('e1'))
+
+        lines = res.split('\n')
+        self.assertEqual(lines[0], 'id: e1')
+        self.assertEqual(lines[1], 'event: checkout')
+        self.assertEqual(json.loads(lines[2][len('data: '):])['book_id'], 'book1')
+        self.assertTrue(res.endswith('\n\n'))
+
+    def test_stream_sendsEvents(self):
+        bus = EventBus()
+        events = stream(bus, 1, keepalive=0.01)
+        next(events)  # retry interval
+
+        bus.publish(event('e1'))
+
+        self.assertTrue(next(events).startswith('id: e1'))
+
+    def test_stream_keepalive(self):
+        events = stream(EventBus(), 1, keepalive=0.01)
+        next(events)
+
+        self.assertEqual(next(events), ': keepalive\n\n')
+
+    def test_stream_resumesAfterLastEventId(self):
+        bus = EventBus()
+        bus.publish(event('e1'))
+        bus.publish(event('e2'))
+
+        events = stream(bus, 1, last_event_id='e1', keepalive=0.01)
+        next(events)
+
+        self.assertTrue(next(events).startswith('id: e2'))
+        self.assertEqual(next(events), ': keepalive\n\n')
+
+    def test_stream_unsubscribesOnClose(self):
+        bus = EventBus()
+        events = stream(bus, 1, keepalive=0.01)
+        next(events)
+
+        events.close()
+
+        self.assertEqual(bus.subscriberCount(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
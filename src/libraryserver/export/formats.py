@@ -0,0 +1,47 @@
+from collections.abc import Callable, Iterable, Iterator
+import csv
+from dataclasses import asdict, fields
+import io
+import json
+
+from libraryserver.api.models import Book, LogEntry
+
+ExportRow = tuple[Book, list[LogEntry]]
+
+_CSV_COLUMNS = [f.name for f in fields(Book)] + ['history']
+
+
+def _historyDicts(history: list[LogEntry]) -> list[dict]:
+    return [{**asdict(log), 'action': log.action.name} for log in history]
+
+
+def toCsv(rows: Iterable[ExportRow]) -> Iterator[str]:
+    """One line per book. The history column holds the book's log entries as
+    a JSON array, so the file round-trips through spreadsheet tools.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(_CSV_COLUMNS)
+    yield buf.getvalue()
+    for book, history in rows:
+        buf.seek(0)
+        buf.truncate()
+        history_json = json.dumps(_historyDicts(history), default=str)
+        writer.writerow(list(asdict(book).values()) + [history_json])
+        yield buf.getvalue()
+
+
+def toNdjson(rows: Iterable[ExportRow]) -> Iterator[str]:
+    """One JSON object per line, with the book's log entries nested under
+    'history'.
+    """
+    for book, history in rows:
+        record = {**asdict(book), 'history': _historyDicts(history)}
+        yield json.dumps(record, default=str) + '\n'
+
+
+# Format name -> (MIME type, file extension, writer)
+FORMATS: dict[str, tuple[str, str, Callable[[Iterable[ExportRow]], Iterator[str]]]] = {
+    'csv': ('text/csv', 'csv', toCsv),
+    'ndjson': ('application/x-ndjson', 'ndjson', toNdjson),
+}
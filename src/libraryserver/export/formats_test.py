@@ -0,0 +1,59 @@
+import csv
+from datetime import datetime, UTC
+import io
+import json
+import unittest
+
+from libraryserver.api.models import Action, Book, LogEntry
+from libraryserver.export.formats import toCsv, toNdjson
+
+BOOK = Book('id1', 'isbn1', 1, 'Babel', 'R.F. Kuang', 'Fiction', '2022', 'url',
+            True, 'user', '2024-01-02 00:00:00+00:00')
+HISTORY = [
+    LogEntry('id1', datetime(2024, 1, 1, tzinfo=UTC), Action.CREATE, None, None),
+    LogEntry('id1', datetime(2024, 1, 2, tzinfo=UTC), Action.CHECKOUT, 1234, 'user'),
+]
+
+
+class TestFormats(unittest.TestCase):
+
+    def test_csv(self):
+        out = ''.join(toCsv([(BOOK, HISTORY)]))
+
+        rows = list(csv.DictReader(io.StringIO(out)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['book_id'], 'id1')
+        self.assertEqual(rows[0]['title'], 'Babel')
+        self.assertEqual(rows[0]['is_out'], 'True')
+        history = json.loads(rows[0]['history'])
+        self.assertEqual([h['action'] for h in history], ['CREATE', 'CHECKOUT'])
+        self.assertEqual(history[1]['user_id'], 1234)
+
+    def test_csv_emptyHasHeader(self):
+        out = ''.join(toCsv([]))
+
+        self.assertTrue(out.startswith('book_id,isbn,owner_id'))
+        self.assertEqual(out.count('\n'), 1)
+
+    def test_ndjson(self):
+        out = list(toNdjson([(BOOK, HISTORY), (BOOK, [])]))
+
+        self.assertEqual(len(out), 2)
+        first = json.loads(out[0])
+        self.assertEqual(first['isbn'], 'isbn1')
+        self.assertEqual(first['history'][0]['action'], 'CREATE')
+        self.assertEqual(first['history'][0]['timestamp'], '2024-01-01 00:00:00+00:00')
+        self.assertEqual(json.loads(out[1])['history'], [])
+
+    def test_streamsLazily(self):
+        def rows():
+            yield (BOOK, HISTORY)
+            raise AssertionError('should not be consumed yet')
+
+        out = toNdjson(rows())
+
+        self.assertIn('Babel', next(out))
+
+
+if __name__ == '__main__':
+    unittest.main()
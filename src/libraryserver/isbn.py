@@ -0,0 +1,43 @@
+"""ISBN normalization, and the document keys derived from it."""
+
+import re
+
+
+def _isbn10Valid(digits: str) -> bool:
+    total = sum((10 - i) * (10 if c == 'X' else int(c)) for i, c in enumerate(digits))
+    return total % 11 == 0
+
+
+def _isbn13Check(first12: str) -> str:
+    total = sum(int(c) * (1 if i % 2 == 0 else 3) for i, c in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def toIsbn13(isbn: str) -> str|None:
+    """Returns this ISBN-10 or ISBN-13 (with or without hyphens and spaces)
+    as a bare ISBN-13, or None if it isn't a valid ISBN.
+    """
+    digits = re.sub(r'[\s-]', '', isbn or '').upper()
+    if re.fullmatch(r'\d{9}[\dX]', digits) and _isbn10Valid(digits):
+        first12 = '978' + digits[:9]
+        return first12 + _isbn13Check(first12)
+    if re.fullmatch(r'\d{13}', digits) and _isbn13Check(digits[:12]) == digits[12]:
+        return digits
+    return None
+
+
+def canonical(isbn: str) -> str:
+    """Returns the form of this ISBN to key documents by: the ISBN-13 if it's
+    a valid ISBN, otherwise the identifier itself minus separators (and any
+    characters Firestore doesn't allow in document IDs).
+    """
+    isbn13 = toIsbn13(isbn)
+    if isbn13 is not None:
+        return isbn13
+    return re.sub(r'[\s\-/]', '', isbn or '')
+
+
+def bookKey(owner_id, isbn: str, copy: int = 1) -> str:
+    """Returns the document ID for this owner's `copy`th copy of this book."""
+    key = '%s-%s' % (owner_id, canonical(isbn))
+    return key if copy == 1 else '%s-%d' % (key, copy)
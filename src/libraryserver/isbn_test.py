@@ -0,0 +1,34 @@
+import unittest
+
+from libraryserver.isbn import bookKey, canonical, toIsbn13
+
+
+class TestIsbn(unittest.TestCase):
+
+    def test_toIsbn13_fromIsbn10(self):
+        self.assertEqual(toIsbn13('0-06-206062-7'), '9780062060624')
+        self.assertEqual(toIsbn13('080442957X'), '9780804429573')
+        self.assertEqual(toIsbn13('080442957x'), '9780804429573')
+
+    def test_toIsbn13_fromIsbn13(self):
+        self.assertEqual(toIsbn13('978-0-06-206062-4'), '9780062060624')
+        self.assertEqual(toIsbn13('978 0062060624'), '9780062060624')
+
+    def test_toIsbn13_invalid(self):
+        self.assertIsNone(toIsbn13('0062060622'))
+        self.assertIsNone(toIsbn13('9780062060625'))
+        self.assertIsNone(toIsbn13('isbn1'))
+        self.assertIsNone(toIsbn13(''))
+        self.assertIsNone(toIsbn13(None))
+
+    def test_canonical(self):
+        self.assertEqual(canonical('0062060627'), '9780062060624')
+        self.assertEqual(canonical('isbn-1/2'), 'isbn12')
+
+    def test_bookKey(self):
+        self.assertEqual(bookKey(1234, '0062060627'), '1234-9780062060624')
+        self.assertEqual(bookKey('1234', '9780062060624', 2), '1234-9780062060624-2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import json
 import logging
 from google.cloud import secretmanager
+import threading
 
 from libraryserver.config import APP_CONFIG
 
@@ -10,13 +11,18 @@ class KeyManager:
 
     KEY_TEMPLATE = "projects/869102415447/secrets/%s/versions/latest"
 
+    # Secrets fetched from GCP are shared by every KeyManager in the process,
+    # so each one is only fetched once (and can be prefetched at startup)
+    _secrets = {}
+    _secret_client = None
+    _lock = threading.Lock()
+
     def __init__(self, keyfile=APP_CONFIG.apikey_file()):
         self.logger = logging.getLogger(__name__)
         self.local = (keyfile is not None)
         self.keymap = {}
 
         if not self.local:
-            self.secret_client = secretmanager.SecretManagerServiceClient()
             return
 
         try:
@@ -32,10 +38,22 @@ class KeyManager:
         if self.local:
             # all local keys loaded at startup
             return None
-        else:
-            key = self.secret_client.access_secret_version(
-                request={"name": (self.KEY_TEMPLATE % name)}
-            )
-            return key.payload.data.decode("UTF-8")
-    
-        
+
+        with KeyManager._lock:
+            if name in KeyManager._secrets:
+                return KeyManager._secrets[name]
+            if KeyManager._secret_client is None:
+                KeyManager._secret_client = secretmanager.SecretManagerServiceClient()
+            client = KeyManager._secret_client
+        key = client.access_secret_version(
+            request={"name": (self.KEY_TEMPLATE % name)}
+        )
+        value = key.payload.data.decode("UTF-8")
+        with KeyManager._lock:
+            KeyManager._secrets[name] = value
+        return value
+
+    def prefetch(self, names: list[str]):
+        """Fetches these keys now, so later lookups don't have to wait."""
+        for name in names:
+            self.getKey(name)
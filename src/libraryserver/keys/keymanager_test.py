@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 
 from libraryserver.keys.keymanager import KeyManager
 
@@ -10,6 +11,21 @@ class TestKeyManager(unittest.TestCase):
         self.assertEqual(km.getKey('books_api_key'), 'test-books')
         self.assertIsNone(km.getKey('other-name'))
 
+    @mock.patch('libraryserver.keys.keymanager.secretmanager')
+    def test_gcp_fetchesOncePerProcess(self, secretmanager):
+        client = secretmanager.SecretManagerServiceClient.return_value
+        client.access_secret_version.return_value.payload.data = b'secret'
+        KeyManager._secrets = {}
+        KeyManager._secret_client = None
+
+        KeyManager(keyfile=None).prefetch(['books_api_key'])
+        res = KeyManager(keyfile=None).getKey('books_api_key')
+
+        self.assertEqual(res, 'secret')
+        client.access_secret_version.assert_called_once()
+        KeyManager._secrets = {}
+        KeyManager._secret_client = None
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,151 @@
+from contextvars import ContextVar
+from datetime import datetime, UTC
+from flask import Flask, Response, request
+import atexit
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+
+
+# ID of the request being handled, attached to every log record made for it
+request_id: ContextVar[str|None] = ContextVar('request_id', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+_VALID_REQUEST_ID = re.compile(r'[\w\-/.;=]{1,128}')
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object. Structured data passed as
+    `extra={'fields': {...}}` is merged into the top level.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, UTC).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+class _StructuredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener, so records keep
+    their structured fields. The message and traceback are still resolved up
+    front, since arguments may change (or not be thread-safe) by the time
+    the record is written.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestIdFilter(logging.Filter):
+    """Tags records with the current request ID. Must run on the thread that
+    made the record, i.e. before it's queued.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class DebugLimitFilter(logging.Filter):
+    """Keeps DEBUG records from swamping the log: only a `sample_rate`
+    fraction of them are kept, and at most `max_per_sec` per call site
+    (logger and message format). Other levels always pass.
+    """
+
+    def __init__(self, sample_rate: float = 1, max_per_sec: float = 10):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_sec = max_per_sec
+        self._lock = threading.Lock()
+        # Call site -> (tokens left, time last refilled)
+        self._buckets: dict[tuple[str, str], tuple[float, float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.max_per_sec, now))
+            tokens = min(self.max_per_sec, tokens + (now - last) * self.max_per_sec)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            return True
+
+
+def configure(path: str, level: int|str = logging.INFO,
+              debug_sample_rate: float = 1,
+              debug_max_per_sec: float = 10) -> QueueListener:
+    """Sends all logging through a queue to a background thread, which
+    writes JSON lines to `path` (and stderr). Request threads only ever
+    append to the queue, so they never wait on log I/O.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = _StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(DebugLimitFilter(debug_sample_rate, debug_max_per_sec))
+
+    formatter = JsonFormatter()
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    listener = QueueListener(log_queue, file_handler, stream_handler,
+                             respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def install(app: Flask):
+    """Gives every request handled by `app` an ID, taken from the
+    X-Request-Id header if the caller sent a valid one, and echoes it back in
+    the response.
+    """
+
+    @app.before_request
+    def startRequest():
+        rid = request.headers.get(REQUEST_ID_HEADER, '')
+        if not _VALID_REQUEST_ID.fullmatch(rid):
+            rid = uuid.uuid4().hex
+        request_id.set(rid)
+
+    @app.after_request
+    def tagResponse(response: Response) -> Response:
+        rid = request_id.get()
+        if rid:
+            response.headers[REQUEST_ID_HEADER] = rid
+        return response
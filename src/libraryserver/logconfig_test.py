@@ -0,0 +1,139 @@
+from flask import Flask
+import atexit
+import json
+import logging
+import os
+import tempfile
+import unittest
+
+from libraryserver import logconfig
+from libraryserver.logconfig import (
+    DebugLimitFilter, JsonFormatter, REQUEST_ID_HEADER, RequestIdFilter,
+    request_id)
+
+
+def makeRecord(level=logging.INFO, msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('test', level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestJsonFormatter(unittest.TestCase):
+
+    def test_format(self):
+        res = json.loads(JsonFormatter().format(makeRecord(request_id='abc')))
+
+        self.assertEqual(res['message'], 'hello world')
+        self.assertEqual(res['level'], 'INFO')
+        self.assertEqual(res['logger'], 'test')
+        self.assertEqual(res['request_id'], 'abc')
+        self.assertIn('timestamp', res)
+
+    def test_format_mergesFields(self):
+        record = makeRecord(fields={'route': '/v0/books', 'latency_ms': 1.5})
+
+        res = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual(res['route'], '/v0/books')
+        self.assertEqual(res['latency_ms'], 1.5)
+
+
+class TestFilters(unittest.TestCase):
+
+    def test_requestIdFilter(self):
+        token = request_id.set('abc')
+        record = makeRecord()
+
+        RequestIdFilter().filter(record)
+        request_id.reset(token)
+
+        self.assertEqual(record.request_id, 'abc')
+
+    def test_debugLimit_ratePerCallSite(self):
+        limit = DebugLimitFilter(max_per_sec=2)
+
+        kept = [limit.filter(makeRecord(logging.DEBUG)) for _ in range(5)]
+        other = limit.filter(makeRecord(logging.DEBUG, msg='other'))
+
+        self.assertEqual(kept, [True, True, False, False, False])
+        self.assertTrue(other)
+
+    def test_debugLimit_sampling(self):
+        limit = DebugLimitFilter(sample_rate=0, max_per_sec=100)
+
+        self.assertFalse(limit.filter(makeRecord(logging.DEBUG)))
+
+    def test_debugLimit_ignoresHigherLevels(self):
+        limit = DebugLimitFilter(sample_rate=0, max_per_sec=0)
+
+        self.assertTrue(limit.filter(makeRecord(logging.WARNING)))
+
+
+class TestConfigure(unittest.TestCase):
+
+    def setUp(self):
+        root = logging.getLogger()
+        self.saved = (list(root.handlers), root.level)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in self.saved[0]:
+            root.addHandler(handler)
+        root.setLevel(self.saved[1])
+        self.tmp.cleanup()
+
+    def test_configure_writesJsonLines(self):
+        path = os.path.join(self.tmp.name, 'test.log')
+        listener = logconfig.configure(path)
+
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            logging.getLogger('test').exception('failed %d', 1)
+        logging.getLogger('test').info('done', extra={'fields': {'n': 2}})
+        atexit.unregister(listener.stop)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[0]['message'], 'failed 1')
+        self.assertIn('ValueError: bad', lines[0]['exception'])
+        self.assertEqual(lines[1]['n'], 2)
+
+
+class TestInstall(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        logconfig.install(self.app)
+
+        @self.app.route('/id')
+        def getId():
+            return request_id.get()
+
+        self.client = self.app.test_client()
+
+    def test_generatesRequestId(self):
+        res = self.client.get('/id')
+
+        self.assertEqual(len(res.data), 32)
+        self.assertEqual(res.headers[REQUEST_ID_HEADER], res.data.decode())
+
+    def test_keepsCallerRequestId(self):
+        res = self.client.get('/id', headers={REQUEST_ID_HEADER: 'abc-123'})
+
+        self.assertEqual(res.data, b'abc-123')
+
+    def test_replacesInvalidRequestId(self):
+        res = self.client.get('/id', headers={REQUEST_ID_HEADER: '<script>'})
+
+        self.assertEqual(len(res.data), 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
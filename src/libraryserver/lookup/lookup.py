@@ -1,37 +1,167 @@
-import json
-from urllib.request import urlopen
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import contextvars
+from dataclasses import replace
+import time
 
-from libraryserver.api.errors import NotFoundException
+import requests
+
+from libraryserver import deadline
+from libraryserver.api.errors import DeadlineExceededException, NotFoundException
 from libraryserver.api.models import Book
+from libraryserver.config import APP_CONFIG
 from libraryserver.keys.keymanager import KeyManager
+from libraryserver.lookup.offline import OFFLINE_STORE, OfflineStore
+from libraryserver.lookup.providers import (
+    PROVIDER_STATS, GoogleBooksProvider, OpenLibraryProvider, Provider, ProviderStats)
+from libraryserver.outbound.client import HTTP_CLIENT, HttpClient
+
+# Fields a lookup fills in, and that may be merged from several providers
+_DETAIL_FIELDS = ['title', 'author', 'category', 'year', 'thumbnail']
+
+# Calls outlive the request that made them when another provider answers
+# first, so they run on a shared pool rather than per-request threads
+_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='lookup')
 
 
 class LookupService:
+    """Looks up book details by ISBN, from the offline store if it has the
+    book, and otherwise from several providers, in order of preference.
+
+    If a provider hasn't answered within its usual response time (the
+    `hedge_percentile`th percentile of its recent latencies), the next one is
+    asked as well, and whichever answers first wins. The next one is also
+    asked if a provider fails, doesn't have the book, or leaves some details
+    blank, and blanks are filled in from later providers' answers. Gives up
+    with DeadlineExceededException when the request's deadline passes.
+    """
 
     API_KEY_NAME = 'books_api_key'
-    GOOGLE_BOOKS_ENDPOINT = 'https://www.googleapis.com/books/v1/volumes?q=isbn:%s&key=%s'
+    # Hedge delay to use until a provider has enough latency samples
+    DEFAULT_HEDGE_DELAY_SECS = 0.5
+    MIN_HEDGE_DELAY_SECS = 0.05
+
+    def __init__(self, keymanager: KeyManager, http: HttpClient = HTTP_CLIENT,
+                 providers: list[Provider]|None = None,
+                 stats: ProviderStats = PROVIDER_STATS,
+                 hedge_percentile: float|None = None,
+                 offline: OfflineStore|None = OFFLINE_STORE):
+        if providers is None:
+            providers = self._configuredProviders(keymanager, http)
+        self.providers = providers
+        self.stats = stats
+        if hedge_percentile is None:
+            hedge_percentile = APP_CONFIG.lookup_hedge_percentile()
+        self.hedge_percentile = hedge_percentile
+        self.offline = offline
 
-    def __init__(self, keymanager: KeyManager):
-        self.api_key = keymanager.getKey(self.API_KEY_NAME)
+    def _configuredProviders(self, keymanager: KeyManager,
+                             http: HttpClient) -> list[Provider]:
+        providers = []
+        for name in APP_CONFIG.lookup_providers():
+            if name == GoogleBooksProvider.name:
+                providers.append(GoogleBooksProvider(
+                    keymanager.getKey(self.API_KEY_NAME), http))
+            elif name == OpenLibraryProvider.name:
+                providers.append(OpenLibraryProvider(http))
+            else:
+                raise ValueError('Unknown lookup provider %s' % name)
+        return providers
+
+    def hedgeDelay(self, provider: Provider) -> float:
+        delay = self.stats.get(provider.name).percentile(self.hedge_percentile)
+        if delay is None:
+            return self.DEFAULT_HEDGE_DELAY_SECS
+        return max(delay, self.MIN_HEDGE_DELAY_SECS)
 
     def lookupIsbn(self, isbn: str) -> Book:
-        url = self.GOOGLE_BOOKS_ENDPOINT % (isbn, self.api_key)
-        res = json.load(urlopen(url))
-        if not 'items' in res or res['totalItems'] == 0:
-            raise NotFoundException('No books found with ISBN %s' % isbn)
-        vals = res['items'][0]['volumeInfo']
-        title = vals['title'] if 'title' in vals else ''
-        authors = vals['authors'] if 'authors' in vals else []
-        author = ', '.join(authors)
-        if 'mainCategory' in vals:
-            category = vals['mainCategory']
-        elif 'categories' in vals and len(vals['categories']) > 0:
-            category = vals['categories'][0]
-        else:
-            category = ''
-        year = vals['publishedDate'][:4] if 'publishedDate' in vals else ''
-        if 'imageLinks' in vals and 'thumbnail' in vals['imageLinks']:
-            thumbnail = vals['imageLinks']['thumbnail']
-        else:
-            thumbnail = ''
-        return Book('', isbn, 0, title, author, category, year, thumbnail)
+        local = self._askOffline(isbn)
+        if local is not None and local.title:
+            return local
+        try:
+            return self._lookupOnline(isbn)
+        except (NotFoundException, requests.RequestException):
+            # Whatever we have locally beats nothing
+            if local is not None:
+                return local
+            raise
+
+    def _askOffline(self, isbn: str) -> Book|None:
+        if self.offline is None:
+            return None
+        start = time.monotonic()
+        book = self.offline.get(isbn)
+        self.stats.get('offline').record('found' if book else 'not_found',
+                                         time.monotonic() - start)
+        return book
+
+    def _lookupOnline(self, isbn: str) -> Book:
+        pending: dict[Future, int] = {}  # call -> provider index
+        answers: dict[int, Book] = {}
+        errors = []
+        asked, hedge_at = 0, None
+
+        def askNext():
+            nonlocal asked, hedge_at
+            provider = self.providers[asked]
+            # Carry the request's deadline over to the pool thread
+            call = _EXECUTOR.submit(contextvars.copy_context().run,
+                                    self._ask, provider, isbn)
+            pending[call] = asked
+            asked += 1
+            hedge_at = time.monotonic() + self.hedgeDelay(provider)
+
+        askNext()
+        while pending:
+            if asked < len(self.providers):
+                timeout = max(hedge_at - time.monotonic(), 0)
+            else:
+                timeout = None
+            done, _ = wait(pending, timeout=deadline.bound(timeout),
+                           return_when=FIRST_COMPLETED)
+            for call in done:
+                i = pending.pop(call)
+                try:
+                    answers[i] = call.result()
+                except requests.RequestException as e:
+                    errors.append(e)
+            if not done and deadline.expired():
+                raise DeadlineExceededException('Request deadline exceeded')
+
+            book = _merge(isbn, [answers[i] for i in sorted(answers)])
+            if book is not None and _isComplete(book):
+                return book
+            # Hedge if the latest provider is slow; move on if it's done
+            # without a complete answer
+            if asked < len(self.providers) and (not done or not pending):
+                askNext()
+
+        if book is not None:
+            return book
+        if errors:
+            raise errors[0]
+        raise NotFoundException('No books found with ISBN %s' % isbn)
+
+    def _ask(self, provider: Provider, isbn: str) -> Book|None:
+        stats = self.stats.get(provider.name)
+        start = time.monotonic()
+        try:
+            book = provider.lookup(isbn)
+        except requests.RequestException:
+            stats.record('error', time.monotonic() - start)
+            raise
+        stats.record('found' if book else 'not_found', time.monotonic() - start)
+        return book
+
+
+def _merge(isbn: str, books: list[Book|None]) -> Book|None:
+    # Takes each detail from the first book that has it
+    books = [b for b in books if b is not None]
+    if not books:
+        return None
+    details = {field: next((getattr(b, field) for b in books if getattr(b, field)), '')
+               for field in _DETAIL_FIELDS}
+    return replace(books[0], isbn=isbn, **details)
+
+
+def _isComplete(book: Book) -> bool:
+    return all(getattr(book, field) for field in _DETAIL_FIELDS)
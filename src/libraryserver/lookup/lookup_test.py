@@ -0,0 +1,207 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from libraryserver import deadline
+from libraryserver.api.errors import DeadlineExceededException, NotFoundException
+from libraryserver.api.models import Book
+from libraryserver.lookup.lookup import LookupService
+from libraryserver.lookup.offline import OfflineStore
+from libraryserver.lookup.providers import (
+    GoogleBooksProvider, LatencyStats, OpenLibraryProvider, ProviderStats)
+from libraryserver.outbound.client import HttpClient
+
+ISBN = '9780062060624'
+
+
+def _google(**vals):
+    return {'totalItems': 1, 'items': [{'volumeInfo': vals}]}
+
+
+def _openLibrary(**vals):
+    return {'ISBN:%s' % ISBN: vals}
+
+
+_COMPLETE_GOOGLE = _google(
+    title='Babel', authors=['R.F. Kuang'], categories=['Fiction'],
+    publishedDate='2022', imageLinks={'thumbnail': 'http://img/babel'})
+_COMPLETE_OPEN_LIBRARY = _openLibrary(
+    title='Babel: An Arcane History', authors=[{'name': 'Rebecca F. Kuang'}],
+    subjects=[{'name': 'Fantasy'}], publish_date='2022',
+    cover={'medium': 'http://covers/babel-M.jpg'})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Provider name -> (delay in seconds, status, JSON body)
+    responses = {}
+    calls = []
+
+    def do_GET(self):
+        name = self.path.split('/')[1]
+        type(self).calls.append(name)
+        delay, status, body = type(self).responses[name]
+        time.sleep(delay)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLookupService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('localhost', 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = 'http://localhost:%d' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        _Handler.calls = []
+        http = HttpClient()
+        self.stats = ProviderStats()
+        self.lookup = LookupService(None, providers=[
+            GoogleBooksProvider('key', http, self.base + '/google/%s?key=%s'),
+            OpenLibraryProvider(http, self.base + '/openlibrary/%s'),
+        ], stats=self.stats, hedge_percentile=95, offline=None)
+        self.lookup.DEFAULT_HEDGE_DELAY_SECS = 0.2
+
+    def respond(self, google, open_library):
+        _Handler.responses = {'google': google, 'openlibrary': open_library}
+
+    def test_primaryAnswers(self):
+        self.respond((0, 200, _COMPLETE_GOOGLE), (0, 200, _COMPLETE_OPEN_LIBRARY))
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.title, 'Babel')
+        self.assertEqual(_Handler.calls, ['google'])
+
+    def test_hedgesSlowPrimary(self):
+        self.respond((1, 200, _COMPLETE_GOOGLE), (0, 200, _COMPLETE_OPEN_LIBRARY))
+        start = time.monotonic()
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.title, 'Babel: An Arcane History')
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_primaryNotFound(self):
+        self.respond((0, 200, {'totalItems': 0}), (0, 200, _COMPLETE_OPEN_LIBRARY))
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.author, 'Rebecca F. Kuang')
+        self.assertEqual(book.isbn, ISBN)
+
+    def test_primaryError(self):
+        self.respond((0, 500, {}), (0, 200, _COMPLETE_OPEN_LIBRARY))
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.category, 'Fantasy')
+        self.assertEqual(self.stats.get('google').summary()['errors'], 1)
+
+    def test_primaryUnexpectedResponse(self):
+        self.respond((0, 200, {'totalItems': 1, 'items': [{}]}),
+                     (0, 200, _COMPLETE_OPEN_LIBRARY))
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.category, 'Fantasy')
+        self.assertEqual(self.stats.get('google').summary()['errors'], 1)
+
+    def test_mergesMissingFields(self):
+        self.respond((0, 200, _google(title='Babel', authors=['R.F. Kuang'])),
+                     (0, 200, _COMPLETE_OPEN_LIBRARY))
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.title, 'Babel')
+        self.assertEqual(book.author, 'R.F. Kuang')
+        self.assertEqual(book.category, 'Fantasy')
+        self.assertEqual(book.thumbnail, 'http://covers/babel-M.jpg')
+
+    def test_incompleteWhenNobodyHasField(self):
+        self.respond((0, 200, _google(title='Babel')), (0, 200, {}))
+
+        book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.title, 'Babel')
+        self.assertEqual(book.thumbnail, '')
+
+    def test_notFound(self):
+        self.respond((0, 200, {'totalItems': 0}), (0, 200, {}))
+
+        with self.assertRaises(NotFoundException):
+            self.lookup.lookupIsbn(ISBN)
+
+    def test_errorAndNotFound(self):
+        self.respond((0, 500, {}), (0, 200, {}))
+
+        with self.assertRaises(requests.RequestException):
+            self.lookup.lookupIsbn(ISBN)
+
+    def test_deadline(self):
+        self.respond((1, 200, _COMPLETE_GOOGLE), (1, 200, _COMPLETE_OPEN_LIBRARY))
+        start = time.monotonic()
+
+        with deadline.scope(0.3):
+            with self.assertRaises(DeadlineExceededException):
+                self.lookup.lookupIsbn(ISBN)
+
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_offlineFirst(self):
+        self.respond((0, 200, _COMPLETE_GOOGLE), (0, 200, _COMPLETE_OPEN_LIBRARY))
+        with tempfile.TemporaryDirectory() as tmp:
+            self.lookup.offline = OfflineStore(os.path.join(tmp, 'isbn.sqlite'))
+            self.lookup.offline.load([Book('', '0062060627', 0, 'Babel (offline)',
+                                           '', '', '', '')])
+
+            book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.title, 'Babel (offline)')
+        self.assertEqual(book.isbn, ISBN)
+        self.assertEqual(_Handler.calls, [])
+
+    def test_offlineMiss(self):
+        self.respond((0, 200, _COMPLETE_GOOGLE), (0, 200, _COMPLETE_OPEN_LIBRARY))
+        with tempfile.TemporaryDirectory() as tmp:
+            self.lookup.offline = OfflineStore(os.path.join(tmp, 'isbn.sqlite'))
+
+            book = self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(book.title, 'Babel')
+        self.assertEqual(self.stats.summary()['offline']['not_found'], 1)
+
+    def test_hedgeDelayFromStats(self):
+        for _ in range(LatencyStats.MIN_SAMPLES):
+            self.stats.get('google').record('found', 0.3)
+
+        self.assertEqual(self.lookup.hedgeDelay(self.lookup.providers[0]), 0.3)
+
+    def test_recordsLatency(self):
+        self.respond((0, 200, _COMPLETE_GOOGLE), (0, 200, _COMPLETE_OPEN_LIBRARY))
+
+        self.lookup.lookupIsbn(ISBN)
+
+        self.assertEqual(self.stats.summary()['google']['found'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
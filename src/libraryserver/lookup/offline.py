@@ -0,0 +1,183 @@
+"""Local store of book details by ISBN, so lookups needn't go to the network.
+
+Records are keyed by ISBN-13 (as an integer), so ISBN-10 and ISBN-13 lookups
+find the same record, and hold the book's details in plain columns. (Records
+are too small for per-record compression to pay for the decompression on
+every lookup.) Databases from before that read as empty until reloaded.
+
+Bulk-load it from the Open Library editions dump
+(https://openlibrary.org/developers/dumps), optionally with the authors dump
+to resolve author names, with
+`python -m libraryserver.lookup.offline <editions dump> [--authors <dump>]`.
+"""
+
+import argparse
+from collections.abc import Iterable, Iterator
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from libraryserver.api.models import Book
+from libraryserver.config import APP_CONFIG
+from libraryserver.isbn import toIsbn13
+
+COVER_URL = 'https://covers.openlibrary.org/b/id/%d-M.jpg'
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineStore:
+    """SQLite-backed ISBN store. Reads are safe from any thread. A missing
+    or unreadable database (e.g. one still being created) reads as empty, and
+    is picked up once it's loaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _reader(self) -> sqlite3.Connection|None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if not os.path.exists(self.path):
+                return None
+            conn = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True)
+            self._local.conn = conn
+        return conn
+
+    def get(self, isbn: str) -> Book|None:
+        isbn13 = toIsbn13(isbn)
+        conn = self._reader()
+        if isbn13 is None or conn is None:
+            return None
+        try:
+            row = conn.execute('SELECT title, author, category, year, thumbnail '
+                               'FROM books WHERE isbn = ?', (int(isbn13),)).fetchone()
+        except sqlite3.OperationalError as e:
+            logger.warning('Could not read offline ISBN database %s: %s',
+                           self.path, e)
+            # Reconnect next time, in case the file has been replaced
+            conn.close()
+            self._local.conn = None
+            return None
+        return Book('', isbn, 0, *row) if row else None
+
+    def load(self, books: Iterable[Book], batch_size: int = 10000) -> int:
+        """Adds (or replaces) these books, skipping any without a valid ISBN.
+        Returns how many were stored.
+        """
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS books '
+                         '(isbn INTEGER PRIMARY KEY, title TEXT, author TEXT, '
+                         'category TEXT, year TEXT, thumbnail TEXT)')
+            count = 0
+            batch = []
+            for book in books:
+                isbn13 = toIsbn13(book.isbn)
+                if isbn13 is None:
+                    continue
+                batch.append((int(isbn13), book.title, book.author,
+                              book.category, book.year, book.thumbnail))
+                if len(batch) >= batch_size:
+                    count += self._insert(conn, batch)
+                    batch = []
+            count += self._insert(conn, batch)
+            return count
+        finally:
+            conn.close()
+
+    def _insert(self, conn: sqlite3.Connection, batch: list) -> int:
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?)',
+                             batch)
+        return len(batch)
+
+
+def _dumpRecords(path: str) -> Iterator[dict]:
+    # Dump lines are: type, key, revision, last modified, JSON record
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 5:
+                yield json.loads(fields[4])
+
+
+class AuthorNames:
+    """Author key (e.g. '/authors/OL1A') to name, from an authors dump. Kept
+    in a temporary SQLite database, as the full dump is several GB.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        self._conn = sqlite3.connect('')  # A private, temporary database
+        self._conn.execute('CREATE TABLE authors (key TEXT PRIMARY KEY, name TEXT)')
+        batch = []
+        for rec in _dumpRecords(path):
+            if 'key' in rec and 'name' in rec:
+                batch.append((rec['key'], rec['name']))
+            if len(batch) >= batch_size:
+                self._insert(batch)
+                batch = []
+        self._insert(batch)
+
+    def _insert(self, batch: list):
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO authors VALUES (?, ?)', batch)
+
+    def get(self, key: str) -> str|None:
+        row = self._conn.execute('SELECT name FROM authors WHERE key = ?',
+                                 (key,)).fetchone()
+        return row[0] if row else None
+
+
+def readEditions(path: str, authors: AuthorNames|dict|None = None) -> Iterator[Book]:
+    """Yields a Book for each distinct ISBN of each edition in an editions
+    dump. An edition's ISBN-10 and ISBN-13 are the same ISBN, so it yields
+    only the first of them.
+    """
+    authors = authors or {}
+    for rec in _dumpRecords(path):
+        isbns = rec.get('isbn_13', []) + rec.get('isbn_10', [])
+        if not isbns or 'title' not in rec:
+            continue
+        title = rec['title']
+        if rec.get('subtitle'):
+            title = '%s: %s' % (title, rec['subtitle'])
+        names = [authors.get(a.get('key')) for a in rec.get('authors', [])]
+        names = [name for name in names if name]
+        author = ', '.join(names) or rec.get('by_statement', '')
+        subjects = rec.get('subjects', [])
+        category = subjects[0] if subjects else ''
+        year = re.search(r'\d{4}', rec.get('publish_date', ''))
+        year = year.group(0) if year else ''
+        covers = [c for c in rec.get('covers', []) if c and c > 0]
+        thumbnail = COVER_URL % covers[0] if covers else ''
+        seen = set()
+        for isbn in isbns:
+            key = toIsbn13(isbn) or isbn
+            if key in seen:
+                continue
+            seen.add(key)
+            yield Book('', isbn, 0, title, author, category, year, thumbnail)
+
+
+OFFLINE_STORE = OfflineStore(APP_CONFIG.offline_isbn_db())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('editions', help='Open Library editions dump')
+    parser.add_argument('--authors', help='Open Library authors dump')
+    parser.add_argument('--db', default=OFFLINE_STORE.path,
+                        help='database to load into')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    authors = AuthorNames(args.authors) if args.authors else None
+    count = OfflineStore(args.db).load(readEditions(args.editions, authors))
+    logger.info('Loaded %d ISBNs into %s', count, args.db)
@@ -0,0 +1,97 @@
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from libraryserver.api.models import Book
+from libraryserver.lookup.offline import AuthorNames, OfflineStore, readEditions
+
+
+def _dumpLine(record_type, key, record):
+    return '%s\t%s\t1\t2024-01-01T00:00:00\t%s\n' % (record_type, key, json.dumps(record))
+
+
+class TestOfflineStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = OfflineStore(os.path.join(self.tmp.name, 'isbn.sqlite'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_missingDatabase(self):
+        self.assertIsNone(self.store.get('9780062060624'))
+        self.assertFalse(os.path.exists(self.store.path))
+
+    def test_databaseWithoutTable(self):
+        open(self.store.path, 'wb').close()
+
+        with self.assertLogs('libraryserver.lookup.offline', 'WARNING'):
+            self.assertIsNone(self.store.get('9780000000002'))
+
+        self.store.load([Book('', '9780000000002', 0, 'Title', '', '', '', '')])
+        self.assertEqual(self.store.get('9780000000002').title, 'Title')
+
+    def test_databaseWithOldSchema(self):
+        conn = sqlite3.connect(self.store.path)
+        conn.execute('CREATE TABLE books (isbn INTEGER PRIMARY KEY, record BLOB NOT NULL)')
+        conn.close()
+
+        with self.assertLogs('libraryserver.lookup.offline', 'WARNING'):
+            self.assertIsNone(self.store.get('9780000000002'))
+
+    def test_loadAndGet(self):
+        book = Book('', '9780062060624', 0, 'Babel', 'R.F. Kuang', 'Fiction',
+                    '2022', 'http://img/babel')
+
+        count = self.store.load([book])
+
+        self.assertEqual(count, 1)
+        self.assertEqual(self.store.get('9780062060624'), book)
+
+    def test_getByIsbn10(self):
+        self.store.load([Book('', '9780062060624', 0, 'Babel', '', '', '', '')])
+
+        book = self.store.get('0-06-206062-7')
+
+        self.assertEqual(book.title, 'Babel')
+        self.assertEqual(book.isbn, '0-06-206062-7')
+
+    def test_skipsInvalidIsbns(self):
+        count = self.store.load([Book('', 'not-an-isbn', 0, 'Babel', '', '', '', '')])
+
+        self.assertEqual(count, 0)
+        self.assertIsNone(self.store.get('not-an-isbn'))
+
+    def test_notFound(self):
+        self.store.load([Book('', '9780062060624', 0, 'Babel', '', '', '', '')])
+
+        self.assertIsNone(self.store.get('9780804429573'))
+
+    def test_readEditions(self):
+        authors_path = os.path.join(self.tmp.name, 'authors.txt')
+        with open(authors_path, 'w') as f:
+            f.write(_dumpLine('/type/author', '/authors/OL1A',
+                              {'key': '/authors/OL1A', 'name': 'R.F. Kuang'}))
+        editions_path = os.path.join(self.tmp.name, 'editions.txt.gz')
+        with gzip.open(editions_path, 'wt') as f:
+            f.write(_dumpLine('/type/edition', '/books/OL1M', {
+                'title': 'Babel', 'subtitle': 'An Arcane History',
+                'authors': [{'key': '/authors/OL1A'}], 'subjects': ['Fantasy'],
+                'publish_date': 'Aug 23, 2022', 'covers': [-1, 42],
+                'isbn_13': ['9780062060624'], 'isbn_10': ['0062060627']}))
+            f.write(_dumpLine('/type/edition', '/books/OL2M', {'title': 'No ISBN'}))
+
+        books = list(readEditions(editions_path, AuthorNames(authors_path)))
+
+        self.assertEqual([b.isbn for b in books], ['9780062060624'])
+        self.assertEqual(books[0], Book(
+            '', '9780062060624', 0, 'Babel: An Arcane History', 'R.F. Kuang',
+            'Fantasy', '2022', 'https://covers.openlibrary.org/b/id/42-M.jpg'))
+
+
+if __name__ == '__main__':
+    unittest.main()
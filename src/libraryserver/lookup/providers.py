@@ -0,0 +1,175 @@
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+import re
+import threading
+
+import requests
+
+from libraryserver.api.models import Book
+from libraryserver.outbound.client import HTTP_CLIENT, HttpClient
+from libraryserver.quantiles import percentile
+
+
+class ProviderResponseError(requests.RequestException):
+    """Raised when a provider answers with something we can't make sense of."""
+
+
+class Provider(ABC):
+    """A source of book details by ISBN."""
+
+    name = ''
+
+    def lookup(self, isbn: str) -> Book|None:
+        """Returns what this provider knows about the book, or None if it
+        doesn't have it. Raises requests.RequestException if it couldn't be
+        asked, or its answer couldn't be understood.
+        """
+        res = self._fetch(isbn)
+        try:
+            return self._parse(isbn, res)
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+            raise ProviderResponseError(
+                'Unexpected response from %s' % self.name) from e
+
+    @abstractmethod
+    def _fetch(self, isbn: str):
+        """Asks the provider about the book, and returns its decoded answer."""
+        pass
+
+    @abstractmethod
+    def _parse(self, isbn: str, res) -> Book|None:
+        pass
+
+
+class GoogleBooksProvider(Provider):
+
+    name = 'google'
+    ENDPOINT = 'https://www.googleapis.com/books/v1/volumes?q=isbn:%s&key=%s'
+
+    def __init__(self, api_key: str, http: HttpClient = HTTP_CLIENT,
+                 endpoint: str = ENDPOINT):
+        self.api_key = api_key
+        self.http = http
+        self.endpoint = endpoint
+
+    def _fetch(self, isbn: str):
+        resp = self.http.get(self.endpoint % (isbn, self.api_key))
+        resp.raise_for_status()
+        return resp.json()
+
+    def _parse(self, isbn: str, res) -> Book|None:
+        if not 'items' in res or res['totalItems'] == 0:
+            return None
+        vals = res['items'][0]['volumeInfo']
+        title = vals['title'] if 'title' in vals else ''
+        authors = vals['authors'] if 'authors' in vals else []
+        author = ', '.join(authors)
+        if 'mainCategory' in vals:
+            category = vals['mainCategory']
+        elif 'categories' in vals and len(vals['categories']) > 0:
+            category = vals['categories'][0]
+        else:
+            category = ''
+        year = vals['publishedDate'][:4] if 'publishedDate' in vals else ''
+        if 'imageLinks' in vals and 'thumbnail' in vals['imageLinks']:
+            thumbnail = vals['imageLinks']['thumbnail']
+        else:
+            thumbnail = ''
+        return Book('', isbn, 0, title, author, category, year, thumbnail)
+
+
+class OpenLibraryProvider(Provider):
+
+    name = 'openlibrary'
+    ENDPOINT = 'https://openlibrary.org/api/books?bibkeys=ISBN:%s&format=json&jscmd=data'
+
+    def __init__(self, http: HttpClient = HTTP_CLIENT, endpoint: str = ENDPOINT):
+        self.http = http
+        self.endpoint = endpoint
+
+    def _fetch(self, isbn: str):
+        resp = self.http.get(self.endpoint % isbn)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _parse(self, isbn: str, res) -> Book|None:
+        vals = res.get('ISBN:%s' % isbn)
+        if not vals:
+            return None
+        title = vals.get('title', '')
+        author = ', '.join(a['name'] for a in vals.get('authors', []))
+        subjects = vals.get('subjects', [])
+        category = subjects[0]['name'] if subjects else ''
+        # Publish dates are free text, e.g. "March 2004"
+        year = re.search(r'\d{4}', vals.get('publish_date', ''))
+        year = year.group(0) if year else ''
+        thumbnail = vals.get('cover', {}).get('medium', '')
+        return Book('', isbn, 0, title, author, category, year, thumbnail)
+
+
+class LatencyStats:
+    """Outcome counts and a sliding window of response times for one
+    provider.
+    """
+
+    WINDOW = 200
+    # Fewer answers than this aren't enough to estimate a percentile from
+    MIN_SAMPLES = 20
+
+    def __init__(self, window: int = WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._outcomes = Counter()
+
+    def record(self, outcome: str, secs: float):
+        """Records a call that ended in `outcome` ('found', 'not_found' or
+        'error') after `secs`. Only answers count towards the latencies.
+        """
+        with self._lock:
+            self._outcomes[outcome] += 1
+            if outcome != 'error':
+                self._latencies.append(secs)
+
+    def percentile(self, p: float) -> float|None:
+        """Returns the `p`th percentile response time in seconds, or None if
+        there aren't enough answers yet.
+        """
+        with self._lock:
+            if len(self._latencies) < self.MIN_SAMPLES:
+                return None
+            return percentile(list(self._latencies), p)
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies_ms = [secs * 1000 for secs in self._latencies]
+            outcomes = dict(self._outcomes)
+        return {
+            "found": outcomes.get('found', 0),
+            "not_found": outcomes.get('not_found', 0),
+            "errors": outcomes.get('error', 0),
+            "p50_ms": percentile(latencies_ms, 50),
+            "p95_ms": percentile(latencies_ms, 95),
+            "p99_ms": percentile(latencies_ms, 99)
+        }
+
+
+class ProviderStats:
+    """LatencyStats for every provider, by name. Shared across requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[str, LatencyStats] = {}
+
+    def get(self, name: str) -> LatencyStats:
+        with self._lock:
+            if name not in self._stats:
+                self._stats[name] = LatencyStats()
+            return self._stats[name]
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {name: s.summary() for name, s in stats.items()}
+
+
+PROVIDER_STATS = ProviderStats()
@@ -0,0 +1,148 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import unittest
+
+import requests
+
+from libraryserver.api.models import Book
+from libraryserver.lookup.providers import (
+    GoogleBooksProvider, LatencyStats, OpenLibraryProvider, ProviderResponseError)
+from libraryserver.outbound.client import HttpClient
+
+_GOOGLE = {
+    'totalItems': 1,
+    'items': [{'volumeInfo': {
+        'title': 'Babel', 'authors': ['R.F. Kuang'], 'categories': ['Fiction'],
+        'publishedDate': '2022-08-23',
+        'imageLinks': {'thumbnail': 'http://img/babel'}}}]
+}
+_OPEN_LIBRARY = {
+    'ISBN:9780062060624': {
+        'title': 'Babel', 'authors': [{'name': 'R.F. Kuang'}],
+        'subjects': [{'name': 'Fantasy'}], 'publish_date': 'August 2022',
+        'cover': {'medium': 'http://covers/babel-M.jpg'}}
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/google/9780062060624'):
+            status, body = 200, _GOOGLE
+        elif self.path.startswith('/google/9780000000002'):
+            status, body = 200, {'totalItems': 1, 'items': [{'id': 'x'}]}
+        elif self.path.startswith('/google/'):
+            status, body = 200, {'totalItems': 0}
+        elif self.path.startswith('/openlibrary/9780062060624'):
+            status, body = 200, _OPEN_LIBRARY
+        elif self.path.startswith('/openlibrary/9780000000002'):
+            status, body = 200, []
+        elif self.path.startswith('/openlibrary/'):
+            status, body = 200, {}
+        else:
+            status, body = 500, {}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestProviders(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('localhost', 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = 'http://localhost:%d' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_googleBooks(self):
+        provider = GoogleBooksProvider('key', HttpClient(),
+                                       self.base + '/google/%s?key=%s')
+
+        book = provider.lookup('9780062060624')
+
+        self.assertEqual(book, Book('', '9780062060624', 0, 'Babel', 'R.F. Kuang',
+                                    'Fiction', '2022', 'http://img/babel'))
+
+    def test_googleBooks_notFound(self):
+        provider = GoogleBooksProvider('key', HttpClient(),
+                                       self.base + '/google/%s?key=%s')
+
+        self.assertIsNone(provider.lookup('9780804429573'))
+
+    def test_openLibrary(self):
+        provider = OpenLibraryProvider(HttpClient(), self.base + '/openlibrary/%s')
+
+        book = provider.lookup('9780062060624')
+
+        self.assertEqual(book, Book('', '9780062060624', 0, 'Babel', 'R.F. Kuang',
+                                    'Fantasy', '2022', 'http://covers/babel-M.jpg'))
+
+    def test_openLibrary_notFound(self):
+        provider = OpenLibraryProvider(HttpClient(), self.base + '/openlibrary/%s')
+
+        self.assertIsNone(provider.lookup('9780804429573'))
+
+    def test_googleBooks_unexpectedResponse(self):
+        provider = GoogleBooksProvider('key', HttpClient(),
+                                       self.base + '/google/%s?key=%s')
+
+        with self.assertRaises(ProviderResponseError):
+            provider.lookup('9780000000002')
+
+    def test_openLibrary_unexpectedResponse(self):
+        provider = OpenLibraryProvider(HttpClient(), self.base + '/openlibrary/%s')
+
+        with self.assertRaises(ProviderResponseError):
+            provider.lookup('9780000000002')
+
+    def test_serverError(self):
+        provider = OpenLibraryProvider(HttpClient(), self.base + '/error/%s')
+
+        with self.assertRaises(requests.RequestException):
+            provider.lookup('9780062060624')
+
+
+class TestLatencyStats(unittest.TestCase):
+
+    def test_percentileNeedsSamples(self):
+        stats = LatencyStats()
+        for _ in range(LatencyStats.MIN_SAMPLES - 1):
+            stats.record('found', 0.1)
+
+        self.assertIsNone(stats.percentile(95))
+        stats.record('found', 0.1)
+        self.assertEqual(stats.percentile(95), 0.1)
+
+    def test_errorsNotInLatencies(self):
+        stats = LatencyStats()
+        for i in range(LatencyStats.MIN_SAMPLES):
+            stats.record('found', 0.1)
+        stats.record('error', 10)
+
+        self.assertEqual(stats.percentile(100), 0.1)
+        self.assertEqual(stats.summary()['errors'], 1)
+
+    def test_windowSlides(self):
+        stats = LatencyStats(window=LatencyStats.MIN_SAMPLES)
+        for _ in range(LatencyStats.MIN_SAMPLES):
+            stats.record('found', 1)
+        for _ in range(LatencyStats.MIN_SAMPLES):
+            stats.record('not_found', 0.2)
+
+        self.assertEqual(stats.percentile(100), 0.2)
+        self.assertEqual(stats.summary()['found'], LatencyStats.MIN_SAMPLES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import atexit
+from dataclasses import dataclass
+import heapq
+import threading
+import time
+
+from libraryserver.keys.keymanager import KeyManager
+from libraryserver.notifs.mailgun_client import Email
+
+_DIGEST_TEMPLATE = 'Activity Digest'
+_DIGEST_SUBJECT = 'You have %recipient.count% updates from Brian\'s Library'
+
+
+@dataclass(frozen=True)
+class _Pending:
+    subject: str
+    template: str
+    substitutions: dict
+
+
+class CoalescingEmail(Email):
+    """Email that holds each recipient's notifications for `window` seconds
+    before sending them.
+
+    A recipient with a single notification at the end of their window gets it
+    as usual. One with several gets a single digest instead, and every
+    recipient due a digest at the same time is covered by one batch send.
+    Must be shared across requests (rather than created per request) for the
+    coalescing to have any effect.
+
+    All sending happens on a single background thread, outside any request,
+    so it neither adds to a request's latency nor runs under its deadline.
+    Sends that fail are retried after `RETRY_SECS`, up to `MAX_ATTEMPTS`
+    times.
+    """
+
+    RETRY_SECS = 30
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, keymanager: KeyManager = None, window: float = 60, **kwargs):
+        super().__init__(keymanager, **kwargs)
+        self.window = window
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending: dict[str, list[_Pending]] = {}
+        self._due: dict[str, float] = {}  # recipient -> time to send
+        self._heap: list[tuple[float, str]] = []  # (due, recipient)
+        self._attempts: dict[str, int] = {}  # recipient -> failed sends so far
+        self._flusher = None
+        atexit.register(self.flush, force=True)
+
+    def send_message(self, to_emails, subject, template, substitutions) -> bool:
+        pending = _Pending(subject, template, substitutions)
+        with self._lock:
+            for to in to_emails:
+                if to not in self._pending:
+                    self._pending[to] = []
+                    self._schedule(to, time.monotonic() + self.window)
+                self._pending[to].append(pending)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._runFlusher,
+                                                 name='email-coalescer',
+                                                 daemon=True)
+                self._flusher.start()
+        return True
+
+    def _schedule(self, to: str, due: float):
+        # Called with the lock held
+        self._due[to] = due
+        heapq.heappush(self._heap, (due, to))
+        self._wakeup.notify()
+
+    def _runFlusher(self):
+        while True:
+            with self._wakeup:
+                while not self._heap:
+                    self._wakeup.wait()
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._wakeup.wait(delay)
+                    continue
+            self.flush()
+
+    def flush(self, force: bool = False):
+        """Sends everything whose window has passed (or everything at all, if
+        `force` is set).
+        """
+        now = time.monotonic()
+        with self._lock:
+            if force:
+                due = list(self._due)
+                self._heap.clear()
+            else:
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    t, to = heapq.heappop(self._heap)
+                    # Skip entries for windows that were already sent
+                    if self._due.get(to) == t:
+                        due.append(to)
+            batch = {to: self._pending.pop(to) for to in due}
+            for to in due:
+                del self._due[to]
+
+        digests = {}
+        for to, messages in batch.items():
+            if len(messages) == 1:
+                msg = messages[0]
+                sent = super().send_message([to], msg.subject, msg.template,
+                                            msg.substitutions)
+                self._sent(to, messages, sent)
+            else:
+                digests[to] = {
+                    'count': len(messages),
+                    'summary': '\n'.join(m.subject for m in messages)
+                }
+        if digests:
+            failed = set(self.send_batch(_DIGEST_SUBJECT, _DIGEST_TEMPLATE, digests))
+            for to in digests:
+                self._sent(to, batch[to], to not in failed)
+
+    def _sent(self, to: str, messages: list[_Pending], success: bool):
+        # Puts a failed send back in the queue, ahead of anything that arrived
+        # for this recipient since
+        with self._lock:
+            if success:
+                self._attempts.pop(to, None)
+                return
+            attempts = self._attempts.get(to, 0) + 1
+            if attempts >= self.MAX_ATTEMPTS:
+                self.logger.error('Giving up on %d emails to %s after %d attempts',
+                                  len(messages), to, attempts)
+                self._attempts.pop(to, None)
+                return
+            self._attempts[to] = attempts
+            self._pending[to] = messages + self._pending.get(to, [])
+            if to not in self._due:
+                self._schedule(to, time.monotonic() + self.RETRY_SECS)
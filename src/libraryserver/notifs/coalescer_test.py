@@ -0,0 +1,162 @@
+import json
+import threading
+import time
+import unittest
+
+from libraryserver.notifs.coalescer import CoalescingEmail
+
+
+class RecordingCoalescingEmail(CoalescingEmail):
+
+    def __init__(self, window):
+        super().__init__(keymanager=None, window=window)
+        self.posts = []
+
+    def _post(self, data):
+        self.posts.append(data)
+        return True
+
+
+class FailingCoalescingEmail(RecordingCoalescingEmail):
+
+    def __init__(self, window, failures):
+        super().__init__(window)
+        self.failures = failures
+
+    def _post(self, data):
+        if self.failures > 0:
+            self.failures -= 1
+            return False
+        return super()._post(data)
+
+
+class TestCoalescingEmail(unittest.TestCase):
+
+    def setUp(self):
+        # Long enough that nothing is sent in the background during a test
+        self.email = RecordingCoalescingEmail(window=3600)
+
+    def test_holdsUntilFlushed(self):
+        self.email.send_message(['a@example.com'], 'Subject', 'Template', {})
+
+        self.assertEqual(self.email.posts, [])
+
+    def test_flush_onlySendsDue(self):
+        self.email.send_message(['a@example.com'], 'Subject', 'Template', {})
+
+        self.email.flush()
+
+        self.assertEqual(self.email.posts, [])
+
+    def test_flush_singleMessageSentAsIs(self):
+        self.email.send_message(['a@example.com'], 'Subject', 'Template', {'x': 1})
+
+        self.email.flush(force=True)
+
+        self.assertEqual(len(self.email.posts), 1)
+        post = self.email.posts[0]
+        self.assertEqual(post['to'], ['a@example.com'])
+        self.assertEqual(post['subject'], 'Subject')
+        self.assertEqual(post['template'], 'Template')
+        self.assertEqual(json.loads(post['h:X-Mailgun-Variables']), {'x': 1})
+
+    def test_flush_digestsBatched(self):
+        self.email.send_message(['a@example.com'], 'One', 'Template', {})
+        self.email.send_message(['a@example.com'], 'Two', 'Template', {})
+        self.email.send_message(['b@example.com'], 'Three', 'Template', {})
+        self.email.send_message(['b@example.com'], 'Four', 'Template', {})
+
+        self.email.flush(force=True)
+
+        self.assertEqual(len(self.email.posts), 1)
+        post = self.email.posts[0]
+        self.assertCountEqual(post['to'], ['a@example.com', 'b@example.com'])
+        self.assertEqual(json.loads(post['recipient-variables']), {
+            'a@example.com': {'count': 2, 'summary': 'One\nTwo'},
+            'b@example.com': {'count': 2, 'summary': 'Three\nFour'},
+        })
+
+    def test_flush_clearsPending(self):
+        self.email.send_message(['a@example.com'], 'Subject', 'Template', {})
+
+        self.email.flush(force=True)
+        self.email.flush(force=True)
+
+        self.assertEqual(len(self.email.posts), 1)
+
+    def test_windowElapsed(self):
+        email = RecordingCoalescingEmail(window=0)
+        email.send_message(['a@example.com'], 'Subject', 'Template', {})
+
+        email.flush()
+
+        self.assertEqual(len(email.posts), 1)
+
+
+    def test_sendDoesNotFlush(self):
+        email = RecordingCoalescingEmail(window=0)
+        email._flusher = threading.current_thread()  # Nothing in the background
+        email.send_message(['a@example.com'], 'One', 'Template', {})
+
+        email.send_message(['b@example.com'], 'Two', 'Template', {})
+
+        self.assertEqual(email.posts, [])
+
+    def test_failedSendRequeued(self):
+        email = FailingCoalescingEmail(window=3600, failures=1)
+        email.send_message(['a@example.com'], 'One', 'Template', {})
+        email.send_message(['a@example.com'], 'Two', 'Template', {})
+
+        email.flush(force=True)
+        email.send_message(['a@example.com'], 'Three', 'Template', {})
+        email.flush(force=True)
+
+        self.assertEqual(len(email.posts), 1)
+        self.assertEqual(json.loads(email.posts[0]['recipient-variables']), {
+            'a@example.com': {'count': 3, 'summary': 'One\nTwo\nThree'},
+        })
+
+    def test_failedSendRetried(self):
+        email = FailingCoalescingEmail(window=0, failures=1)
+        email.RETRY_SECS = 0
+        email._flusher = threading.current_thread()  # Nothing in the background
+        email.send_message(['a@example.com'], 'One', 'Template', {})
+
+        email.flush()
+        email.flush()
+
+        self.assertEqual(len(email.posts), 1)
+
+    def test_failedSendGivesUp(self):
+        email = FailingCoalescingEmail(window=0, failures=100)
+        email.RETRY_SECS = 0
+        email._flusher = threading.current_thread()  # Nothing in the background
+        email.send_message(['a@example.com'], 'One', 'Template', {})
+
+        with self.assertLogs('libraryserver.notifs.mailgun_client', 'ERROR'):
+            for _ in range(email.MAX_ATTEMPTS + 1):
+                email.flush()
+
+        self.assertEqual(email._pending, {})
+
+    def test_oneFlusherThread(self):
+        before = threading.active_count()
+
+        for i in range(20):
+            self.email.send_message(['%d@example.com' % i], 'Subject', 'Template', {})
+
+        self.assertEqual(threading.active_count(), before + 1)
+
+    def test_flusherSendsInBackground(self):
+        email = RecordingCoalescingEmail(window=0.01)
+        email.send_message(['a@example.com'], 'Subject', 'Template', {})
+
+        deadline = time.monotonic() + 5
+        while not email.posts and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(len(email.posts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,12 +3,18 @@ import logging
 import re
 import requests
 
-from libraryserver.api.models import Book, User
+from libraryserver.api.errors import DeadlineExceededException
+from libraryserver.api.models import Book, User, Loan
 from libraryserver.keys.keymanager import KeyManager
+from libraryserver.outbound.client import HTTP_CLIENT, HttpClient
 
 _EMAIL_FROM = 'Brian\'s Library <library@mcswiggen.me>'
 _CHECKOUT_TEMPLATE = 'Checkout Notification'
 _RETURN_TEMPLATE = 'Return Notification'
+_OVERDUE_TEMPLATE = 'Overdue Reminder'
+_MESSAGES_ENDPOINT = 'https://api.mailgun.net/v3/mg.mcswiggen.me/messages'
+# Mailgun's limit on recipients per batch send
+_MAX_BATCH_RECIPIENTS = 1000
 # Could be better, but this is sufficient for now
 _VALID_EMAIL_PATTERN = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
 
@@ -17,9 +23,10 @@ class Email:
 
     API_KEY_NAME = 'mailgun_sending_key'
 
-    def __init__(self, keymanager: KeyManager = None):
+    def __init__(self, keymanager: KeyManager = None, http: HttpClient = HTTP_CLIENT):
         self.logger = logging.getLogger(__name__)
-        
+        self.http = http
+
         if keymanager is None:
             self.logger.warning('No API key provided, emails will not be sent')
             self.api_key = ''
@@ -56,22 +63,76 @@ class Email:
         subject = 'Thanks for returning \'%s\'' % book.title
         self.send_message([user.email], subject, _RETURN_TEMPLATE, subs)
 
-    def send_message(self, to_emails, subject, template, substitutions):
+    def send_overdue_message(self, user: User, loans: list[Loan]):
+        subs = {
+            'user': {
+                'name': user.name
+            },
+            'books': [{
+                'title': loan.title,
+                'author': loan.author,
+                'checkout_time': loan.checkout_time
+            } for loan in loans]
+        }
+        if len(loans) == 1:
+            subject = 'Reminder: you still have \'%s\'' % loans[0].title
+        else:
+            subject = 'Reminder: you still have %d borrowed books' % len(loans)
+        self.send_message([user.email], subject, _OVERDUE_TEMPLATE, subs)
+
+    def send_message(self, to_emails, subject, template, substitutions) -> bool:
+        """Returns False if sending failed but may succeed if retried."""
         to_emails = list(filter(self._validate_email, to_emails))
         if not to_emails:
             self.logger.warning('No valid emails; skipping notification')
-            return
+            return True
         subs = json.dumps(substitutions)
-        resp = requests.post(
-            'https://api.mailgun.net/v3/mg.mcswiggen.me/messages',
-            auth=('api', self.api_key),
-  	    data={'from': _EMAIL_FROM,
-                'to': to_emails,
-  		'subject': subject,
-                'template': template,
-  		'h:X-Mailgun-Variables': subs})
-        print(resp.status_code)
-        print(resp.text)
+        return self._post({'from': _EMAIL_FROM,
+                    'to': to_emails,
+                    'subject': subject,
+                           'template': template,
+                           'h:X-Mailgun-Variables': subs})
+
+    def send_batch(self, subject, template, recipient_vars: dict[str, dict]) -> list[str]:
+        """Sends one templated message to many recipients, with as few API
+        calls as possible. `recipient_vars` maps each recipient's address to
+        their own (flat) variables, which the subject and template can refer
+        to as %recipient.<name>%. Each recipient only sees their own address.
+        Returns the recipients whose send failed and is worth retrying.
+        """
+        recipient_vars = {to: v for to, v in recipient_vars.items()
+                          if self._validate_email(to)}
+        if not recipient_vars:
+            self.logger.warning('No valid emails; skipping notification')
+            return []
+        recipients = list(recipient_vars.keys())
+        failed = []
+        for i in range(0, len(recipients), _MAX_BATCH_RECIPIENTS):
+            chunk = recipients[i:i + _MAX_BATCH_RECIPIENTS]
+            if not self._post({'from': _EMAIL_FROM,
+                               'to': chunk,
+                               'subject': subject,
+                               'template': template,
+                               'recipient-variables': json.dumps(
+                                   {to: recipient_vars[to] for to in chunk})}):
+                failed += chunk
+        return failed
+
+    def _post(self, data: dict) -> bool:
+        # Returns False if the send failed but might work if retried
+        try:
+            resp = self.http.post(_MESSAGES_ENDPOINT, auth=('api', self.api_key),
+                                  data=data)
+        except (requests.RequestException, DeadlineExceededException) as e:
+            # A notification isn't worth failing the checkout/return over
+            self.logger.error('Could not send "%s" email', data['subject'], exc_info=e)
+            return False
+        if resp.status_code >= 400:
+            self.logger.error('Mailgun rejected "%s" email: %d %s', data['subject'],
+                              resp.status_code, resp.text)
+            return resp.status_code < 500 and resp.status_code != 429
+        self.logger.debug('Sent "%s" email: %s', data['subject'], resp.text)
+        return True
 
     def send_test_message(self):
         book = Book('isbn', 'Babel', 'R.F. Kuang', '', '',
@@ -91,6 +152,7 @@ class FakeEmail(Email):
 
     def send_message(self, to_emails, subject, template, substitutions):
         print(to_emails, subject, template, substitutions)
+        return True
 
 if __name__ == '__main__':
     email = Email()
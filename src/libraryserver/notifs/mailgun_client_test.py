@@ -1,7 +1,19 @@
+import json
 import unittest
 
 from libraryserver.notifs.mailgun_client import Email
 
+
+class RecordingEmail(Email):
+
+    def __init__(self):
+        super().__init__(keymanager=None)
+        self.posts = []
+
+    def _post(self, data):
+        self.posts.append(data)
+        return True
+
 class TestMailgunClient(unittest.TestCase):
 
     def setUp(self):
@@ -13,6 +25,28 @@ class TestMailgunClient(unittest.TestCase):
         self.assertFalse(self.email._validate_email('email'))
         self.assertFalse(self.email._validate_email('@gmail.com'))
         self.assertFalse(self.email._validate_email('foo@bar'))
+
+    def test_send_batch(self):
+        email = RecordingEmail()
+
+        email.send_batch('Hi %recipient.name%', 'Template', {
+            'a@example.com': {'name': 'A'},
+            'not-an-email': {'name': 'B'},
+            'c@example.com': {'name': 'C'},
+        })
+
+        self.assertEqual(len(email.posts), 1)
+        self.assertEqual(email.posts[0]['to'], ['a@example.com', 'c@example.com'])
+        self.assertEqual(json.loads(email.posts[0]['recipient-variables']),
+                         {'a@example.com': {'name': 'A'}, 'c@example.com': {'name': 'C'}})
+
+    def test_send_batch_chunked(self):
+        email = RecordingEmail()
+
+        email.send_batch('Hi', 'Template',
+                         {'user%d@example.com' % i: {} for i in range(1500)})
+
+        self.assertEqual([len(p['to']) for p in email.posts], [1000, 500])
                         
 
 if __name__ == '__main__':
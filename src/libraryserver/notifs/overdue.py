@@ -0,0 +1,61 @@
+"""Sends reminder emails for books that have been out too long.
+
+Meant to be run on a schedule (e.g. daily) with
+`python -m libraryserver.notifs.overdue`. Only reads the `outbooks` index,
+never the full `books` or `actionlogs` collections. Pass `--rebuild` once to
+build that index from existing data.
+"""
+
+import argparse
+import logging
+
+from libraryserver.api.models import Action
+from libraryserver.keys.keymanager import KeyManager
+from libraryserver.storage.firestore_client import Database, connect
+from libraryserver.storage.local import LocalBookService
+
+OVERDUE_DAYS = 28
+REMIND_DAYS = 7
+
+logger = logging.getLogger(__name__)
+
+
+def rebuildOutIndex(db: Database) -> int:
+    """Recreates the `outbooks` index from the latest log of every book.
+    Returns the number of checked-out books found.
+    """
+    stale = {loan.id for loan in db.listOutBooks()}
+    count = 0
+    for book_id in db.listBookIds():
+        log = db.getLatestLog(book_id)
+        if log is None or log.get("action") != Action.CHECKOUT.value:
+            continue
+        book = db.books_ref.document(book_id).get()
+        db.putOutBook(book_id, book.get("owner_id"), book.get("isbn"),
+                      book.get("title"), book.get("author"), log.get("user_id"),
+                      log.get("timestamp"))
+        stale.discard(book_id)
+        count += 1
+    for book_id in stale:
+        db.deleteOutBook(book_id)
+    db.markOutBooksComplete()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--overdue-days', type=int, default=OVERDUE_DAYS,
+                        help='send reminders for loans older than this')
+    parser.add_argument('--remind-days', type=int, default=REMIND_DAYS,
+                        help='minimum days between reminders for a loan')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild the checked-out index before sweeping')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = Database(connect())
+    if args.rebuild:
+        logger.info('Indexed %d checked-out books', rebuildOutIndex(db))
+    books = LocalBookService(db)
+    sent = books.sendOverdueReminders(args.overdue_days, args.remind_days)
+    logger.info('Sent %d reminders', sent)
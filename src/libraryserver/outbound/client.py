@@ -0,0 +1,202 @@
+from collections.abc import Callable
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from libraryserver import deadline
+from libraryserver.accesslog import recordCall
+from libraryserver.api.errors import DeadlineExceededException
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to a host that has been failing."""
+
+
+class CircuitBreaker:
+    """Stops calls to a dependency after `failure_threshold` consecutive
+    failures. After `reset_after` seconds, lets a single trial call through:
+    if it succeeds the circuit closes again, otherwise it stays open for
+    another `reset_after` seconds.
+    """
+
+    def __init__(self, failure_threshold: int, reset_after: float):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if (time.monotonic() - self._opened_at >= self.reset_after and
+                    not self._trial_running):
+                self._trial_running = True
+                return True
+            return False
+
+    def record(self, success: bool):
+        with self._lock:
+            self._trial_running = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def cancel(self):
+        """Ends a call without recording an outcome, e.g. when the caller gave
+        up on it.
+        """
+        with self._lock:
+            self._trial_running = False
+
+
+class HttpClient:
+    """Shared client for all outbound HTTP calls.
+
+    Keeps a pool of keep-alive connections per host, caps how many requests
+    may be in flight to any one host, applies connect/read timeouts to every
+    request, and trips a per-host circuit breaker when a host keeps failing
+    (connection errors, timeouts or 5xx responses).
+
+    Timeouts are cut down to what's left of the current request's deadline.
+    Calls that run out of it raise DeadlineExceededException, and don't count
+    against the host.
+
+    A `stream=True` response keeps its host slot until it's closed, since
+    reading the body is where streamed calls spend their time, so callers
+    must close it (e.g. with `with`).
+    """
+
+    CONNECT_TIMEOUT = 3.05
+    READ_TIMEOUT = 10
+    MAX_PER_HOST = 8
+    FAILURE_THRESHOLD = 5
+    RESET_AFTER_SECS = 30
+
+    def __init__(self, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 max_per_host: int = MAX_PER_HOST,
+                 failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_after: float = RESET_AFTER_SECS):
+        self.logger = logging.getLogger(__name__)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_per_host = max_per_host
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max_per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._limits: dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method: str, url: str, timeout: float|tuple|None = None,
+                **kwargs) -> requests.Response:
+        """Sends a request, like `requests.request`. `timeout` defaults to the
+        client's (connect, read) timeouts.
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, tuple):
+            timeout = tuple(deadline.bound(t) for t in timeout)
+        else:
+            timeout = deadline.bound(timeout)
+
+        recordCall('http.%s' % host)
+        release = self._acquireSlot(host)
+        try:
+            if not breaker.allow():
+                raise CircuitOpenError('Circuit open for %s' % host)
+            recorded = False
+            try:
+                resp = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.Timeout as e:
+                if deadline.expired():
+                    raise DeadlineExceededException(
+                        'Request deadline exceeded calling %s' % host) from e
+                breaker.record(False)
+                recorded = True
+                raise
+            except requests.RequestException:
+                breaker.record(False)
+                recorded = True
+                raise
+            else:
+                breaker.record(resp.status_code < 500)
+                recorded = True
+            finally:
+                # Anything else (including running out of time) says nothing
+                # about the host, but mustn't leave a trial call running
+                if not recorded:
+                    breaker.cancel()
+        except BaseException:
+            release()
+            raise
+        if kwargs.get('stream'):
+            close = resp.close
+            def closeAndRelease():
+                try:
+                    close()
+                finally:
+                    release()
+            resp.close = closeAndRelease
+        else:
+            release()
+        return resp
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold,
+                                                      self.reset_after)
+            return self._breakers[host]
+
+    def _acquireSlot(self, host: str) -> Callable[[], None]:
+        # Returns a function that gives the slot back (only once, however
+        # many times it's called)
+        with self._lock:
+            if host not in self._limits:
+                self._limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            limit = self._limits[host]
+        # Waiting for a free slot counts against the connect timeout
+        if not limit.acquire(timeout=deadline.bound(self.connect_timeout)):
+            if deadline.expired():
+                raise DeadlineExceededException(
+                    'Request deadline exceeded waiting for %s' % host)
+            raise requests.ConnectTimeout(
+                'Too many concurrent requests to %s' % host)
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if released:
+                    return
+                released = True
+            limit.release()
+        return release
+
+
+HTTP_CLIENT = HttpClient()
@@ -0,0 +1,167 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+import unittest
+
+import requests
+
+from libraryserver import deadline
+from libraryserver.api.errors import DeadlineExceededException
+from libraryserver.outbound.client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_GET(self):
+        type(self).connections.add(self.client_address)
+        if self.path == '/slow':
+            time.sleep(0.5)
+        status = 500 if self.path == '/error' else 200
+        body = b'ok'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpClient(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('localhost', 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = 'http://localhost:%d' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        _Handler.connections = set()
+
+    def test_get(self):
+        client = HttpClient()
+
+        resp = client.get(self.base + '/')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.text, 'ok')
+
+    def test_reusesConnections(self):
+        client = HttpClient()
+
+        for _ in range(5):
+            client.get(self.base + '/')
+
+        self.assertEqual(len(_Handler.connections), 1)
+
+    def test_readTimeout(self):
+        client = HttpClient(read_timeout=0.1)
+
+        with self.assertRaises(requests.Timeout):
+            client.get(self.base + '/slow')
+
+    def test_circuitOpensAfterFailures(self):
+        client = HttpClient(failure_threshold=2, reset_after=60)
+
+        client.get(self.base + '/error')
+        client.get(self.base + '/error')
+
+        with self.assertRaises(CircuitOpenError):
+            client.get(self.base + '/')
+
+    def test_circuitOpenIsRequestException(self):
+        client = HttpClient(failure_threshold=1, reset_after=60)
+        client.get(self.base + '/error')
+
+        with self.assertRaises(requests.RequestException):
+            client.get(self.base + '/')
+
+    def test_unexpectedErrorEndsTrial(self):
+        client = HttpClient(failure_threshold=1, reset_after=0)
+        client.get(self.base + '/error')
+
+        # Fails before sending, during the half-open trial
+        with self.assertRaises(TypeError):
+            client.get(self.base + '/', json=object())
+
+        self.assertEqual(client.get(self.base + '/').status_code, 200)
+
+    def test_deadlineCutsTimeout(self):
+        client = HttpClient(failure_threshold=1)
+
+        with deadline.scope(0.1):
+            with self.assertRaises(DeadlineExceededException):
+                client.get(self.base + '/slow')
+
+        # Running out of our own time doesn't count against the host
+        self.assertTrue(client.breaker(self.base[len('http://'):]).allow())
+
+    def test_deadlineAlreadyPassed(self):
+        client = HttpClient()
+
+        with deadline.scope(0):
+            with self.assertRaises(DeadlineExceededException):
+                client.get(self.base + '/')
+
+    def test_perHostLimit(self):
+        client = HttpClient(max_per_host=1, connect_timeout=0.1)
+        slow = threading.Thread(target=client.get, args=(self.base + '/slow',))
+        slow.start()
+        time.sleep(0.05)
+
+        with self.assertRaises(requests.ConnectTimeout):
+            client.get(self.base + '/')
+        slow.join()
+
+    def test_perHostLimitCoversStreamedBody(self):
+        client = HttpClient(max_per_host=1, connect_timeout=0.1)
+        resp = client.get(self.base + '/', stream=True)
+
+        with self.assertRaises(requests.ConnectTimeout):
+            client.get(self.base + '/')
+        resp.close()
+        resp.close()
+        self.assertEqual(client.get(self.base + '/').text, 'ok')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_closedByDefault(self):
+        self.assertTrue(CircuitBreaker(1, 60).allow())
+
+    def test_successResetsFailures(self):
+        breaker = CircuitBreaker(2, 60)
+
+        breaker.record(False)
+        breaker.record(True)
+        breaker.record(False)
+
+        self.assertTrue(breaker.allow())
+
+    def test_halfOpenAllowsOneTrial(self):
+        breaker = CircuitBreaker(1, 0)
+        breaker.record(False)
+
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertTrue(breaker.allow())
+
+    def test_failedTrialReopens(self):
+        breaker = CircuitBreaker(1, 60)
+        breaker.record(False)
+        breaker._opened_at -= 60
+
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertFalse(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,16 @@
+"""Quantiles of samples, for the benchmarks and for the adaptive timeouts
+that the server derives from observed latencies.
+"""
+
+import math
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Returns the `p`th percentile (0-100) of `values`, by the nearest-rank
+    method. Returns 0 for no values.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
@@ -0,0 +1,24 @@
+import unittest
+
+from libraryserver.quantiles import percentile
+
+
+class TestQuantiles(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+
+    def test_percentile_unsorted(self):
+        self.assertEqual(percentile([5, 1, 3], 50), 3)
+
+    def test_percentile_empty(self):
+        self.assertEqual(percentile([], 50), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Catalog of every book across all owners, keyed by ISBN.
+
+Each `catalog` document lists the copies of one ISBN (owner and whether it's
+out) along with search tokens for its title and author, so "who has this
+book" is a single indexed query instead of a scan of every library. The
+catalog is kept up to date by `LocalBookService`; run
+`python -m libraryserver.search.catalog` once to build it from existing data.
+"""
+
+import logging
+import re
+
+from libraryserver.api.models import Action
+from libraryserver.search.suggest import normalize
+from libraryserver.storage.firestore_client import Database, connect
+
+# Shortest word prefix that's indexed. Shorter query words are still matched,
+# just not used to look entries up.
+MIN_TOKEN_LEN = 2
+
+logger = logging.getLogger(__name__)
+
+
+def catalogTokens(title: str, author: str) -> list[str]:
+    """Returns the tokens to index a catalog entry under: every prefix (of at
+    least MIN_TOKEN_LEN characters) of every word in the title and author.
+    """
+    tokens = set()
+    for word in normalize('%s %s' % (title, author)).split():
+        for i in range(MIN_TOKEN_LEN, len(word) + 1):
+            tokens.add(word[:i])
+    return sorted(tokens)
+
+
+def looksLikeIsbn(query: str) -> bool:
+    return re.fullmatch(r'[0-9Xx-]{10,17}', query) is not None
+
+
+def queryWords(query: str) -> list[str]:
+    return normalize(query).split()
+
+
+def lookupToken(words: list[str]) -> str|None:
+    """Picks the query word to look entries up by (the longest, as the most
+    selective), or None if no word is long enough to be indexed.
+    """
+    longest = max(words, key=len, default='')
+    return longest if len(longest) >= MIN_TOKEN_LEN else None
+
+
+def matchesAll(title: str, author: str, words: list[str]) -> bool:
+    """True if every query word is a prefix of some word of the title or
+    author.
+    """
+    entry_words = normalize('%s %s' % (title, author)).split()
+    return all(any(w.startswith(q) for w in entry_words) for q in words)
+
+
+def rebuildCatalog(db: Database, chunk_size: int = 100) -> int:
+    """Adds every existing book to the catalog, with its current status.
+    Returns the number of books indexed.
+    """
+    count = 0
+    books = []
+    for book in db.books_ref.stream():
+        books.append(book)
+        if len(books) >= chunk_size:
+            count += _indexBooks(db, books)
+            books = []
+    if books:
+        count += _indexBooks(db, books)
+    return count
+
+
+def _indexBooks(db: Database, books) -> int:
+    latest = db.getLatestLogs([b.id for b in books])
+    for book in books:
+        log = latest.get(book.id)
+        is_out = log is not None and log.get("action") == Action.CHECKOUT.value
+        db.putCatalogCopy(book.get("isbn"), book.id, book.get("owner_id"),
+                          book.get("title"), book.get("author"),
+                          catalogTokens(book.get("title"), book.get("author")),
+                          is_out)
+    return len(books)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    logger.info('Indexed %d books', rebuildCatalog(Database(connect())))
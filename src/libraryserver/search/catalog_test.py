@@ -0,0 +1,36 @@
+import unittest
+
+from libraryserver.search.catalog import (
+    catalogTokens, looksLikeIsbn, lookupToken, matchesAll, queryWords)
+
+
+class TestCatalog(unittest.TestCase):
+
+    def test_catalogTokens(self):
+        self.assertEqual(catalogTokens('Babel', 'Kuang'),
+                         ['ba', 'bab', 'babe', 'babel',
+                          'ku', 'kua', 'kuan', 'kuang'])
+
+    def test_catalogTokens_normalizes(self):
+        self.assertIn('miserables', catalogTokens('Les Misérables', 'Hugo'))
+
+    def test_looksLikeIsbn(self):
+        self.assertTrue(looksLikeIsbn('9780062060624'))
+        self.assertTrue(looksLikeIsbn('0-06-206062-X'))
+        self.assertFalse(looksLikeIsbn('babel'))
+        self.assertFalse(looksLikeIsbn('12345'))
+
+    def test_lookupToken_picksLongest(self):
+        self.assertEqual(lookupToken(queryWords('the secret history')), 'history')
+
+    def test_lookupToken_tooShort(self):
+        self.assertIsNone(lookupToken(queryWords('a')))
+        self.assertIsNone(lookupToken([]))
+
+    def test_matchesAll(self):
+        self.assertTrue(matchesAll('The Secret History', 'Donna Tartt', ['sec', 'tar']))
+        self.assertFalse(matchesAll('The Secret History', 'Donna Tartt', ['sec', 'kuang']))
+
+
+if __name__ == '__main__':
+    unittest.main()
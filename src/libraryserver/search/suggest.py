@@ -0,0 +1,133 @@
+from bisect import bisect_left, insort
+from collections.abc import Iterable
+import re
+import threading
+import time
+import unicodedata
+
+from libraryserver.storage.firestore_client import Database
+
+
+def normalize(text: str) -> str:
+    """Lowercases, strips accents and punctuation, and collapses whitespace,
+    so "Cien años de soledad" and "cien anos de soledad" compare equal.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+class PrefixIndex:
+    """Sorted index of phrases for prefix completion.
+
+    Each phrase is indexed under its normalized form and under every suffix
+    that starts at a later word, so "for al" completes "Looking for Alaska".
+    Completions matching from the first word rank ahead of the rest; within
+    each group they're alphabetical.
+    """
+
+    def __init__(self):
+        self._display: dict[str, str] = {}  # normalized phrase -> original
+        self._starts: list[str] = []  # sorted normalized phrases
+        self._inner: list[tuple[str, str]] = []  # sorted (suffix, phrase)
+
+    @classmethod
+    def build(cls, phrases: Iterable[str]) -> 'PrefixIndex':
+        """Indexes all of these phrases at once, sorting once at the end
+        rather than inserting each in place as `add` does.
+        """
+        index = cls()
+        for phrase in phrases:
+            norm = index._register(phrase)
+            if norm:
+                index._starts.append(norm)
+                index._inner.extend(_suffixes(norm))
+        index._starts.sort()
+        index._inner.sort()
+        return index
+
+    def add(self, phrase: str):
+        norm = self._register(phrase)
+        if not norm:
+            return
+        insort(self._starts, norm)
+        for entry in _suffixes(norm):
+            insort(self._inner, entry)
+
+    def _register(self, phrase: str) -> str|None:
+        # Returns the phrase's normalized form if it's new to the index
+        norm = normalize(phrase)
+        if not norm or norm in self._display:
+            return None
+        self._display[norm] = phrase
+        return norm
+
+    def complete(self, prefix: str, k: int) -> list[str]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = []
+        i = bisect_left(self._starts, prefix)
+        while (i < len(self._starts) and len(found) < k and
+               self._starts[i].startswith(prefix)):
+            found.append(self._starts[i])
+            i += 1
+        i = bisect_left(self._inner, (prefix, ''))
+        while (i < len(self._inner) and len(found) < k and
+               self._inner[i][0].startswith(prefix)):
+            if self._inner[i][1] not in found:
+                found.append(self._inner[i][1])
+            i += 1
+        return [self._display[norm] for norm in found]
+
+
+def _suffixes(norm: str) -> list[tuple[str, str]]:
+    # The (suffix, phrase) entries for each later word of a normalized phrase
+    words = norm.split(' ')
+    return [(' '.join(words[i:]), norm) for i in range(1, len(words))]
+
+
+class SuggestIndex:
+    """Per-owner prefix indexes over book titles and authors.
+
+    An owner's index is built from their books the first time it's needed,
+    kept up to date by `addBook`, and rebuilt after `ttl` seconds to pick up
+    books created by other instances.
+    """
+
+    TTL_SECS = 300
+
+    def __init__(self, db: Database, ttl: float = TTL_SECS):
+        self.db = db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Keyed by str(owner_id), as callers pass either
+        self._indexes: dict[str, tuple[PrefixIndex, float]] = {}
+
+    def suggest(self, owner_id, prefix: str, k: int = 10) -> list[str]:
+        index = self._index(owner_id)
+        with self._lock:
+            return index.complete(prefix, k)
+
+    def addBook(self, owner_id, title: str, author: str):
+        with self._lock:
+            entry = self._indexes.get(str(owner_id))
+            if entry is None:
+                # Not built yet; it'll include this book when it is
+                return
+            index, _ = entry
+            index.add(title)
+            index.add(author)
+
+    def _index(self, owner_id) -> PrefixIndex:
+        with self._lock:
+            entry = self._indexes.get(str(owner_id))
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        books = self.db.listBooks(owner_id)
+        index = PrefixIndex.build(phrase for book in books
+                                  for phrase in (book.get("title"), book.get("author")))
+        with self._lock:
+            self._indexes[str(owner_id)] = (index, time.monotonic())
+        return index
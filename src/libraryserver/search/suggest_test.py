@@ -0,0 +1,119 @@
+import unittest
+
+from libraryserver.search.suggest import PrefixIndex, SuggestIndex, normalize
+
+
+class FakeBookDoc:
+
+    def __init__(self, title, author):
+        self.vals = {"title": title, "author": author}
+
+    def get(self, field):
+        return self.vals[field]
+
+
+class FakeDatabase:
+
+    def __init__(self, books):
+        self.books = books
+        self.list_calls = 0
+
+    def listBooks(self, user_id, search=None):
+        self.list_calls += 1
+        return [FakeBookDoc(t, a) for t, a in self.books.get(user_id, [])]
+
+
+class TestNormalize(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(normalize('Cien Años de  Soledad!'), 'cien anos de soledad')
+        self.assertEqual(normalize('R.F. Kuang'), 'r f kuang')
+        self.assertEqual(normalize(None), '')
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        for phrase in ['Looking for Alaska', 'John Green', 'Babel',
+                       'Babel-17', 'Samuel R. Delany', 'Alanna']:
+            self.index.add(phrase)
+
+    def test_complete_firstWord(self):
+        self.assertEqual(self.index.complete('bab', 10), ['Babel', 'Babel-17'])
+
+    def test_complete_laterWordRanksAfter(self):
+        self.assertEqual(self.index.complete('al', 10), ['Alanna', 'Looking for Alaska'])
+
+    def test_complete_multiWord(self):
+        self.assertEqual(self.index.complete('for ala', 10), ['Looking for Alaska'])
+
+    def test_complete_ignoresCaseAndAccents(self):
+        self.index.add('Les Misérables')
+        self.assertEqual(self.index.complete('MISER', 10), ['Les Misérables'])
+
+    def test_complete_limit(self):
+        self.assertEqual(self.index.complete('bab', 1), ['Babel'])
+
+    def test_complete_empty(self):
+        self.assertEqual(self.index.complete('', 10), [])
+        self.assertEqual(self.index.complete('zzz', 10), [])
+
+    def test_add_duplicate(self):
+        self.index.add('babel')
+        self.assertEqual(self.index.complete('bab', 10), ['Babel', 'Babel-17'])
+
+    def test_build_matchesAdd(self):
+        phrases = ['Looking for Alaska', 'John Green', 'Babel', 'Babel-17',
+                   'Samuel R. Delany', 'Alanna', 'babel', None]
+
+        built = PrefixIndex.build(phrases)
+
+        self.assertEqual(built._starts, self.index._starts)
+        self.assertEqual(built._inner, self.index._inner)
+        built.add('Bleak House')
+        self.assertEqual(built.complete('b', 10), ['Babel', 'Babel-17', 'Bleak House'])
+
+
+class TestSuggestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase({
+            1: [('Babel', 'R.F. Kuang'), ('Looking for Alaska', 'John Green')],
+            2: [('Bleak House', 'Charles Dickens')],
+        })
+
+    def test_suggest_perOwner(self):
+        suggest = SuggestIndex(self.db)
+
+        self.assertEqual(suggest.suggest(1, 'b'), ['Babel'])
+        self.assertEqual(suggest.suggest(2, 'b'), ['Bleak House'])
+
+    def test_suggest_buildsOnce(self):
+        suggest = SuggestIndex(self.db)
+
+        suggest.suggest(1, 'b')
+        suggest.suggest(1, 'j')
+
+        self.assertEqual(self.db.list_calls, 1)
+
+    def test_suggest_rebuildsAfterTtl(self):
+        suggest = SuggestIndex(self.db, ttl=0)
+
+        suggest.suggest(1, 'b')
+        suggest.suggest(1, 'b')
+
+        self.assertEqual(self.db.list_calls, 2)
+
+    def test_addBook(self):
+        suggest = SuggestIndex(self.db)
+        suggest.suggest(1, 'b')
+
+        suggest.addBook(1, 'Binti', 'Nnedi Okorafor')
+
+        self.assertEqual(suggest.suggest(1, 'b'), ['Babel', 'Binti'])
+        self.assertEqual(suggest.suggest(1, 'okor'), ['Nnedi Okorafor'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""Moves old action logs out of the hot `actionlogs` collection.
+
+Each book keeps its most recent logs (and anything newer than the minimum
+age) in `actionlogs`; everything older is folded into a single per-book
+document in `logarchive`. History reads merge the two, so compaction is
+invisible to API callers.
+
+Run periodically with `python -m libraryserver.storage.compaction`.
+"""
+
+import argparse
+from datetime import datetime, timedelta, UTC
+import logging
+
+from libraryserver.storage.firestore_client import Database, connect
+
+# Always leave at least this many of a book's latest logs in place, so
+# getLatestLog never has to look at the archive.
+KEEP_RECENT = 10
+# Never archive logs younger than this. Windowed queries (rankings, sync)
+# rely on recent logs being in the hot collection.
+MIN_AGE = timedelta(days=90)
+
+logger = logging.getLogger(__name__)
+
+
+def compactBook(db: Database, book_id: str, keep: int = KEEP_RECENT,
+                min_age: timedelta = MIN_AGE) -> int:
+    """Archives this book's old logs. Returns how many were archived."""
+    before = datetime.now(UTC) - min_age
+    logs = db.listLogsForCompaction(book_id, keep, before)
+    if logs:
+        db.archiveLogs(book_id, logs)
+    return len(logs)
+
+
+def compactAll(db: Database, keep: int = KEEP_RECENT,
+               min_age: timedelta = MIN_AGE) -> int:
+    """Archives old logs for every book. Returns how many were archived."""
+    total = 0
+    for book_id in db.listBookIds():
+        count = compactBook(db, book_id, keep, min_age)
+        if count:
+            logger.info('Archived %d logs for book %s', count, book_id)
+        total += count
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keep', type=int, default=KEEP_RECENT,
+                        help='number of recent logs to keep per book')
+    parser.add_argument('--min-age-days', type=int, default=MIN_AGE.days,
+                        help='only archive logs older than this')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    total = compactAll(Database(connect()), args.keep,
+                       timedelta(days=args.min_age_days))
+    logger.info('Archived %d logs in total', total)
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, UTC
+from firebase_admin import credentials, firestore, initialize_app
+import os
+import requests
+import time
+import unittest
+
+from libraryserver.api.models import Action
+from libraryserver.storage.compaction import compactAll, compactBook
+from libraryserver.storage.firestore_client import Database
+from libraryserver.storage.testbase import BaseTestCase
+
+LOCAL_EMULATOR = "localhost:8287"
+
+# Start the emulator with `gcloud emulators firestore start --host-port=localhost:8287`
+os.environ["FIRESTORE_EMULATOR_HOST"] = LOCAL_EMULATOR
+cred = credentials.Certificate('run-web-efd188ab2632.json')
+initialize_app(cred, {"projectId": "demo-project"})
+
+class TestCompaction(BaseTestCase):
+
+    def setUp(self):
+        self.db = Database(firestore.client())
+
+    def tearDown(self):
+        del_url = (
+            "http://%s/emulator/v1/projects/demo-project/databases/(default)/documents" %
+            LOCAL_EMULATOR
+        )
+        requests.delete(del_url)
+
+    def _putLogs(self, book_id, *entries):
+        for action, user_id in entries:
+            self.db.putLog(book_id, action, user_id)
+            time.sleep(0.01)
+
+    def test_compactBook_keepsRecent(self):
+        self._putLogs('id1', (Action.CREATE, 0), (Action.CHECKOUT, 1234),
+                      (Action.RETURN, 1234), (Action.CHECKOUT, 5678))
+
+        count = compactBook(self.db, 'id1', keep=2, min_age=timedelta(0))
+
+        self.assertEqual(count, 2)
+        self.assertEqual(len(self.db.listLogsForCompaction('id1', 0, self._future())), 2)
+        self.assertEqual(self.db.getLatestLog('id1').get("action"), Action.CHECKOUT.value)
+
+    def test_compactBook_respectsMinAge(self):
+        self._putLogs('id1', (Action.CREATE, 0), (Action.CHECKOUT, 1234))
+
+        count = compactBook(self.db, 'id1', keep=0, min_age=timedelta(days=1))
+
+        self.assertEqual(count, 0)
+
+    def test_compactAll(self):
+        b1 = self.db.putBook('isbn1', 1, '', '', '', '', '')
+        b2 = self.db.putBook('isbn2', 1, '', '', '', '', '')
+        self._putLogs(b1, (Action.CREATE, 0), (Action.CHECKOUT, 1234))
+        self._putLogs(b2, (Action.CREATE, 0))
+
+        count = compactAll(self.db, keep=1, min_age=timedelta(0))
+
+        self.assertEqual(count, 1)
+        self.assertEqual(len(self.db.listLogsByBook(b1)), 2)
+
+    def test_listLogsByBook_mergesArchive(self):
+        self._putLogs('id1', (Action.CREATE, 0), (Action.CHECKOUT, 1234),
+                      (Action.RETURN, 1234), (Action.CHECKOUT, 5678))
+        compactBook(self.db, 'id1', keep=1, min_age=timedelta(0))
+
+        res = self.db.listLogsByBook('id1')
+
+        self.assertEqual([l.get("action") for l in res],
+                         [Action.CREATE.value, Action.CHECKOUT.value,
+                          Action.RETURN.value, Action.CHECKOUT.value])
+        self.assertEqual(res[0].to_dict()["book_id"], 'id1')
+
+    def test_listLogsByUser_mergesArchive(self):
+        self._putLogs('id1', (Action.CHECKOUT, 1234), (Action.RETURN, 1234),
+                      (Action.CHECKOUT, 5678))
+        self._putLogs('id2', (Action.CHECKOUT, 1234))
+        compactBook(self.db, 'id1', keep=1, min_age=timedelta(0))
+
+        res = self.db.listLogsByUser(1234)
+
+        self.assertEqual([(l.get("book_id"), l.get("action")) for l in res],
+                         [('id1', Action.CHECKOUT.value),
+                          ('id1', Action.RETURN.value),
+                          ('id2', Action.CHECKOUT.value)])
+
+    def _future(self):
+        return datetime.now(UTC) + timedelta(days=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
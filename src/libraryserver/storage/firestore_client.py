@@ -1,72 +1,237 @@
-from firebase_admin import firestore
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import ServiceUnavailable
+from google.api_core.retry import Retry, if_exception_type, if_transient_error
 from google.cloud.firestore_v1.base_document import DocumentSnapshot
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.cloud.firestore_v1.batch import WriteBatch
 from google.cloud.firestore_v1.client import Client
+from google.cloud.firestore_v1.transaction import Transaction
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import datetime
 import logging
 
+from libraryserver import deadline
+from libraryserver.api.errors import AlreadyExistsException
 from libraryserver.api.models import Action
+from libraryserver.config import APP_CONFIG
+from libraryserver.isbn import bookKey, canonical
+
+# Runs the per-book queries of bulk reads side by side
+_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='firestore')
+
+
+def connect() -> Client:
+    """Initializes the Firebase app (if needed) and returns a Firestore client.
+    Uses the configured service account key in dev, and application default
+    credentials otherwise.
+    """
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        if APP_CONFIG.firestore_apikey_file():
+            cred = credentials.Certificate(APP_CONFIG.firestore_apikey_file())
+            firebase_admin.initialize_app(cred)
+        else:
+            firebase_admin.initialize_app()
+    return firestore.client()
+
+
+class ArchivedLog:
+    """A log entry that has been compacted into a book's archive document.
+
+    Quacks like the DocumentSnapshots returned for live logs, so callers can
+    treat archived and recent logs the same way.
+    """
+
+    def __init__(self, book_id: str, entry: dict):
+        self.id = entry["log_id"]
+        self._vals = {
+            "book_id": book_id,
+            "timestamp": entry["timestamp"],
+            "action": entry["action"],
+            "user_id": entry["user_id"]
+        }
+
+    def get(self, field: str):
+        return self._vals[field]
+
+    def to_dict(self) -> dict:
+        return dict(self._vals)
 
 
 class Database:
 
     def __init__(self, cli: Client):
+        self.cli = cli
         self.books_ref = cli.collection('books')
         self.logs_ref = cli.collection('actionlogs')
         self.users_ref = cli.collection('users')
+        self.bookstats_ref = cli.collection('bookstats')
+        self.userstats_ref = cli.collection('userstats')
+        self.archive_ref = cli.collection('logarchive')
+        self.outbooks_ref = cli.collection('outbooks')
+        self.meta_ref = cli.collection('meta')
+        self.userindex_ref = cli.collection('userindex')
+        self.catalog_ref = cli.collection('catalog')
+        self.rankings_ref = cli.collection('rankings')
         self.logger = logging.getLogger(__name__)
 
-    def getBook(self, isbn: str) -> DocumentSnapshot|None:
-        books = self.books_ref.where(filter=FieldFilter("isbn", "==", isbn)).get()
-        if len(books) == 0:
-            return None
+    def _rpc(self, idempotent: bool = True) -> dict:
+        """Timeout and retry settings for a Firestore call, cut down to what's
+        left of the current request's deadline (if there is one). Raises
+        DeadlineExceededException if nothing is left.
+
+        Non-idempotent writes (e.g. counter increments) are only retried if
+        Firestore was unavailable, since otherwise they may have been applied.
+        """
+        timeout = deadline.bound(None)
+        if timeout is None:
+            return {}
+        predicate = (if_transient_error if idempotent
+                     else if_exception_type(ServiceUnavailable))
+        return {"timeout": timeout,
+                "retry": Retry(predicate=predicate, timeout=timeout)}
+
+    def batch(self) -> WriteBatch:
+        """Starts a batch of writes, for the write methods that take a `batch`
+        (which add to it rather than writing straight away). Commit it with
+        `commit`.
+        """
+        return self.cli.batch()
+
+    def commit(self, batch: WriteBatch, idempotent: bool = True) -> datetime:
+        """Applies every write in `batch` at once. Returns the commit time,
+        which is what any SERVER_TIMESTAMP fields were set to.
+        """
+        batch.commit(**self._rpc(idempotent))
+        return batch.commit_time
+
+    def getBook(self, isbn: str, owner_id: int|None = None) -> DocumentSnapshot|None:
+        """Gets a book by ISBN. With `owner_id`, gets the first copy in that
+        library by its key (a direct read); otherwise, the first copy in any
+        library.
+        """
+        if owner_id is not None:
+            book = self.books_ref.document(bookKey(owner_id, isbn)).get(**self._rpc())
+            if book.exists:
+                return book
+            # Books not yet rekeyed by storage.rekey can only be queried
+            books = self._queryBooks(isbn, owner_id)
         else:
-            return books[0]
+            books = self._queryBooks(isbn)
+        return books[0] if books else None
+
+    def getBookCopies(self, isbn: str, owner_id: int) -> list[DocumentSnapshot]:
+        """Gets every copy of this book in this library, first copy first."""
+        first = self.books_ref.document(bookKey(owner_id, isbn)).get(**self._rpc())
+        if not first.exists:
+            return self._queryBooks(isbn, owner_id)
+        copies = first.to_dict().get("copies", 1)
+        if copies == 1:
+            return [first]
+        refs = [self.books_ref.document(bookKey(owner_id, isbn, n))
+                for n in range(2, copies + 1)]
+        rest = [book for book in self.cli.get_all(refs, **self._rpc()) if book.exists]
+        return [first] + sorted(rest, key=lambda b: b.get("copy"))
+
+    def _queryBooks(self, isbn: str, owner_id: int|None = None) -> list[DocumentSnapshot]:
+        query = self.books_ref.where(filter=FieldFilter("isbn", "==", isbn))
+        if owner_id is not None:
+            query = query.where(filter=_ownerFilter(owner_id))
+        return query.get(**self._rpc())
+
+    def getBooksById(self, book_ids: list[str]) -> list[DocumentSnapshot]:
+        """Fetches these books in a single batched read. Books that don't
+        exist are omitted; the rest are returned in no particular order.
+        """
+        refs = [self.books_ref.document(book_id) for book_id in book_ids]
+        return [book for book in self.cli.get_all(refs, **self._rpc()) if book.exists]
 
-    def putBook(self, isbn, owner_id, title, author, cat, year, img):
-        book = self.books_ref.document()
-        book.set({
+    def putBook(self, isbn, owner_id, title, author, cat, year, img,
+                also: Callable[[Transaction, str], None]|None = None):
+        """Adds a book, keyed by owner and ISBN (see isbn.bookKey). If the
+        owner already has this book, it's added as their next copy. Returns
+        the new book's ID.
+
+        `also(transaction, book_id)`, if given, may add further writes for the
+        new book (via the write methods' `batch`), which are applied with it.
+        """
+        return _putBook(self.cli.transaction(), self, also, {
             "isbn": isbn,
-            "owner_id": owner_id,
+            "owner_id": int(owner_id),
             "title": title,
             "author": author,
             "category": cat,
             "year": year,
             "img": img
         })
-        return book.id
 
     def listBooks(self, user_id: int, search: str|None = None) -> list[DocumentSnapshot]:
         books = (
             self.books_ref
-            .where(filter=FieldFilter("owner_id", "==", user_id))
-            .get()
+            .where(filter=_ownerFilter(user_id))
+            .get(**self._rpc())
         )
         # have to do filtering here, because Firestore doesn't support search
         if search:
             books = [book for book in books if self._matches(book, search)]
         return books
 
+    def pageBooks(self, user_id: int, page_size: int,
+                  start_after: DocumentSnapshot|None = None) -> list[DocumentSnapshot]:
+        """Lists up to `page_size` of this user's books in document ID order,
+        starting after the `start_after` book if given.
+        """
+        query = (
+            self.books_ref
+            .where(filter=_ownerFilter(user_id))
+            .order_by(FieldPath.document_id())
+            .limit(page_size)
+        )
+        if start_after is not None:
+            query = query.start_after(start_after)
+        return query.get(**self._rpc())
+
     def _matches(self, book, search: str) -> bool:
         return (
             search.lower() in book.get('title').lower() or
             search.lower() in book.get('author').lower()
         )
 
-    def putLog(self, book_id: str, action: Action, user_id: int = 0):
+    def putLog(self, book_id: str, action: Action, user_id: int = 0, batch=None,
+               owner_id: int|None = None):
+        # `batch`, here and below, may be a WriteBatch or a transaction to add
+        # the write to, instead of writing straight away
         log = self.logs_ref.document()
-        log.set({
+        vals = {
             "book_id": book_id,
             "timestamp": firestore.SERVER_TIMESTAMP,
             "action": action.value,
             "user_id": user_id
-        })
+        }
+        if owner_id is not None:
+            # Lets listLogsFrom find one library's logs
+            vals["owner_id"] = int(owner_id)
+        if batch is not None:
+            batch.set(log, vals)
+        else:
+            log.set(vals, **self._rpc())
+        return log.id
 
     def getLatestLog(self, book_id: str) -> DocumentSnapshot|None:
+        return self._queryLatestLog(book_id)
+
+    def _queryLatestLog(self, book_id: str) -> DocumentSnapshot|None:
         log = (
             self.logs_ref
             .where(filter=FieldFilter("book_id", "==", book_id))
             .order_by('timestamp', direction='DESCENDING')
-            .get()
+            .limit(1)
+            .get(**self._rpc())
         )
         try:
             return log[0]
@@ -74,67 +239,504 @@ class Database:
             # Maybe default value instead?
             return None
 
-    def listLogsByBook(self, book_id: str) -> list[DocumentSnapshot]:
-        return (
+    def getLatestLogs(self, book_ids: list[str]) -> dict[str, DocumentSnapshot]:
+        """Bulk version of getLatestLog. Books with no logs are omitted.
+
+        Runs one single-result query per book, concurrently, so it reads one
+        log per book however long their histories are.
+        """
+        calls = [_EXECUTOR.submit(contextvars.copy_context().run,
+                                  self._queryLatestLog, book_id)
+                 for book_id in book_ids]
+        latest = {}
+        for book_id, call in zip(book_ids, calls):
+            log = call.result()
+            if log is not None:
+                latest[book_id] = log
+        return latest
+
+    def listLogsByBook(self, book_id: str) -> list[DocumentSnapshot|ArchivedLog]:
+        recent = (
             self.logs_ref
             .where(filter=FieldFilter("book_id", "==", book_id))
             .order_by('timestamp', direction='ASCENDING')
-            .get()
+            .get(**self._rpc())
         )
+        archive = self.archive_ref.document(book_id).get(**self._rpc())
+        if not archive.exists:
+            return recent
+        return self._mergeLogs(self._archivedLogs(archive), recent)
 
-    def listLogsByUser(self, user_id: int) -> list[DocumentSnapshot]:
-        return (
+    def listLogsByUser(self, user_id: int) -> list[DocumentSnapshot|ArchivedLog]:
+        recent = (
             self.logs_ref
             .where(filter=FieldFilter("user_id", "==", user_id))
             .order_by('timestamp', direction='ASCENDING')
-            .get()
+            .get(**self._rpc())
+        )
+        archives = (
+            self.archive_ref
+            .where(filter=FieldFilter("user_ids", "array_contains", user_id))
+            .get(**self._rpc())
+        )
+        archived = [log for archive in archives
+                    for log in self._archivedLogs(archive)
+                    if log.get("user_id") == user_id]
+        if not archived:
+            return recent
+        return self._mergeLogs(archived, recent)
+
+    def listLogsByBooks(self, book_ids: list[str]) -> dict[str, list[DocumentSnapshot|ArchivedLog]]:
+        """Bulk version of listLogsByBook. Returns each book's logs (including
+        archived ones), earliest first, keyed by book ID.
+        """
+        logs = {book_id: [] for book_id in book_ids}
+        # Firestore caps 'in' filters at 30 values
+        for i in range(0, len(book_ids), 30):
+            chunk = book_ids[i:i + 30]
+            recent = (
+                self.logs_ref
+                .where(filter=FieldFilter("book_id", "in", chunk))
+                .get(**self._rpc())
+            )
+            for log in recent:
+                logs[log.get("book_id")].append(log)
+        archive_refs = [self.archive_ref.document(book_id) for book_id in book_ids]
+        for archive in self.cli.get_all(archive_refs, **self._rpc()):
+            if archive.exists:
+                logs[archive.id].extend(self._archivedLogs(archive))
+        for book_logs in logs.values():
+            book_logs.sort(key=lambda log: log.get("timestamp"))
+        return logs
+
+    def listLogsForCompaction(self, book_id: str, keep: int,
+                              before: datetime) -> list[DocumentSnapshot]:
+        """Lists this book's logs that are older than `before`, excluding its
+        `keep` most recent logs (which always stay in the hot collection).
+        """
+        logs = (
+            self.logs_ref
+            .where(filter=FieldFilter("book_id", "==", book_id))
+            .order_by('timestamp', direction='DESCENDING')
+            .get(**self._rpc())
+        )
+        return [log for log in logs[keep:] if log.get("timestamp") < before]
+
+    def archiveLogs(self, book_id: str, logs: list[DocumentSnapshot]):
+        """Moves these logs (which must all be for this book) out of the
+        `actionlogs` collection and into the book's archive document.
+        """
+        # Firestore batches are capped at 500 writes; leave room for the archive
+        for i in range(0, len(logs), 400):
+            chunk = logs[i:i + 400]
+            entries = [{
+                "log_id": log.id,
+                "timestamp": log.get("timestamp"),
+                "action": log.get("action"),
+                "user_id": log.get("user_id")
+            } for log in chunk]
+            user_ids = list({log.get("user_id") for log in chunk})
+            batch = self.cli.batch()
+            batch.set(self.archive_ref.document(book_id), {
+                "book_id": book_id,
+                "user_ids": firestore.ArrayUnion(user_ids),
+                "entries": firestore.ArrayUnion(entries)
+            }, merge=True)
+            for log in chunk:
+                batch.delete(log.reference)
+            batch.commit(**self._rpc())
+
+    def rekeyBook(self, book: DocumentSnapshot, new_id: str, copy: int):
+        """Moves this book, along with its logs, stats, archive, out-book
+        entry and catalog copy, to the ID `new_id` as copy number `copy`.
+        Each step is safe to repeat, so an interrupted move can be rerun.
+        """
+        old_id = book.id
+        vals = book.to_dict()
+        self.books_ref.document(new_id).set(
+            dict(vals, owner_id=int(vals["owner_id"]), copy=copy,
+                 rekeyed_from=old_id), **self._rpc())
+
+        logs = (
+            self.logs_ref
+            .where(filter=FieldFilter("book_id", "==", old_id))
+            .get(**self._rpc())
+        )
+        for i in range(0, len(logs), 500):
+            batch = self.cli.batch()
+            for log in logs[i:i + 500]:
+                batch.update(log.reference, {"book_id": new_id,
+                                             "owner_id": int(vals["owner_id"])})
+            batch.commit(**self._rpc())
+
+        for ref, extra in [(self.archive_ref, {"book_id": new_id}),
+                           (self.bookstats_ref, {}), (self.outbooks_ref, {})]:
+            doc = ref.document(old_id).get(**self._rpc())
+            if doc.exists:
+                batch = self.cli.batch()
+                batch.set(ref.document(new_id), dict(doc.to_dict(), **extra))
+                batch.delete(doc.reference)
+                batch.commit(**self._rpc())
+
+        for catalog_id in {vals["isbn"], canonical(vals["isbn"])}:
+            entry = self.catalog_ref.document(catalog_id).get(**self._rpc())
+            if entry.exists and old_id in (entry.get("copies") or {}):
+                entry.reference.update(
+                    {FieldPath("copies", old_id).to_api_repr(): firestore.DELETE_FIELD},
+                    **self._rpc())
+
+        self.books_ref.document(old_id).delete(**self._rpc())
+
+    def listBookIds(self) -> list[str]:
+        return [book.id for book in self.books_ref.select([]).stream(**self._rpc())]
+
+    def _archivedLogs(self, archive: DocumentSnapshot) -> list[ArchivedLog]:
+        book_id = archive.id
+        return [ArchivedLog(book_id, entry) for entry in archive.get("entries")]
+
+    def _mergeLogs(self, archived, recent) -> list[DocumentSnapshot|ArchivedLog]:
+        logs = list(archived) + list(recent)
+        logs.sort(key=lambda log: log.get("timestamp"))
+        return logs
+
+    def recordCheckout(self, book_id: str, user_id: int, batch=None):
+        """Bumps the checkout counters for this book and user."""
+        update = {
+            "checkouts": firestore.Increment(1),
+            "last_activity": firestore.SERVER_TIMESTAMP
+        }
+        self._updateStats(book_id, user_id, update, batch)
+
+    def recordReturn(self, book_id: str, user_id: int, loan_secs: float, batch=None):
+        """Adds a completed loan of `loan_secs` to this book's and user's
+        counters.
+        """
+        update = {
+            "returns": firestore.Increment(1),
+            "total_loan_secs": firestore.Increment(loan_secs),
+            "last_activity": firestore.SERVER_TIMESTAMP
+        }
+        self._updateStats(book_id, user_id, update, batch)
+
+    def _updateStats(self, book_id: str, user_id: int, update: dict, batch):
+        own_batch = batch is None
+        batch = self.cli.batch() if own_batch else batch
+        batch.set(self.bookstats_ref.document(book_id), update, merge=True)
+        batch.set(self.userstats_ref.document(str(user_id)), update, merge=True)
+        if own_batch:
+            self.commit(batch, idempotent=False)
+
+    def getBookStats(self, book_id: str) -> DocumentSnapshot:
+        return self.bookstats_ref.document(book_id).get(**self._rpc())
+
+    def getUserStats(self, user_id: int) -> DocumentSnapshot:
+        return self.userstats_ref.document(str(user_id)).get(**self._rpc())
+
+    def listAllBookStats(self) -> list[DocumentSnapshot]:
+        return self.bookstats_ref.get(**self._rpc())
+
+    def listLogsSince(self, since: datetime) -> list[DocumentSnapshot]:
+        """Lists every book's logs from `since` onwards, oldest first."""
+        return (
+            self.logs_ref
+            .where(filter=FieldFilter("timestamp", ">=", since))
+            .order_by("timestamp")
+            .get(**self._rpc())
+        )
+
+    def listLogsFrom(self, since: datetime, limit: int,
+                     owner_id: int|None = None) -> list[DocumentSnapshot]:
+        """Lists up to `limit` logs from `since` onwards, oldest first. With
+        `owner_id`, only logs for books in that library (which needs a
+        composite index on owner_id and timestamp).
+        """
+        query = self.logs_ref
+        if owner_id is not None:
+            query = query.where(filter=FieldFilter("owner_id", "==", int(owner_id)))
+        return (
+            query
+            .where(filter=FieldFilter("timestamp", ">=", since))
+            .order_by("timestamp")
+            .limit(limit)
+            .get(**self._rpc())
+        )
+
+    def putRankings(self, key: str, rankings: dict):
+        self.rankings_ref.document(key).set(
+            dict(rankings, updated=firestore.SERVER_TIMESTAMP), **self._rpc())
+
+    def getRankings(self, key: str) -> DocumentSnapshot:
+        return self.rankings_ref.document(key).get(**self._rpc())
+
+    def putOutBook(self, book_id: str, owner_id: int, isbn: str, title: str,
+                   author: str, user_id: int, checkout_time: datetime|None = None,
+                   batch=None):
+        """Adds this book to the index of currently checked-out books."""
+        ref = self.outbooks_ref.document(book_id)
+        vals = {
+            "owner_id": owner_id,
+            "isbn": isbn,
+            "title": title,
+            "author": author,
+            "user_id": user_id,
+            "checkout_time": checkout_time or firestore.SERVER_TIMESTAMP,
+            "reminded": None
+        }
+        if batch is not None:
+            batch.set(ref, vals)
+        else:
+            ref.set(vals, **self._rpc())
+
+    def deleteOutBook(self, book_id: str, batch=None):
+        ref = self.outbooks_ref.document(book_id)
+        if batch is not None:
+            batch.delete(ref)
+        else:
+            ref.delete(**self._rpc())
+
+    def getCheckouts(self, book_ids: list[str]) -> dict[str, tuple[int, datetime]]:
+        """Returns (borrower's user ID, checkout time) for each of these books
+        that's checked out, read from the `outbooks` index in one batched
+        read. Until rebuildOutIndex has marked the index complete, books
+        without an entry fall back to their latest log, as they may have gone
+        out before the index existed.
+        """
+        if not book_ids:
+            return {}
+        marker = self.meta_ref.document('outbooks')
+        refs = [self.outbooks_ref.document(book_id) for book_id in book_ids]
+        checkouts = {}
+        built = False
+        for doc in self.cli.get_all(refs + [marker], **self._rpc()):
+            if doc.reference.path == marker.path:
+                built = doc.exists
+            elif doc.exists:
+                checkouts[doc.id] = (int(doc.get("user_id")), doc.get("checkout_time"))
+        if not built:
+            legacy = [book_id for book_id in book_ids if book_id not in checkouts]
+            for book_id, log in self.getLatestLogs(legacy).items():
+                if log.get("action") == Action.CHECKOUT.value:
+                    checkouts[book_id] = (int(log.get("user_id")), log.get("timestamp"))
+        return checkouts
+
+    def markOutBooksComplete(self):
+        """Records that every checked-out book has an `outbooks` entry."""
+        self.meta_ref.document('outbooks').set(
+            {"built": firestore.SERVER_TIMESTAMP}, **self._rpc())
+
+    def listOutBooks(self, before: datetime|None = None) -> list[DocumentSnapshot]:
+        """Lists checked-out books across all owners, oldest checkout first.
+        If `before` is set, only includes books checked out before then.
+        """
+        query = self.outbooks_ref
+        if before is not None:
+            query = query.where(filter=FieldFilter("checkout_time", "<", before))
+        return query.order_by('checkout_time', direction='ASCENDING').get(**self._rpc())
+
+    def setOutBooksReminded(self, book_ids: list[str]):
+        for i in range(0, len(book_ids), 500):
+            batch = self.cli.batch()
+            for book_id in book_ids[i:i + 500]:
+                batch.update(self.outbooks_ref.document(book_id),
+                             {"reminded": firestore.SERVER_TIMESTAMP})
+            batch.commit(**self._rpc())
+
+    def putCatalogCopy(self, isbn: str, book_id: str, owner_id: int,
+                       title: str, author: str, tokens: list[str],
+                       is_out: bool = False, batch=None):
+        """Adds (or updates) this book as a copy of `isbn` in the catalog
+        shared by all owners. Entries are keyed by ISBN-13 where possible, so
+        ISBN-10 and ISBN-13 copies of a book share one.
+        """
+        ref = self.catalog_ref.document(canonical(isbn))
+        vals = {
+            "isbn": isbn,
+            "title": title,
+            "author": author,
+            "tokens": tokens,
+            "copies": {book_id: {"owner_id": owner_id, "is_out": is_out}}
+        }
+        if batch is not None:
+            batch.set(ref, vals, merge=True)
+        else:
+            ref.set(vals, merge=True, **self._rpc())
+
+    def getCatalogEntry(self, isbn: str) -> DocumentSnapshot:
+        return self.catalog_ref.document(canonical(isbn)).get(**self._rpc())
+
+    def searchCatalog(self, token: str, limit: int) -> list[DocumentSnapshot]:
+        """Lists up to `limit` catalog entries indexed under `token`."""
+        return (
+            self.catalog_ref
+            .where(filter=FieldFilter("tokens", "array_contains", token))
+            .limit(limit)
+            .get(**self._rpc())
         )
 
     def putUser(self, user_id: int, name: str, email: str):
-        user = self.users_ref.document(str(user_id))
-        user.set({
-            "name": name,
-            "email": email
-        })
-        
+        """Creates or replaces this user. Raises AlreadyExistsException if a
+        different user already has this email address.
+        """
+        _putUser(self.cli.transaction(), self, user_id, name, email)
+
     def getUser(self, user_id: int) -> DocumentSnapshot:
-        return self.users_ref.document(str(user_id)).get()
+        return self.users_ref.document(str(user_id)).get(**self._rpc())
+
+    def getUsers(self, user_ids: list[int]) -> list[DocumentSnapshot]:
+        """Fetches these users in a single batched read. Users that don't
+        exist are omitted.
+        """
+        refs = [self.users_ref.document(str(user_id)) for user_id in set(user_ids)]
+        return [user for user in self.cli.get_all(refs, **self._rpc()) if user.exists]
 
     def listUsers(self) -> list[DocumentSnapshot]:
-        return self.users_ref.get()
+        return self.users_ref.get(**self._rpc())
 
     def setUserName(self, user_id: int, name: str):
-        user = self.users_ref.document(str(user_id))
-        user.update({"name": name})
+        batch = self.cli.batch()
+        batch.update(self.users_ref.document(str(user_id)), {"name": name})
+        self._bumpUsersVersion(batch)
+        batch.commit(**self._rpc())
+
+    def getUsersVersion(self) -> int:
+        """Returns a counter that changes whenever a user's name or email may
+        have changed, so cached copies of the user list can be revalidated
+        with a single document read.
+        """
+        version = self.meta_ref.document('users').get(**self._rpc())
+        return version.get("version") if version.exists else 0
+
+    def _bumpUsersVersion(self, batch):
+        # `batch` may also be a transaction
+        batch.set(self.meta_ref.document('users'),
+                  {"version": firestore.Increment(1)}, merge=True)
 
     def setUserTokenUid(self, user_id: int, token_uid: str):
-        user = self.users_ref.document(str(user_id))
-        user.update({"token_uid": token_uid})
+        """Associates this user with a login token UID. Raises
+        AlreadyExistsException if a different user already has it.
+        """
+        _setUserTokenUid(self.cli.transaction(), self, user_id, token_uid)
 
     def getUserByTokenUid(self, token_uid: str) -> DocumentSnapshot|None:
-        users = (
-            self.users_ref
-            .where(filter=FieldFilter("token_uid", "==", token_uid))
-            .get()
-        )
-        if len(users) == 1:
-            return users[0]
-        elif len(users) == 0:
-            return None
-        else:
-            # would be better if Firestore could enforce uniqueness on writes...
-            raise RuntimeError("Multiple users with the same token_uid")
+        return self._getUserByIndex(_uidKey(token_uid), "token_uid", token_uid)
 
     def getUserByEmail(self, email: str) -> DocumentSnapshot|None:
-        users = (
-            self.users_ref
-            .where(filter=FieldFilter("email", "==", email))
-            .get()
-        )
-        if len(users) == 1:
-            return users[0]
-        elif len(users) == 0:
-            return None
-        else:
-            raise RuntimeError("Multiple users with the same email")
+        return self._getUserByIndex(_emailKey(email), "email", email)
+
+    def _getUserByIndex(self, key: str, field: str, value: str) -> DocumentSnapshot|None:
+        claim = self.userindex_ref.document(key).get(**self._rpc())
+        if claim.exists:
+            user = self.getUser(claim.get("user_id"))
+            return user if user.exists else None
+        return _indexLegacyUser(self.cli.transaction(), self, key, field, value)
+
+
+def _ownerFilter(owner_id) -> FieldFilter:
+    # Books created before owner IDs were stored as ints have them as
+    # strings, so match either
+    try:
+        return FieldFilter("owner_id", "in", [int(owner_id), str(owner_id)])
+    except ValueError:
+        return FieldFilter("owner_id", "==", owner_id)
+
+
+def _emailKey(email: str) -> str:
+    return 'email:%s' % email.strip().lower()
+
+
+def _uidKey(token_uid: str) -> str:
+    return 'uid:%s' % token_uid
+
+
+@firestore.transactional
+def _putBook(transaction, db: Database, also, vals: dict) -> str:
+    # The first copy's document counts the copies, so each new copy gets the
+    # next number
+    first_ref = db.books_ref.document(bookKey(vals["owner_id"], vals["isbn"]))
+    first = first_ref.get(transaction=transaction, **db._rpc())
+    if not first.exists:
+        ref = first_ref
+        transaction.create(ref, dict(vals, copy=1, copies=1))
+    else:
+        copy = first.to_dict().get("copies", 1) + 1
+        ref = db.books_ref.document(bookKey(vals["owner_id"], vals["isbn"], copy))
+        transaction.create(ref, dict(vals, copy=copy))
+        transaction.update(first_ref, {"copies": copy})
+    if also:
+        also(transaction, ref.id)
+    return ref.id
+
+
+# Firestore can't enforce uniqueness on a field, so each email and token UID is
+# claimed by a document in `userindex` whose ID is derived from the value. These
+# transactions check and update the claims along with the user document.
+
+@firestore.transactional
+def _putUser(transaction, db: Database, user_id: int, name: str, email: str):
+    user_id = int(user_id)
+    user_ref = db.users_ref.document(str(user_id))
+    claim_ref = db.userindex_ref.document(_emailKey(email))
+    existing = user_ref.get(transaction=transaction, **db._rpc())
+    claim = claim_ref.get(transaction=transaction, **db._rpc())
+    if claim.exists and claim.get("user_id") != user_id:
+        raise AlreadyExistsException('Email %s is already in use' % email)
+
+    # putUser replaces the whole document, so release the old user's claims
+    stale = []
+    if existing.exists:
+        old = existing.to_dict()
+        if "email" in old and _emailKey(old["email"]) != claim_ref.id:
+            stale.append(db.userindex_ref.document(_emailKey(old["email"])))
+        if "token_uid" in old:
+            stale.append(db.userindex_ref.document(_uidKey(old["token_uid"])))
+
+    transaction.set(user_ref, {
+        "name": name,
+        "email": email
+    })
+    transaction.set(claim_ref, {"user_id": user_id})
+    for ref in stale:
+        transaction.delete(ref)
+    db._bumpUsersVersion(transaction)
+
+
+@firestore.transactional
+def _indexLegacyUser(transaction, db: Database, key: str, field: str,
+                     value: str) -> DocumentSnapshot|None:
+    # Users written before the index existed can only be found by query.
+    # Index them on the way past, so this only happens once per user.
+    claim_ref = db.userindex_ref.document(key)
+    claim = claim_ref.get(transaction=transaction, **db._rpc())
+    if claim.exists:
+        # Claimed since we last looked
+        user = db.users_ref.document(str(claim.get("user_id"))).get(
+            transaction=transaction, **db._rpc())
+        return user if user.exists else None
+    users = (
+        db.users_ref
+        .where(filter=FieldFilter(field, "==", value))
+        .get(transaction=transaction, **db._rpc())
+    )
+    if len(users) == 0:
+        return None
+    elif len(users) > 1:
+        raise RuntimeError("Multiple users with the same %s" % field)
+    transaction.create(claim_ref, {"user_id": int(users[0].id)})
+    return users[0]
+
+
+@firestore.transactional
+def _setUserTokenUid(transaction, db: Database, user_id: int, token_uid: str):
+    user_id = int(user_id)
+    user_ref = db.users_ref.document(str(user_id))
+    claim_ref = db.userindex_ref.document(_uidKey(token_uid))
+    existing = user_ref.get(transaction=transaction, **db._rpc())
+    claim = claim_ref.get(transaction=transaction, **db._rpc())
+    if claim.exists and claim.get("user_id") != user_id:
+        raise AlreadyExistsException('Token UID is already in use')
 
+    old_uid = existing.to_dict().get("token_uid") if existing.exists else None
+    transaction.update(user_ref, {"token_uid": token_uid})
+    transaction.set(claim_ref, {"user_id": user_id})
+    if old_uid is not None and old_uid != token_uid:
+        transaction.delete(db.userindex_ref.document(_uidKey(old_uid)))
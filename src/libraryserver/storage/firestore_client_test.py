@@ -5,6 +5,8 @@ from datetime import datetime, UTC
 from firebase_admin import credentials, firestore, initialize_app
 import requests
 
+from libraryserver import deadline
+from libraryserver.api.errors import AlreadyExistsException, DeadlineExceededException
 from libraryserver.api.models import Action
 from libraryserver.storage.firestore_client import Database
 from libraryserver.storage.testbase import BaseTestCase
@@ -41,6 +43,46 @@ class TestDatabase(BaseTestCase):
         self.assertEqual(res['year'], '1998')
         self.assertEqual(res['img'], 'url')
 
+    def test_book_keyedByOwnerAndIsbn(self):
+        first = self.db.putBook('0-06-206062-7', 1, 'Babel', '', '', '', '')
+        second = self.db.putBook('9780062060624', 1, 'Babel', '', '', '', '')
+        other = self.db.putBook('9780062060624', 2, 'Babel', '', '', '', '')
+
+        self.assertEqual(first, '1-9780062060624')
+        self.assertEqual(second, '1-9780062060624-2')
+        self.assertEqual(other, '2-9780062060624')
+        self.assertEqual(self.db.getBook('9780062060624', 2).id, other)
+
+    def test_book_getCopies(self):
+        self.db.putBook('isbn1', 1, '', '', '', '', '')
+        self.db.putBook('isbn1', 1, '', '', '', '', '')
+        self.db.putBook('isbn1', 2, '', '', '', '', '')
+
+        res = self.db.getBookCopies('isbn1', 1)
+
+        self.assertEqual([b.id for b in res], ['1-isbn1', '1-isbn1-2'])
+
+    def test_book_getCopiesLegacy(self):
+        self.db.books_ref.document('legacy').set({'isbn': 'isbn1', 'owner_id': 1})
+
+        self.assertEqual([b.id for b in self.db.getBookCopies('isbn1', 1)], ['legacy'])
+        self.assertEqual(self.db.getBook('isbn1', 1).id, 'legacy')
+
+    def test_book_legacyStringOwner(self):
+        self.db.books_ref.document('legacy').set({'isbn': 'isbn1', 'owner_id': '1',
+                                                  'title': 'Babel', 'author': ''})
+        self.db.putBook('isbn1', 2, '', '', '', '', '')
+
+        self.assertEqual(self.db.getBook('isbn1', 1).id, 'legacy')
+        self.assertEqual([b.id for b in self.db.listBooks(1)], ['legacy'])
+        self.assertEqual([b.id for b in self.db.listBooks('1')], ['legacy'])
+        self.assertEqual(self.db.getBook('isbn1', '2').get('owner_id'), 2)
+
+    def test_deadlineExceeded(self):
+        with deadline.scope(0):
+            with self.assertRaises(DeadlineExceededException):
+                self.db.getBook('isbn1')
+
     def test_book_getNotFound(self):
         res = self.db.getBook('does-not-exist')
         self.assertIsNone(res)
@@ -96,6 +138,26 @@ class TestDatabase(BaseTestCase):
             self.db.listBooks(1, 'a'),
             [babel_dict, lfa_dict])
 
+    def test_book_getById(self):
+        b1 = self.db.putBook('isbn1', 1, 'Babel', 'R.F. Kuang', 'Fiction', '2022', 'url')
+        b2 = self.db.putBook('isbn2', 1, 'Foo', 'Bar', 'Fiction', '2005', 'url')
+
+        res = self.db.getBooksById([b1, b2, 'missing'])
+
+        self.assertCountEqual([b.id for b in res], [b1, b2])
+
+    def test_book_pages(self):
+        for i in range(5):
+            self.db.putBook('isbn%d' % i, 1, '', '', '', '', '')
+        self.db.putBook('other', 2, '', '', '', '', '')
+
+        first = self.db.pageBooks(1, 3)
+        second = self.db.pageBooks(1, 3, first[-1])
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertEqual(len({b.id for b in first + second}), 5)
+
     def test_logs_putAndGet(self):
         self.db.putLog('some-id', Action.CREATE, 1234)
 
@@ -164,6 +226,98 @@ class TestDatabase(BaseTestCase):
         self.assertEqual(res[1].to_dict()["action"], Action.RETURN.value)
         self.assertEqual(res[1].to_dict()["user_id"], 1234)
 
+    def test_stats_recordCheckoutAndReturn(self):
+        self.db.recordCheckout('id1', 1234)
+        self.db.recordReturn('id1', 1234, 60)
+        self.db.recordCheckout('id1', 5678)
+
+        book = self.db.getBookStats('id1').to_dict()
+        user = self.db.getUserStats(1234).to_dict()
+
+        self.assertEqual(book['checkouts'], 2)
+        self.assertEqual(book['returns'], 1)
+        self.assertEqual(book['total_loan_secs'], 60)
+        self.assertAboutNow(book['last_activity'])
+        self.assertEqual(user['checkouts'], 1)
+        self.assertEqual(user['returns'], 1)
+
+    def test_stats_unset(self):
+        res = self.db.getBookStats('id1')
+
+        self.assertFalse(res.exists)
+
+    def test_outBooks_putListAndDelete(self):
+        self.db.putOutBook('id1', 1, 'isbn1', 'Babel', 'R.F. Kuang', 1234)
+        time.sleep(0.01)
+        self.db.putOutBook('id2', 2, 'isbn2', 'Foo', 'Bar', 5678)
+        self.db.putOutBook('id3', 2, 'isbn3', 'Foo', 'Bar', 5678)
+        self.db.deleteOutBook('id3')
+
+        res = self.db.listOutBooks()
+
+        self.assertEqual([r.id for r in res], ['id1', 'id2'])
+        self.assertEqual(res[0].get('owner_id'), 1)
+        self.assertEqual(res[0].get('user_id'), 1234)
+        self.assertAboutNow(res[0].get('checkout_time'))
+        self.assertIsNone(res[0].get('reminded'))
+
+    def test_outBooks_listBefore(self):
+        self.db.putOutBook('id1', 1, 'isbn1', 'Babel', 'R.F. Kuang', 1234,
+                           datetime(2020, 1, 1, tzinfo=UTC))
+        self.db.putOutBook('id2', 1, 'isbn2', 'Foo', 'Bar', 1234)
+
+        res = self.db.listOutBooks(datetime(2021, 1, 1, tzinfo=UTC))
+
+        self.assertEqual([r.id for r in res], ['id1'])
+
+    def test_outBooks_getCheckouts(self):
+        self.db.putOutBook('id1', 1, 'isbn1', 'Babel', 'R.F. Kuang', 1234)
+        self.db.putLog('id2', Action.CHECKOUT, 5678)
+        self.db.putLog('id3', Action.CREATE, 9001)
+
+        res = self.db.getCheckouts(['id1', 'id2', 'id3'])
+
+        self.assertEqual(set(res.keys()), {'id1', 'id2'})
+        self.assertEqual(res['id1'][0], 1234)
+        self.assertAboutNow(res['id1'][1])
+        self.assertEqual(res['id2'][0], 5678)
+
+    def test_outBooks_getCheckoutsOnceComplete(self):
+        self.db.putOutBook('id1', 1, 'isbn1', 'Babel', 'R.F. Kuang', 1234)
+        self.db.putLog('id2', Action.CHECKOUT, 5678)
+        self.db.markOutBooksComplete()
+
+        res = self.db.getCheckouts(['id1', 'id2'])
+
+        self.assertEqual(set(res.keys()), {'id1'})
+
+    def test_logs_getLatestMany(self):
+        self.db.putLog('id1', Action.CREATE, 1234)
+        time.sleep(0.01)
+        self.db.putLog('id1', Action.CHECKOUT, 5678)
+        self.db.putLog('id2', Action.CREATE, 9001)
+
+        res = self.db.getLatestLogs(['id1', 'id2', 'id3'])
+
+        self.assertEqual(set(res.keys()), {'id1', 'id2'})
+        self.assertEqual(res['id1'].get("action"), Action.CHECKOUT.value)
+        self.assertEqual(res['id2'].get("action"), Action.CREATE.value)
+
+    def test_logs_listByBooks(self):
+        self.db.putLog('id1', Action.CREATE, 1234)
+        time.sleep(0.01)
+        self.db.putLog('id1', Action.CHECKOUT, 5678)
+        self.db.putLog('id2', Action.CREATE, 9001)
+        self.db.putLog('id3', Action.CREATE, 9001)
+
+        res = self.db.listLogsByBooks(['id1', 'id2', 'id4'])
+
+        self.assertEqual(set(res.keys()), {'id1', 'id2', 'id4'})
+        self.assertEqual([l.get("action") for l in res['id1']],
+                         [Action.CREATE.value, Action.CHECKOUT.value])
+        self.assertEqual(len(res['id2']), 1)
+        self.assertEqual(res['id4'], [])
+
     def test_user_putAndGet(self):
         self.db.putUser(1234, 'John Doe', 'john@example.com')
         res = self.db.getUser(1234)
@@ -194,6 +348,13 @@ class TestDatabase(BaseTestCase):
         self.assertEqual(res.get('name'), 'Bob')
         self.assertEqual(res.get('email'), 'adam@example.com')
 
+    def test_user_versionBumpedOnWrite(self):
+        before = self.db.getUsersVersion()
+        self.db.putUser(1234, 'Adam', 'adam@example.com')
+        self.db.setUserName(1234, 'Bob')
+
+        self.assertEqual(self.db.getUsersVersion(), before + 2)
+
     def test_user_tokenUidMatch(self):
         self.db.putUser(1234, 'John Doe', 'john@example.com')
         self.db.setUserTokenUid(1234, "ABC")
@@ -215,10 +376,36 @@ class TestDatabase(BaseTestCase):
         self.db.putUser(1234, 'John Doe', 'john@example.com')
         self.db.setUserTokenUid(1234, "ABC")
         self.db.putUser(5678, 'Jane Doe', 'jane@example.com')
-        self.db.setUserTokenUid(5678, "ABC")
 
-        with self.assertRaises(RuntimeError):
-            res = self.db.getUserByTokenUid("ABC")
+        with self.assertRaises(AlreadyExistsException):
+            self.db.setUserTokenUid(5678, "ABC")
+        self.assertEqual(self.db.getUserByTokenUid("ABC").id, "1234")
+
+    def test_user_tokenUidChanged(self):
+        self.db.putUser(1234, 'John Doe', 'john@example.com')
+        self.db.setUserTokenUid(1234, "ABC")
+        self.db.setUserTokenUid(1234, "DEF")
+
+        self.assertIsNone(self.db.getUserByTokenUid("ABC"))
+        self.assertEqual(self.db.getUserByTokenUid("DEF").id, "1234")
+
+    def test_user_tokenUidLegacy(self):
+        self.db.putUser(1234, 'John Doe', 'john@example.com')
+        # Written directly, as it would have been before the index existed
+        self.db.users_ref.document("1234").update({"token_uid": "ABC"})
+
+        res = self.db.getUserByTokenUid("ABC")
+
+        self.assertEqual(res.id, "1234")
+        self.assertTrue(self.db.userindex_ref.document("uid:ABC").get().exists)
+
+    def test_user_claimForDeletedUser(self):
+        self.db.putUser(1234, 'John Doe', 'john@example.com')
+        self.db.setUserTokenUid(1234, "ABC")
+        self.db.users_ref.document("1234").delete()
+
+        self.assertIsNone(self.db.getUserByTokenUid("ABC"))
+        self.assertIsNone(self.db.getUserByEmail("john@example.com"))
 
     def test_user_emailMatch(self):
         self.db.putUser(1234, 'John Doe', 'john@example.com')
@@ -238,10 +425,25 @@ class TestDatabase(BaseTestCase):
 
     def test_user_emailMultiple(self):
         self.db.putUser(1234, 'John Doe', 'john@example.com')
+
+        with self.assertRaises(AlreadyExistsException):
+            self.db.putUser(5678, 'John Denver', 'John@Example.com')
+        self.assertFalse(self.db.getUser(5678).exists)
+
+    def test_user_emailNormalized(self):
+        self.db.putUser(1234, 'John Doe', 'John@Example.com')
+
+        res = self.db.getUserByEmail("john@example.com ")
+
+        self.assertEqual(res.id, "1234")
+
+    def test_user_emailChanged(self):
+        self.db.putUser(1234, 'John Doe', 'john@example.com')
+        self.db.putUser(1234, 'John Doe', 'johnny@example.com')
         self.db.putUser(5678, 'John Denver', 'john@example.com')
 
-        with self.assertRaises(RuntimeError):
-            res = self.db.getUserByEmail("john@example.com")
+        self.assertEqual(self.db.getUserByEmail("johnny@example.com").id, "1234")
+        self.assertEqual(self.db.getUserByEmail("john@example.com").id, "5678")
         
 
 if __name__ == '__main__':
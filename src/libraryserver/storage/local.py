@@ -1,29 +1,50 @@
+from collections.abc import Iterator
+from dataclasses import replace
+from datetime import datetime, timedelta, UTC
 from google.cloud.firestore_v1.base_document import DocumentSnapshot
 import random
 
 from libraryserver.api.errors import NotFoundException, InvalidStateException
-from libraryserver.api.models import Book, User, Action, LogEntry
+from libraryserver.api.models import (
+    Book, User, Action, LogEntry, CirculationStats, Loan, CatalogEntry,
+    CatalogHolding, RankedBook, Rankings, BookChanges)
 from libraryserver.api.service import BookService, UserService
 from libraryserver.config import APP_CONFIG
+from libraryserver.events.bus import BookEvent, EventBus
 from libraryserver.constants import MIN_USER_ID, MAX_USER_ID
 from libraryserver.keys.keymanager import KeyManager
 from libraryserver.notifs.mailgun_client import Email
+from libraryserver.search import catalog
+from libraryserver.search.suggest import SuggestIndex
+from libraryserver.storage import rankings, sync
 from libraryserver.storage.firestore_client import Database
+from libraryserver.storage.userdir import UserDirectory
+from libraryserver.thumbnails.cache import ThumbnailCache
 
 
 class LocalBookService(BookService):
 
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, thumbnails: ThumbnailCache|None = None,
+                 email: Email|None = None, suggest: SuggestIndex|None = None,
+                 events: EventBus|None = None):
         self.db = db
-        self.email = Email(KeyManager())
+        self.email = email or Email(KeyManager())
+        self.thumbnails = thumbnails
+        self.suggest = suggest
+        self.events = events
 
-    def _parseLogs(self, log_vals: DocumentSnapshot) -> LogEntry:
+    def _parseLogs(self, log_vals: DocumentSnapshot,
+                   names: dict[int, str]|None = None) -> LogEntry:
+        # `names` optionally caches user names across many calls
         user_id = log_vals.get("user_id") or None
-        user = (
-            self.db.getUser(user_id).get("name")
-            if user_id
-            else None
-        )
+        if not user_id:
+            user = None
+        elif names is not None and user_id in names:
+            user = names[user_id]
+        else:
+            user = self.db.getUser(user_id).get("name")
+            if names is not None:
+                names[user_id] = user
         action = Action(log_vals.get("action"))
         return LogEntry(log_vals.get("book_id"), log_vals.get("timestamp"),
                         action, user_id, user)
@@ -33,6 +54,12 @@ class LocalBookService(BookService):
         if log_vals:
             log = self._parseLogs(log_vals)
         else:
+            log = None
+        return self._bookFromLog(book_vals, log)
+
+    def _bookFromLog(self, book_vals: DocumentSnapshot,
+                     log: LogEntry|None) -> Book:
+        if log is None:
             log = LogEntry(book_vals.id, "", Action.UNKNOWN, None, None)
 
         is_out = (log.action == Action.CHECKOUT)
@@ -41,18 +68,46 @@ class LocalBookService(BookService):
         else:
             (checkout_user, checkout_time) = ('', '')
 
-        return Book(book_vals.id, book_vals.get("isbn"), book_vals.get("owner_id"),
+        return Book(book_vals.id, book_vals.get("isbn"), int(book_vals.get("owner_id")),
                     book_vals.get("title"), book_vals.get("author"),
                     book_vals.get("category"), book_vals.get("year"),
                     book_vals.get("img"), is_out, checkout_user, checkout_time)
 
-    def getBook(self, isbn: str) -> Book:
-        book_vals = self.db.getBook(isbn)
+    def getBook(self, isbn: str, owner_id: int|None = None) -> Book:
+        """Gets a book by ISBN, from owner_id's library if it has a copy, and
+        otherwise from any library.
+        """
+        book_vals = self.db.getBook(isbn, owner_id)
+        if book_vals is None and owner_id is not None:
+            book_vals = self.db.getBook(isbn)
         if book_vals is None:
             raise NotFoundException('No book in database with ISBN %s' % isbn)
         log_vals = self.db.getLatestLog(book_vals.id)
         return self._bookFromDocs(book_vals, log_vals)
 
+    def getBooks(self, book_ids: list[str]) -> list[Book]:
+        return self._booksFromDocs(self.db.getBooksById(book_ids), book_ids)
+
+    def _booksFromDocs(self, book_vals: list[DocumentSnapshot],
+                       book_ids: list[str]) -> list[Book]:
+        # Builds these books (in the order of `book_ids`) with bulk reads: one
+        # for their statuses and one for the names of everyone who has one out
+        books = {b.id: b for b in book_vals}
+        checkouts = self.db.getCheckouts(list(books.keys()))
+        borrowers = [user_id for user_id, _ in checkouts.values()]
+        names = {int(u.id): u.get("name") for u in self.db.getUsers(borrowers)}
+        return [self._bookFromLog(books[book_id], self._checkoutLog(
+                    book_id, checkouts.get(book_id), names))
+                for book_id in book_ids if book_id in books]
+
+    def _checkoutLog(self, book_id: str, checkout: tuple[int, datetime]|None,
+                     names: dict[int, str]) -> LogEntry|None:
+        if checkout is None:
+            return None
+        user_id, checkout_time = checkout
+        return LogEntry(book_id, checkout_time, Action.CHECKOUT, user_id,
+                        names.get(user_id))
+
     def listBooks(self, user_id: int, search: str|None = None) -> list[Book]:
         vals = self.db.listBooks(user_id, search)
         # It would probably be more efficient to do this with a JOIN in the DB
@@ -61,44 +116,242 @@ class LocalBookService(BookService):
                                    self.db.getLatestLog(book_vals.id))
                 for book_vals in vals]
 
+    def listChanges(self, user_id: int, token: str|None = None,
+                    limit: int = 500) -> BookChanges:
+        """Returns this user's books that were created or checked out/in
+        since `token` was issued, with a token to pass next time. Looks at
+        most `limit` logs at a time; if there were more, `more` is set.
+
+        Without a token, or with one too old to answer from the recent logs,
+        returns the whole library with `reset` set. Raises
+        InvalidTokenException for a malformed token.
+        """
+        now = datetime.now(UTC)
+        point = sync.decodeToken(token) if token else None
+        if point is None or sync.isExpired(point, now):
+            # Mark the point before reading, so nothing falls in between
+            start = sync.SyncPoint(now - sync.CLOCK_SKEW)
+            books = self.db.listBooks(user_id)
+            return BookChanges(sync.encodeToken(start), True, False,
+                               self._booksFromDocs(books, [b.id for b in books]))
+
+        logs = self.db.listLogsFrom(point.timestamp, limit + len(point.seen),
+                                    user_id)
+        logs = [log for log in logs if log.id not in point.seen][:limit]
+        if logs:
+            last = logs[-1].get("timestamp")
+            seen = tuple(log.id for log in logs if log.get("timestamp") == last)
+            if last == point.timestamp:
+                seen += point.seen
+            next_point = sync.SyncPoint(last, seen)
+        elif now - sync.CLOCK_SKEW > point.timestamp:
+            # Nothing new for this user, so move up to now, to keep the token
+            # from expiring
+            next_point = sync.SyncPoint(now - sync.CLOCK_SKEW)
+        else:
+            next_point = point
+
+        # Latest change last, and only books still in this user's library
+        changed = list(dict.fromkeys(log.get("book_id") for log in reversed(logs)))[::-1]
+        books = [b for b in self.db.getBooksById(changed)
+                 if str(b.get("owner_id")) == str(user_id)]
+        return BookChanges(sync.encodeToken(next_point), False, len(logs) == limit,
+                           self._booksFromDocs(books, changed))
+
     # Lists all checked-out or checked-in books
     def listBooksByStatus(self, user_id: int, is_out: bool) -> list[Book]:
         allBooks = self.listBooks(user_id)
         return [b for b in allBooks if b.is_out == is_out]
 
+    def listLoans(self, min_days: int = 0) -> list[Loan]:
+        before = None
+        if min_days > 0:
+            before = datetime.now(UTC) - timedelta(days=min_days)
+        return [self._loanFromDoc(v) for v in self.db.listOutBooks(before)]
+
+    def _loanFromDoc(self, loan_vals: DocumentSnapshot) -> Loan:
+        return Loan(loan_vals.id, loan_vals.get("isbn"), loan_vals.get("owner_id"),
+                    loan_vals.get("title"), loan_vals.get("author"),
+                    loan_vals.get("user_id"), str(loan_vals.get("checkout_time")))
+
+    def sendOverdueReminders(self, overdue_days: int, remind_days: int) -> int:
+        """Emails every borrower who has had a book for more than
+        `overdue_days`, at most once every `remind_days`. Each borrower gets a
+        single message covering all of their overdue books. Returns the number
+        of messages sent.
+        """
+        now = datetime.now(UTC)
+        remind_before = now - timedelta(days=remind_days)
+        by_user = {}
+        for loan_vals in self.db.listOutBooks(now - timedelta(days=overdue_days)):
+            reminded = loan_vals.get("reminded")
+            if reminded is not None and reminded > remind_before:
+                continue
+            loan = self._loanFromDoc(loan_vals)
+            by_user.setdefault(loan.user_id, []).append(loan)
+
+        for user_id, loans in by_user.items():
+            user = LocalUserService(self.db).getUser(user_id)
+            self.email.send_overdue_message(user, loans)
+            self.db.setOutBooksReminded([loan.book_id for loan in loans])
+        return len(by_user)
+
+    def searchCatalog(self, query: str, limit: int = 50) -> list[CatalogEntry]:
+        """Finds books in any library whose ISBN is `query`, or whose title
+        and author contain a word starting with each word of `query`.
+        """
+        query = query.strip()
+        entry = None
+        if catalog.looksLikeIsbn(query):
+            entry = self.db.getCatalogEntry(query)
+        if entry is not None and entry.exists:
+            entries = [entry]
+        else:
+            words = catalog.queryWords(query)
+            token = catalog.lookupToken(words)
+            if token is None:
+                return []
+            # Fetch extra, since some may not match the other words
+            entries = [e for e in self.db.searchCatalog(token, limit * 4)
+                       if catalog.matchesAll(e.get("title"), e.get("author"), words)]
+            entries = entries[:limit]
+
+        owner_ids = {copy["owner_id"] for e in entries
+                     for copy in e.get("copies").values()}
+        names = {int(u.id): u.get("name") for u in self.db.getUsers(list(owner_ids))}
+        return sorted((self._catalogEntryFromDoc(e, names) for e in entries),
+                      key=lambda e: (e.title, e.isbn))
+
+    def _catalogEntryFromDoc(self, entry_vals: DocumentSnapshot,
+                             names: dict[int, str]) -> CatalogEntry:
+        by_owner = {}
+        for book_id, copy in sorted(entry_vals.get("copies").items()):
+            by_owner.setdefault(copy["owner_id"], []).append((book_id, copy["is_out"]))
+        holdings = [
+            CatalogHolding(owner_id, names.get(int(owner_id), ''),
+                           [book_id for book_id, _ in copies],
+                           sum(1 for _, is_out in copies if not is_out))
+            for owner_id, copies in by_owner.items()
+        ]
+        holdings.sort(key=lambda h: (h.owner_name, h.owner_id))
+        return CatalogEntry(entry_vals.get("isbn"), entry_vals.get("title"),
+                            entry_vals.get("author"), holdings,
+                            any(h.available for h in holdings))
+
+    def _updateCatalog(self, book_id: str, book: Book, is_out: bool, batch):
+        self.db.putCatalogCopy(book.isbn, book_id, book.owner_id, book.title,
+                               book.author,
+                               catalog.catalogTokens(book.title, book.author),
+                               is_out, batch=batch)
+
+    # Each change writes the book's log along with the indexes kept from it
+    # (stats, out books, catalog) in one batch, so they can't fall out of step
+    # if the request runs out of time part way through. Nothing after the
+    # commit touches the database, so a committed change always reports
+    # success.
+
     def createBook(self, book: Book) -> str:
+        log_id = None
+        transaction_used = None
+
+        def addRecords(transaction, book_id: str):
+            nonlocal log_id, transaction_used
+            log_id = self.db.putLog(book_id, Action.CREATE, batch=transaction,
+                                    owner_id=book.owner_id)
+            self._updateCatalog(book_id, book, False, transaction)
+            # Its commit_time, once committed, is the CREATE log's timestamp
+            transaction_used = transaction
+
         book_id = self.db.putBook(book.isbn, book.owner_id, book.title,
                                   book.author, book.category, book.year,
-                                  book.thumbnail)
-        self.db.putLog(book_id, Action.CREATE)
+                                  book.thumbnail, also=addRecords)
+        self._publish(log_id, book_id, book.owner_id, Action.CREATE, None,
+                      transaction_used.commit_time)
+        if self.thumbnails and book.thumbnail:
+            self.thumbnails.prefetchInBackground(book.thumbnail)
+        if self.suggest:
+            self.suggest.addBook(book.owner_id, book.title, book.author)
         return book_id
 
-    def checkoutBook(self, isbn: str, user: User):
-        book_id = self.db.getBook(isbn).id
-        prev_log = self.db.getLatestLog(book_id)
-        if prev_log and prev_log.get("action") == Action.CHECKOUT.value:
+    def _copies(self, isbn: str, owner_id: int|None) -> list[tuple[DocumentSnapshot, bool]]:
+        # Every copy of this book (and whether it's out) in owner_id's
+        # library, or if it has none, in the first library that does
+        if owner_id is not None:
+            copies = self.db.getBookCopies(isbn, owner_id)
+        if owner_id is None or not copies:
+            book_vals = self.db.getBook(isbn)
+            if book_vals is None:
+                raise NotFoundException('No book in database with ISBN %s' % isbn)
+            copies = self.db.getBookCopies(isbn, book_vals.get("owner_id")) or [book_vals]
+        logs = self.db.getLatestLogs([b.id for b in copies])
+        return [(b, b.id in logs and logs[b.id].get("action") == Action.CHECKOUT.value)
+                for b in copies]
+
+    def checkoutBook(self, isbn: str, user: User, owner_id: int|None = None):
+        """Checks out the first available copy of this book from owner_id's
+        library (or any library, as for getBook).
+        """
+        available = [b for b, is_out in self._copies(isbn, owner_id) if not is_out]
+        if not available:
             raise InvalidStateException('Book with ISBN %s already out' % isbn)
+        book_vals = available[0]
+        book_id = book_vals.id
+        user_id = int(user.user_id)
+        book = self._bookFromLog(book_vals, None)
 
-        self.db.putLog(book_id, Action.CHECKOUT, int(user.user_id))
+        batch = self.db.batch()
+        log_id = self.db.putLog(book_id, Action.CHECKOUT, user_id, batch=batch,
+                                owner_id=book.owner_id)
+        self.db.recordCheckout(book_id, user_id, batch=batch)
+        self.db.putOutBook(book_id, book.owner_id, book.isbn, book.title,
+                           book.author, user_id, batch=batch)
+        self._updateCatalog(book_id, book, True, batch)
+        checkout_time = self.db.commit(batch, idempotent=False)
 
-        book = self.getBook(isbn)
+        book = replace(book, is_out=True, checkout_user=user.name,
+                       checkout_time=str(checkout_time))
+        self._publish(log_id, book_id, book.owner_id, Action.CHECKOUT,
+                      user_id, checkout_time)
         self.email.send_checkout_message(book, user)
 
-    def returnBook(self, isbn: str):
-        book_id = self.db.getBook(isbn).id
-        checkout_log = self.db.getLatestLog(book_id)
-        if not checkout_log or checkout_log.get("action") != Action.CHECKOUT.value:
+    def returnBook(self, isbn: str, owner_id: int|None = None):
+        """Returns the first checked-out copy of this book to owner_id's
+        library (or any library, as for getBook).
+        """
+        out = [b for b, is_out in self._copies(isbn, owner_id) if is_out]
+        if not out:
             raise InvalidStateException('Book with ISBN %s is not out' % isbn)
-
+        book_vals = out[0]
+        book_id = book_vals.id
+        checkout_log = self.db.getLatestLog(book_id)
         user_id = checkout_log.get("user_id")
-        self.db.putLog(book_id, Action.RETURN, user_id)
-
-        book = self.getBook(isbn)
         user_vals = self.db.getUser(user_id)
         user = User(user_id, user_vals.get("name"), user_vals.get("email"))
-        ret_time = self.db.getLatestLog(book_id).get("timestamp")
+        book = self._bookFromLog(book_vals, None)
+        # The return is stamped with the commit time, which isn't known until
+        # it's written along with the stats, so time the loan by our clock
+        loan_secs = max(
+            (datetime.now(UTC) - checkout_log.get("timestamp")).total_seconds(), 0)
+
+        batch = self.db.batch()
+        log_id = self.db.putLog(book_id, Action.RETURN, user_id, batch=batch,
+                                owner_id=book.owner_id)
+        self.db.deleteOutBook(book_id, batch=batch)
+        self._updateCatalog(book_id, book, False, batch)
+        self.db.recordReturn(book_id, user_id, loan_secs, batch=batch)
+        ret_time = self.db.commit(batch, idempotent=False)
+
+        self._publish(log_id, book_id, book.owner_id, Action.RETURN, user_id,
+                      ret_time)
         self.email.send_return_message(book, user, str(ret_time))
 
+    def _publish(self, log_id: str, book_id: str, owner_id: int,
+                 action: Action, user_id: int|None, timestamp):
+        if self.events:
+            self.events.publish(BookEvent(log_id, book_id, owner_id,
+                                          action.name.lower(), user_id,
+                                          str(timestamp)))
+
     def listBookCheckoutHistory(self, book_id: str) -> list[LogEntry]:
         logs = self.db.listLogsByBook(book_id)
         logs = map(self._parseLogs, logs)
@@ -111,11 +364,66 @@ class LocalBookService(BookService):
         logs = filter(lambda l: l.action in [Action.CHECKOUT, Action.RETURN], logs)
         return list(logs)
 
+    def exportBooks(self, user_id: int,
+                    page_size: int = 200) -> Iterator[tuple[Book, list[LogEntry]]]:
+        """Yields every book owned by this user along with its full log
+        history (earliest first), reading `page_size` books at a time so the
+        whole library never has to be held in memory.
+        """
+        names = {}
+        last = None
+        while True:
+            page = self.db.pageBooks(user_id, page_size, last)
+            if not page:
+                return
+            logs = self.db.listLogsByBooks([b.id for b in page])
+            for book_vals in page:
+                history = [self._parseLogs(l, names) for l in logs[book_vals.id]]
+                latest = history[-1] if history else None
+                yield self._bookFromLog(book_vals, latest), history
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    def _parseStats(self, stats_vals: DocumentSnapshot) -> CirculationStats:
+        vals = stats_vals.to_dict() or {}
+        returns = vals.get("returns", 0)
+        total = vals.get("total_loan_secs", 0)
+        avg = total / returns if returns else 0
+        last = vals.get("last_activity")
+        return CirculationStats(vals.get("checkouts", 0), returns, total, avg,
+                                str(last) if last else '')
+
+    def getBookStats(self, book_id: str) -> CirculationStats:
+        return self._parseStats(self.db.getBookStats(book_id))
+
+    def getUserStats(self, user_id: int) -> CirculationStats:
+        return self._parseStats(self.db.getUserStats(user_id))
+
+    def getRankings(self, owner_id: int|None = None) -> Rankings:
+        key = rankings.GLOBAL if owner_id is None else str(owner_id)
+        vals = self.db.getRankings(key).to_dict()
+        if not vals:
+            return Rankings('', {}, [])
+
+        def ranked(entry: dict) -> RankedBook:
+            book = vals["books"][entry["book_id"]]
+            last = entry.get("last_checkout")
+            return RankedBook(entry["book_id"], book["isbn"], book["owner_id"],
+                              book["title"], book["author"],
+                              entry.get("checkouts", 0), str(last) if last else '')
+
+        windows = {name: [ranked(e) for e in entries]
+                   for name, entries in vals["windows"].items()}
+        return Rankings(str(vals["updated"]), windows,
+                        [ranked(e) for e in vals["recent"]])
+
 
 class LocalUserService(UserService):
 
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, directory: UserDirectory|None = None):
         self.db = db
+        self.directory = directory
 
     def getUser(self, user_id: int) -> User:
         user_vals = self.db.getUser(user_id)
@@ -125,12 +433,21 @@ class LocalUserService(UserService):
         user_id = random.randint(MIN_USER_ID, MAX_USER_ID)
         user = User(user_id, name, email)
         self.db.putUser(user.user_id, user.name, user.email)
+        if self.directory:
+            self.directory.invalidate()
         return user
 
-    def listUsers(self) -> list[User]:
+    def listUsers(self, prefix: str|None = None) -> list[User]:
+        if self.directory:
+            return self.directory.listUsers(prefix)
         vals = self.db.listUsers()
-        return [User(int(v.id), v.get("name"), v.get("email")) for v in vals]
+        users = [User(int(v.id), v.get("name"), v.get("email")) for v in vals]
+        if prefix:
+            users = UserDirectory.filterByPrefix(users, prefix)
+        return users
 
     def updateUser(self, user_id: int, name: str):
         self.db.setUserName(user_id, name)
+        if self.directory:
+            self.directory.invalidate()
 
@@ -3,13 +3,16 @@ import os
 import requests
 import unittest
 
-from libraryserver.api.errors import InvalidStateException, NotFoundException
+from libraryserver.api.errors import InvalidStateException, InvalidTokenException, NotFoundException
 from libraryserver.api.models import Book, User, Action
 from libraryserver.constants import MIN_USER_ID, MAX_USER_ID
+from libraryserver.events.bus import EventBus
 from libraryserver.notifs.mailgun_client import FakeEmail
 from libraryserver.storage.firestore_client import Database
 from libraryserver.storage.local import LocalBookService, LocalUserService
+from libraryserver.storage.rankings import updateRankings
 from libraryserver.storage.testbase import BaseTestCase
+from libraryserver.storage.userdir import UserDirectory
 
 LOCAL_EMULATOR = "localhost:8287"
 
@@ -92,6 +95,22 @@ class TestBookService(BaseTestCase):
         with self.assertRaises(NotFoundException):
             self.books.getBook('isbn1')
 
+    def test_getBooks(self):
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, 'Babel', '', '', '', ''))
+        b2 = self.books.createBook(Book(None, 'isbn2', 2, 'Paul', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn2', user)
+
+        res = self.books.getBooks([b2, 'does-not-exist', b1])
+
+        self.assertEqual([b.book_id for b in res], [b2, b1])
+        self.assertEqual(res[0].is_out, True)
+        self.assertEqual(res[0].checkout_user, 'user')
+        self.assertAboutNow(res[0].checkout_time)
+        self.assertEqual(res[1].title, 'Babel')
+        self.assertEqual(res[1].is_out, False)
+
     def test_listBooks(self):
         b1 = self.db.putBook('isbn1', 1234, 'Babel', 'R.F. Kuang', 'Fiction', '2022', 'url')
         b2 = self.db.putBook('isbn2', 1234, 'Looking For Alaska', 'John Green', 'Fiction', '2005', 'url')
@@ -171,6 +190,108 @@ class TestBookService(BaseTestCase):
         self.assertEqual(len(books), 1)
         self.assertEqual(books[0].isbn, 'isbn-in')
         
+    def test_createBook_eventStampedWithLogTime(self):
+        self.books.events = EventBus()
+        sub = self.books.events.subscribe(1)
+
+        book_id = self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+
+        log = self.db.getLatestLog(book_id)
+        self.assertEqual(sub.get(0).timestamp, str(log.get("timestamp")))
+
+    def test_listChanges_noToken(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 2, '', '', '', '', ''))
+
+        res = self.books.listChanges(1)
+
+        self.assertTrue(res.reset)
+        self.assertEqual([b.isbn for b in res.books], ['isbn1'])
+
+    def test_listChanges_sinceToken(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        token = self.books.listChanges(1).token
+        self.db.putUser(1234, 'user', 'user@example.com')
+        self.books.createBook(Book(None, 'isbn2', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn3', 2, '', '', '', '', ''))
+        self.books.checkoutBook('isbn1', User(1234, 'user', 'user@example.com'))
+
+        res = self.books.listChanges(1, token)
+
+        self.assertFalse(res.reset)
+        self.assertFalse(res.more)
+        self.assertEqual([(b.isbn, b.is_out) for b in res.books],
+                         [('isbn2', False), ('isbn1', True)])
+        self.assertEqual(self.books.listChanges(1, res.token).books, [])
+
+    def test_listChanges_paged(self):
+        token = self.books.listChanges(1).token
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 1, '', '', '', '', ''))
+
+        first = self.books.listChanges(1, token, limit=1)
+        second = self.books.listChanges(1, first.token, limit=1)
+
+        self.assertTrue(first.more)
+        self.assertEqual([b.isbn for b in first.books + second.books],
+                         ['isbn1', 'isbn2'])
+
+    def test_listChanges_otherLibrariesDontPage(self):
+        token = self.books.listChanges(1).token
+        self.books.createBook(Book(None, 'isbn1', 2, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 2, '', '', '', '', ''))
+
+        res = self.books.listChanges(1, token, limit=1)
+
+        self.assertFalse(res.more)
+        self.assertEqual(res.books, [])
+
+    def test_listChanges_invalidToken(self):
+        with self.assertRaises(InvalidTokenException):
+            self.books.listChanges(1, 'garbage')
+
+    def test_searchCatalog_groupsByIsbnAndOwner(self):
+        self.db.putUser(1, 'Alice', 'alice@example.com')
+        self.db.putUser(2, 'Bob', 'bob@example.com')
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, 'Babel', 'R.F. Kuang', '', '', ''))
+        b2 = self.books.createBook(Book(None, 'isbn1', 2, 'Babel', 'R.F. Kuang', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 1, 'Paul', 'Andrea Lawlor', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+
+        res = self.books.searchCatalog('bab kua')
+
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0].isbn, 'isbn1')
+        self.assertEqual(res[0].available, True)
+        self.assertEqual([(h.owner_name, h.book_ids) for h in res[0].holdings],
+                         [('Alice', [b1]), ('Bob', [b2])])
+        self.assertEqual(sum(h.available for h in res[0].holdings), 1)
+
+    def test_searchCatalog_byIsbn(self):
+        self.books.createBook(Book(None, '9780062060624', 1, 'Babel', 'Kuang', '', '', ''))
+
+        res = self.books.searchCatalog('9780062060624')
+
+        self.assertEqual([e.title for e in res], ['Babel'])
+
+    def test_searchCatalog_returnedIsAvailable(self):
+        self.books.createBook(Book(None, 'isbn1', 1, 'Babel', 'Kuang', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+        self.books.returnBook('isbn1')
+
+        res = self.books.searchCatalog('babel')
+
+        self.assertEqual(res[0].available, True)
+
+    def test_searchCatalog_noMatch(self):
+        self.books.createBook(Book(None, 'isbn1', 1, 'Babel', 'Kuang', '', '', ''))
+
+        self.assertEqual(self.books.searchCatalog('babel dickens'), [])
+
     def test_createBook(self):
         book = Book(None, 'isbn1', 1, 'Paul', 'Andrea Lawler', 'Fiction', '2017', 'url')
 
@@ -202,6 +323,58 @@ class TestBookService(BaseTestCase):
         with self.assertRaises(InvalidStateException):
             self.books.checkoutBook('isbn1', user)
 
+    def test_checkoutBook_picksAvailableCopy(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+
+        self.books.checkoutBook('isbn1', user, 1)
+        self.books.checkoutBook('isbn1', user, 1)
+
+        out = self.books.listBooksByStatus(1, True)
+        self.assertEqual(sorted(b.book_id for b in out), ['1-isbn1', '1-isbn1-2'])
+        with self.assertRaises(InvalidStateException):
+            self.books.checkoutBook('isbn1', user, 1)
+
+    def test_checkoutBook_prefersOwnersCopy(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn1', 2, '', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+
+        self.books.checkoutBook('isbn1', user, 2)
+
+        self.assertEqual(self.books.getBook('isbn1', 2).is_out, True)
+        self.assertEqual(self.books.getBook('isbn1', 1).is_out, False)
+
+    def test_checkoutBook_notFound(self):
+        user = User(1234, 'user', 'user@example.com')
+
+        with self.assertRaises(NotFoundException):
+            self.books.checkoutBook('isbn1', user)
+
+    def test_checkoutBook_writesIndexesWithLog(self):
+        book_id = self.books.createBook(Book(None, 'isbn1', 1, 'Babel', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+
+        self.books.checkoutBook('isbn1', user)
+
+        log = self.db.getLatestLog(book_id)
+        out = self.db.outbooks_ref.document(book_id).get()
+        # Written in the same commit, so stamped with the same time
+        self.assertEqual(out.get('checkout_time'), log.get('timestamp'))
+        self.assertEqual(self.db.getBookStats(book_id).get('last_activity'),
+                         log.get('timestamp'))
+        self.assertTrue(self.db.getCatalogEntry('isbn1').get('copies')[book_id]['is_out'])
+
+        self.books.returnBook('isbn1')
+
+        self.assertFalse(self.db.outbooks_ref.document(book_id).get().exists)
+        self.assertEqual(self.db.getBookStats(book_id).get('returns'), 1)
+        self.assertFalse(self.db.getCatalogEntry('isbn1').get('copies')[book_id]['is_out'])
+
     def test_checkoutBook_sendsEmail(self):
         # TODO
         return
@@ -281,6 +454,130 @@ class TestBookService(BaseTestCase):
         self.assertEqual(res[1].user_id, user.user_id)
         self.assertEqual(res[1].user_name, 'user')
 
+    def test_listLoans(self):
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, 'Babel', 'R.F. Kuang', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 2, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn3', 3, '', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+        self.books.checkoutBook('isbn2', user)
+        self.books.returnBook('isbn2')
+
+        res = self.books.listLoans()
+
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0].book_id, b1)
+        self.assertEqual(res[0].owner_id, 1)
+        self.assertEqual(res[0].title, 'Babel')
+        self.assertEqual(res[0].user_id, 1234)
+        self.assertAboutNow(res[0].checkout_time)
+
+    def test_listLoans_minDays(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+
+        self.assertEqual(self.books.listLoans(min_days=1), [])
+
+    def test_sendOverdueReminders(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 2, '', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+        self.books.checkoutBook('isbn2', user)
+
+        first = self.books.sendOverdueReminders(0, 1)
+        second = self.books.sendOverdueReminders(0, 1)
+
+        self.assertEqual(first, 1)
+        self.assertEqual(second, 0)
+
+    def test_exportBooks(self):
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, 'Babel', '', '', '', ''))
+        b2 = self.books.createBook(Book(None, 'isbn2', 1, 'Paul', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn3', 2, 'Other', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+
+        res = sorted(self.books.exportBooks(1, page_size=1), key=lambda r: r[0].isbn)
+
+        self.assertEqual([book.book_id for book, _ in res], [b1, b2])
+        self.assertEqual(res[0][0].is_out, True)
+        self.assertEqual(res[0][0].checkout_user, 'user')
+        self.assertEqual([l.action for l in res[0][1]], [Action.CREATE, Action.CHECKOUT])
+        self.assertEqual(res[1][0].is_out, False)
+        self.assertEqual([l.action for l in res[1][1]], [Action.CREATE])
+
+    def test_getBookStats(self):
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+        self.books.returnBook('isbn1')
+        self.books.checkoutBook('isbn1', user)
+
+        res = self.books.getBookStats(b1)
+
+        self.assertEqual(res.checkouts, 2)
+        self.assertEqual(res.returns, 1)
+        self.assertGreater(res.total_loan_secs, 0)
+        self.assertEqual(res.avg_loan_secs, res.total_loan_secs)
+        self.assertAboutNow(res.last_activity)
+
+    def test_getBookStats_noActivity(self):
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+
+        res = self.books.getBookStats(b1)
+
+        self.assertEqual(res.checkouts, 0)
+        self.assertEqual(res.returns, 0)
+        self.assertEqual(res.avg_loan_secs, 0)
+        self.assertEqual(res.last_activity, '')
+
+    def test_getUserStats(self):
+        self.books.createBook(Book(None, 'isbn1', 1, '', '', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 1, '', '', '', '', ''))
+        user = self.users.createUser('user', 'user@example.com')
+        other = self.users.createUser('other', 'other@example.com')
+        self.books.checkoutBook('isbn1', user)
+        self.books.returnBook('isbn1')
+        self.books.checkoutBook('isbn2', user)
+        self.books.checkoutBook('isbn1', other)
+
+        res = self.books.getUserStats(user.user_id)
+
+        self.assertEqual(res.checkouts, 2)
+        self.assertEqual(res.returns, 1)
+
+    def test_getRankings(self):
+        b1 = self.books.createBook(Book(None, 'isbn1', 1, 'Babel', 'Kuang', '', '', ''))
+        self.books.createBook(Book(None, 'isbn2', 2, 'Paul', 'Lawlor', '', '', ''))
+        user = User(1234, 'user', 'user@example.com')
+        self.db.putUser(user.user_id, user.name, user.email)
+        self.books.checkoutBook('isbn1', user)
+        self.books.returnBook('isbn1')
+        self.books.checkoutBook('isbn1', user)
+        updateRankings(self.db)
+
+        res = self.books.getRankings(1)
+
+        self.assertEqual([(b.book_id, b.checkouts) for b in res.windows['7d']], [(b1, 2)])
+        self.assertEqual([(b.book_id, b.checkouts) for b in res.windows['all']], [(b1, 2)])
+        self.assertEqual(res.recent[0].title, 'Babel')
+        self.assertAboutNow(res.recent[0].last_checkout)
+        self.assertEqual(self.books.getRankings(2).windows, {})
+
+    def test_getRankings_notComputed(self):
+        res = self.books.getRankings(1)
+
+        self.assertEqual(res.windows, {})
+        self.assertEqual(res.recent, [])
+
+
 class TestUserService(BaseTestCase):
 
     def setUp(self):
@@ -327,6 +624,25 @@ class TestUserService(BaseTestCase):
         self.assertEqual(res[1].name, 'Other')
         self.assertEqual(res[1].email, 'someone@example.com')
 
+    def test_listUsers_prefix(self):
+        self.db.putUser(1234, 'Brian', 'me@example.com')
+        self.db.putUser(5678, 'Other', 'someone@example.com')
+
+        res = self.users.listUsers('bri')
+
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0].user_id, 1234)
+
+    def test_listUsers_withDirectory(self):
+        users = LocalUserService(self.db, UserDirectory(self.db))
+        self.db.putUser(1234, 'Brian', 'me@example.com')
+        users.listUsers()
+
+        users.updateUser(1234, 'Charlie')
+        res = users.listUsers()
+
+        self.assertEqual(res[0].name, 'Charlie')
+
     def test_updateUser(self):
         self.db.putUser(1234, 'Brian', 'me@example.com')
 
@@ -0,0 +1,107 @@
+"""Precomputes the most borrowed and most recently borrowed books.
+
+Rankings are stored as one small document per owner in `rankings`, plus a
+`global` one covering every library, so serving them never touches
+`actionlogs`. Windowed counts come from the last 90 days of CHECKOUT logs
+(which compaction always leaves in place), all-time counts from `bookstats`.
+
+Run periodically (e.g. hourly) with `python -m libraryserver.storage.rankings`.
+"""
+
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+import logging
+
+from libraryserver.api.models import Action
+from libraryserver.storage.firestore_client import Database, connect
+
+# Sliding windows to rank over, by name. Must fit within compaction.MIN_AGE.
+WINDOWS = {'7d': 7, '30d': 30, '90d': 90}
+ALL_TIME = 'all'
+GLOBAL = 'global'
+TOP_N = 20
+
+logger = logging.getLogger(__name__)
+
+
+def computeRankings(logs, books: dict, all_time: dict[str, int],
+                    now: datetime, top_n: int = TOP_N) -> dict[str, dict]:
+    """Ranks books from `logs` (covering at least the longest window),
+    `books` (book ID -> book document) and `all_time` (book ID -> total
+    checkouts). Returns the ranking documents keyed by owner ID (as a string)
+    and GLOBAL.
+    """
+    checkouts = [(log.get("book_id"), log.get("timestamp")) for log in logs
+                 if log.get("action") == Action.CHECKOUT.value
+                 and log.get("book_id") in books]
+
+    scopes = {GLOBAL: set(books)}
+    for book_id, book in books.items():
+        scopes.setdefault(str(book.get("owner_id")), set()).add(book_id)
+
+    rankings = {}
+    for key, ids in scopes.items():
+        scoped = [(b, t) for b, t in checkouts if b in ids]
+        windows = {}
+        for name, days in WINDOWS.items():
+            since = now - timedelta(days=days)
+            windows[name] = _top(Counter(b for b, t in scoped if t >= since), top_n)
+        windows[ALL_TIME] = _top(
+            Counter({b: n for b, n in all_time.items() if b in ids and n}), top_n)
+
+        last = {}
+        for book_id, t in scoped:
+            last[book_id] = max(t, last.get(book_id, t))
+        recent = sorted(last.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)
+        recent = [{"book_id": b, "last_checkout": t} for b, t in recent[:top_n]]
+
+        ranked = ({e["book_id"] for w in windows.values() for e in w} |
+                  {e["book_id"] for e in recent})
+        if key != GLOBAL and not ranked:
+            continue
+        rankings[key] = {
+            "windows": windows,
+            "recent": recent,
+            "books": {b: _bookSummary(books[b]) for b in ranked}
+        }
+    return rankings
+
+
+def _top(counts: Counter, top_n: int) -> list[dict]:
+    top = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:top_n]
+    return [{"book_id": b, "checkouts": n} for b, n in top]
+
+
+def _bookSummary(book) -> dict:
+    return {
+        "isbn": book.get("isbn"),
+        "owner_id": book.get("owner_id"),
+        "title": book.get("title"),
+        "author": book.get("author")
+    }
+
+
+def updateRankings(db: Database, top_n: int = TOP_N) -> int:
+    """Recomputes and stores every ranking. Returns how many were stored."""
+    now = datetime.now(UTC)
+    logs = db.listLogsSince(now - timedelta(days=max(WINDOWS.values())))
+    all_time = {s.id: s.to_dict().get("checkouts", 0)
+                for s in db.listAllBookStats()}
+    book_ids = {log.get("book_id") for log in logs} | set(all_time)
+    books = {b.id: b for b in db.getBooksById(sorted(book_ids))}
+
+    rankings = computeRankings(logs, books, all_time, now, top_n)
+    for key, ranking in rankings.items():
+        db.putRankings(key, ranking)
+    return len(rankings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--top', type=int, default=TOP_N,
+                        help='number of books to keep in each ranking')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info('Stored %d rankings', updateRankings(Database(connect()), args.top))
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, UTC
+import unittest
+
+from libraryserver.api.models import Action
+from libraryserver.storage.rankings import ALL_TIME, GLOBAL, computeRankings
+
+NOW = datetime(2024, 6, 1, tzinfo=UTC)
+
+
+class FakeDoc:
+
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, field):
+        return self.data[field]
+
+
+def book(owner_id, title):
+    return FakeDoc({'isbn': 'isbn-' + title, 'owner_id': owner_id,
+                    'title': title, 'author': 'author'})
+
+
+def log(book_id, days_ago, action=Action.CHECKOUT):
+    return FakeDoc({'book_id': book_id, 'action': action.value,
+                    'timestamp': NOW - timedelta(days=days_ago)})
+
+
+class TestComputeRankings(unittest.TestCase):
+
+    def setUp(self):
+        self.books = {'b1': book(1, 'Babel'), 'b2': book(1, 'Paul'),
+                      'b3': book(2, 'Bleak House')}
+
+    def test_windows(self):
+        logs = [log('b1', 60), log('b1', 20), log('b2', 3), log('b2', 2),
+                log('b2', 1, Action.RETURN)]
+
+        res = computeRankings(logs, self.books, {}, NOW)
+
+        windows = res['1']['windows']
+        self.assertEqual(windows['7d'], [{'book_id': 'b2', 'checkouts': 2}])
+        self.assertEqual(windows['30d'], [{'book_id': 'b2', 'checkouts': 2},
+                                          {'book_id': 'b1', 'checkouts': 1}])
+        self.assertEqual(windows['90d'], [{'book_id': 'b1', 'checkouts': 2},
+                                          {'book_id': 'b2', 'checkouts': 2}])
+
+    def test_allTimeFromStats(self):
+        res = computeRankings([], self.books, {'b1': 5, 'b3': 7, 'b2': 0}, NOW)
+
+        self.assertEqual(res['1']['windows'][ALL_TIME],
+                         [{'book_id': 'b1', 'checkouts': 5}])
+        self.assertEqual(res[GLOBAL]['windows'][ALL_TIME],
+                         [{'book_id': 'b3', 'checkouts': 7},
+                          {'book_id': 'b1', 'checkouts': 5}])
+
+    def test_recent(self):
+        logs = [log('b1', 10), log('b3', 5), log('b1', 1)]
+
+        res = computeRankings(logs, self.books, {}, NOW)
+
+        self.assertEqual([(e['book_id'], e['last_checkout']) for e in res[GLOBAL]['recent']],
+                         [('b1', NOW - timedelta(days=1)),
+                          ('b3', NOW - timedelta(days=5))])
+
+    def test_topN(self):
+        logs = [log('b1', 1), log('b1', 2), log('b2', 1), log('b3', 1)]
+
+        res = computeRankings(logs, self.books, {}, NOW, top_n=1)
+
+        self.assertEqual(res[GLOBAL]['windows']['7d'], [{'book_id': 'b1', 'checkouts': 2}])
+        self.assertEqual(len(res[GLOBAL]['recent']), 1)
+
+    def test_includesOnlyRankedBooks(self):
+        res = computeRankings([log('b1', 1)], self.books, {}, NOW)
+
+        self.assertEqual(set(res[GLOBAL]['books']), {'b1'})
+        self.assertEqual(res['1']['books']['b1']['title'], 'Babel')
+        self.assertNotIn('2', res)
+
+    def test_ignoresUnknownBooks(self):
+        res = computeRankings([log('gone', 1)], self.books, {}, NOW)
+
+        self.assertEqual(res[GLOBAL]['windows']['7d'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
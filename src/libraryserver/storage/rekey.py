@@ -0,0 +1,108 @@
+"""Moves books created before ISBN-addressed keys to their new document IDs.
+
+Books used to get random document IDs, so finding one by ISBN took a query.
+New books are keyed by owner and ISBN-13 (see isbn.bookKey), with further
+copies of the same book numbered after the first. This job gives existing
+books the same treatment, carrying their logs, stats and catalog entries
+along, and stores their owner IDs as ints. It's safe to rerun, including after an interrupted run. Rankings
+pick up the new IDs the next time the rankings job runs.
+
+Run once with `python -m libraryserver.storage.rekey`.
+"""
+
+import argparse
+from collections import defaultdict
+import logging
+import re
+
+from libraryserver.isbn import bookKey, canonical
+from libraryserver.search import catalog
+from libraryserver.storage.firestore_client import Database, connect
+
+logger = logging.getLogger(__name__)
+
+
+def _copyNumber(book_id: str, owner_id, isbn: str) -> int|None:
+    # The copy number encoded in this ID, or None for a legacy ID
+    first = bookKey(owner_id, isbn)
+    if book_id == first:
+        return 1
+    match = re.fullmatch(re.escape(first) + r'-(\d+)', book_id)
+    return int(match.group(1)) if match else None
+
+
+def planKeys(books) -> tuple[dict[str, tuple[str, int]], dict[str, int]]:
+    """Works out where every legacy book should move. Returns a map of legacy
+    ID to (new ID, copy number), and the number of copies each first-copy ID
+    should record.
+
+    Copies of a book in the same library keep their relative (ID) order and
+    take whichever copy numbers are free. A book already moved by an earlier,
+    interrupted run keeps the ID it was given then.
+    """
+    groups = defaultdict(list)
+    for book in books:
+        vals = book.to_dict()
+        # Older books have string owner IDs
+        groups[(int(vals["owner_id"]), canonical(vals["isbn"]))].append(book)
+
+    moves, copies = {}, {}
+    for (owner_id, isbn), group in groups.items():
+        taken, moved, legacy = set(), {}, []
+        for book in group:
+            number = _copyNumber(book.id, owner_id, isbn)
+            if number is None:
+                legacy.append(book.id)
+                continue
+            taken.add(number)
+            rekeyed_from = book.to_dict().get("rekeyed_from")
+            if rekeyed_from:
+                moved[rekeyed_from] = number
+        number = 0
+        for book_id in sorted(legacy):
+            if book_id in moved:
+                copy = moved[book_id]
+            else:
+                number += 1
+                while number in taken:
+                    number += 1
+                copy = number
+                taken.add(copy)
+            moves[book_id] = (bookKey(owner_id, isbn, copy), copy)
+        if legacy:
+            copies[bookKey(owner_id, isbn)] = max(taken)
+    return moves, copies
+
+
+def rekeyAll(db: Database) -> int:
+    """Moves every legacy book to its ISBN-addressed key. Returns how many
+    were moved.
+    """
+    books = list(db.books_ref.stream())
+    by_id = {book.id: book for book in books}
+    moves, copies = planKeys(books)
+    for old_id, (new_id, copy) in sorted(moves.items()):
+        db.rekeyBook(by_id[old_id], new_id, copy)
+        logger.info('Moved book %s to %s', old_id, new_id)
+    for first_id, count in copies.items():
+        db.books_ref.document(first_id).update({"copies": count})
+    for book in books:
+        if book.id not in moves and isinstance(book.get("owner_id"), str):
+            book.reference.update({"owner_id": int(book.get("owner_id"))})
+
+    if moves:
+        # Entries keyed by a raw ISBN-10 now only hold moved copies, which the
+        # rebuild adds back under the ISBN-13
+        for entry in db.catalog_ref.stream():
+            if entry.id != canonical(entry.id):
+                entry.reference.delete()
+        catalog.rebuildCatalog(db)
+    return len(moves)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info('Moved %d books', rekeyAll(Database(connect())))
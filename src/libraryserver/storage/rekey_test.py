@@ -0,0 +1,66 @@
+import unittest
+
+from libraryserver.storage.rekey import planKeys
+
+
+class FakeDoc:
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class TestPlanKeys(unittest.TestCase):
+
+    def test_numbersCopiesInIdOrder(self):
+        books = [FakeDoc('b2', {'isbn': '9780062060624', 'owner_id': 1}),
+                 FakeDoc('b1', {'isbn': '0-06-206062-7', 'owner_id': 1}),
+                 FakeDoc('b3', {'isbn': '9780062060624', 'owner_id': 2})]
+
+        moves, copies = planKeys(books)
+
+        self.assertEqual(moves, {'b1': ('1-9780062060624', 1),
+                                 'b2': ('1-9780062060624-2', 2),
+                                 'b3': ('2-9780062060624', 1)})
+        self.assertEqual(copies, {'1-9780062060624': 2, '2-9780062060624': 1})
+
+    def test_skipsTakenNumbers(self):
+        books = [FakeDoc('1-isbn1', {'isbn': 'isbn1', 'owner_id': 1}),
+                 FakeDoc('b1', {'isbn': 'isbn1', 'owner_id': 1})]
+
+        moves, copies = planKeys(books)
+
+        self.assertEqual(moves, {'b1': ('1-isbn1-2', 2)})
+        self.assertEqual(copies, {'1-isbn1': 2})
+
+    def test_resumesInterruptedMove(self):
+        books = [FakeDoc('b1', {'isbn': 'isbn1', 'owner_id': 1}),
+                 FakeDoc('b2', {'isbn': 'isbn1', 'owner_id': 1}),
+                 FakeDoc('1-isbn1', {'isbn': 'isbn1', 'owner_id': 1,
+                                     'rekeyed_from': 'b2'})]
+
+        moves, _ = planKeys(books)
+
+        self.assertEqual(moves, {'b1': ('1-isbn1-2', 2),
+                                 'b2': ('1-isbn1', 1)})
+
+    def test_groupsStringAndIntOwners(self):
+        books = [FakeDoc('b1', {'isbn': 'isbn1', 'owner_id': '1'}),
+                 FakeDoc('b2', {'isbn': 'isbn1', 'owner_id': 1})]
+
+        moves, copies = planKeys(books)
+
+        self.assertEqual(moves, {'b1': ('1-isbn1', 1), 'b2': ('1-isbn1-2', 2)})
+        self.assertEqual(copies, {'1-isbn1': 2})
+
+    def test_nothingToMove(self):
+        books = [FakeDoc('1-isbn1', {'isbn': 'isbn1', 'owner_id': 1})]
+
+        self.assertEqual(planKeys(books), ({}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+from collections import defaultdict
+from datetime import datetime
+from google.cloud.firestore_v1.base_document import DocumentSnapshot
+from google.cloud.firestore_v1.client import Client
+from google.cloud.firestore_v1.watch import ChangeType
+import itertools
+import threading
+import time
+
+from libraryserver.api.models import Action
+from libraryserver.isbn import bookKey
+from libraryserver.storage.firestore_client import Database
+
+
+class ReplicatedDatabase(Database):
+    """Database that keeps an in-process replica of the `books`, `users` and
+    `actionlogs` collections, fed by Firestore snapshot listeners.
+
+    `getBook`, `listBooks`, `getLatestLog` and `getUser` (and their bulk
+    variants) are served from memory once every listener has delivered its initial snapshot. Writes still go
+    straight to Firestore (via the base class). Anything this instance has
+    written but not yet seen come back through a listener is considered
+    pending, and reads touching it fall through to Firestore, so callers
+    always read their own writes.
+    """
+
+    # How long a local write may stay unconfirmed by the listeners before we
+    # stop waiting for it. Only matters for writes that don't change the
+    # document (which Firestore never echoes back).
+    PENDING_TTL_SECS = 10
+
+    def __init__(self, cli: Client):
+        super().__init__(cli)
+        self._lock = threading.Lock()
+        self._books: dict[str, DocumentSnapshot] = {}
+        self._books_by_isbn: dict[str, set[str]] = defaultdict(set)
+        # Keyed by str(owner_id), as older books have string owner IDs
+        self._books_by_owner: dict[str, set[str]] = defaultdict(set)
+        self._users: dict[str, DocumentSnapshot] = {}
+        self._logs: dict[str, DocumentSnapshot] = {}  # log ID -> log
+        self._logs_by_book: dict[str, set[str]] = defaultdict(set)
+        self._latest_logs: dict[str, DocumentSnapshot] = {}  # book ID -> log
+        # Collection name -> read time of the last snapshot applied from it
+        self._read_times: dict[str, datetime] = {}
+        # Replica key (e.g. "owner:1234") -> document ID -> time of the write
+        self._pending: dict[str, dict[str, float]] = defaultdict(dict)
+        self._pending_keys: dict[str, set[str]] = defaultdict(set)  # doc ID -> keys
+        self._placeholders = itertools.count()
+
+        self._watches = [
+            self.books_ref.on_snapshot(self._collectionListener('books', self._applyBook)),
+            self.users_ref.on_snapshot(self._collectionListener('users', self._applyUser)),
+            self.logs_ref.on_snapshot(self._collectionListener('actionlogs', self._applyLog)),
+        ]
+
+    def close(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+
+    def watermark(self) -> datetime|None:
+        """Returns the point in time the replica is known to be consistent
+        with, or None if it hasn't finished its initial sync.
+        """
+        with self._lock:
+            if len(self._read_times) < len(self._watches):
+                return None
+            return min(self._read_times.values())
+
+    def isServing(self) -> bool:
+        return (self.watermark() is not None and
+                all(watch.is_active for watch in self._watches))
+
+    # Listener callbacks. These run on Firestore's watch threads.
+
+    def _collectionListener(self, name, apply):
+        def callback(docs, changes, read_time):
+            with self._lock:
+                for change in changes:
+                    apply(change.document, change.type == ChangeType.REMOVED)
+                    self._confirm(change.document.id)
+                self._read_times[name] = read_time
+        return callback
+
+    def _applyBook(self, doc: DocumentSnapshot, removed: bool):
+        old = self._books.pop(doc.id, None)
+        if old is not None:
+            self._books_by_isbn[old.get('isbn')].discard(doc.id)
+            self._books_by_owner[str(old.get('owner_id'))].discard(doc.id)
+        if not removed:
+            self._books[doc.id] = doc
+            self._books_by_isbn[doc.get('isbn')].add(doc.id)
+            self._books_by_owner[str(doc.get('owner_id'))].add(doc.id)
+
+    def _applyUser(self, doc: DocumentSnapshot, removed: bool):
+        if removed:
+            self._users.pop(doc.id, None)
+        else:
+            self._users[doc.id] = doc
+
+    def _applyLog(self, doc: DocumentSnapshot, removed: bool):
+        book_id = doc.get('book_id')
+        latest = self._latest_logs.get(book_id)
+        if removed:
+            self._logs.pop(doc.id, None)
+            self._logs_by_book[book_id].discard(doc.id)
+            if not self._logs_by_book[book_id]:
+                del self._logs_by_book[book_id]
+            if latest is not None and latest.id == doc.id:
+                # Recompute from whatever we still hold for this book
+                remaining = [self._logs[i]
+                             for i in self._logs_by_book.get(book_id, ())]
+                if remaining:
+                    self._latest_logs[book_id] = max(remaining, key=_logTime)
+                else:
+                    del self._latest_logs[book_id]
+            return
+        self._logs[doc.id] = doc
+        self._logs_by_book[book_id].add(doc.id)
+        if (latest is None or latest.id == doc.id or
+                _logTime(doc) >= _logTime(latest)):
+            self._latest_logs[book_id] = doc
+
+    def _confirm(self, doc_id: str):
+        for key in self._pending_keys.pop(doc_id, ()):
+            self._pending[key].pop(doc_id, None)
+            if not self._pending[key]:
+                del self._pending[key]
+
+    # Pending-write bookkeeping. Keys are marked before the write is sent, so
+    # a listener echo that beats the write's return can't be missed. Writes
+    # that only learn their document ID from Firestore are held under a
+    # placeholder until then.
+
+    def _markPending(self, doc_id: str, *keys: str) -> list[str]:
+        """Returns the keys that weren't already waiting on doc_id."""
+        now = time.monotonic()
+        with self._lock:
+            added = [k for k in keys if doc_id not in self._pending.get(k, ())]
+            for key in keys:
+                self._pending[key][doc_id] = now
+                self._pending_keys[doc_id].add(key)
+            return added
+
+    def _unmarkPending(self, doc_id: str, keys: list[str]):
+        with self._lock:
+            for key in keys:
+                pending = self._pending.get(key, {})
+                pending.pop(doc_id, None)
+                if not pending:
+                    self._pending.pop(key, None)
+                self._pending_keys[doc_id].discard(key)
+            if not self._pending_keys[doc_id]:
+                del self._pending_keys[doc_id]
+
+    def _writeUnknownId(self, keys: list[str], write, seen: dict[str, DocumentSnapshot]) -> str:
+        # Runs write(), which returns the new document's ID. `seen` is the
+        # replica's map of that collection, where an echo that arrived first
+        # will already be.
+        placeholder = 'write:%d' % next(self._placeholders)
+        self._markPending(placeholder, *keys)
+        try:
+            doc_id = write()
+        finally:
+            self._unmarkPending(placeholder, keys)
+        now = time.monotonic()
+        with self._lock:
+            if doc_id not in seen:
+                for key in keys:
+                    self._pending[key][doc_id] = now
+                    self._pending_keys[doc_id].add(key)
+        return doc_id
+
+    def _writeKnownId(self, doc_id: str, keys: list[str], write):
+        added = self._markPending(doc_id, *keys)
+        try:
+            write()
+        except BaseException:
+            self._unmarkPending(doc_id, added)
+            raise
+
+    def _canServe(self, key: str) -> bool:
+        if not self.isServing():
+            return False
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return True
+            now = time.monotonic()
+            for doc_id in [d for d, t in pending.items()
+                           if now - t > self.PENDING_TTL_SECS]:
+                del pending[doc_id]
+                self._pending_keys[doc_id].discard(key)
+                if not self._pending_keys[doc_id]:
+                    del self._pending_keys[doc_id]
+            if pending:
+                return False
+            del self._pending[key]
+            return True
+
+    # Writes
+
+    def putBook(self, isbn, owner_id, title, author, cat, year, img, also=None):
+        return self._writeUnknownId(
+            ['isbn:%s' % isbn, 'owner:%s' % owner_id],
+            lambda: super(ReplicatedDatabase, self).putBook(
+                isbn, owner_id, title, author, cat, year, img, also),
+            self._books)
+
+    def putLog(self, book_id: str, action: Action, user_id: int = 0, batch=None,
+               owner_id: int|None = None):
+        return self._writeUnknownId(
+            ['log:%s' % book_id],
+            lambda: super(ReplicatedDatabase, self).putLog(
+                book_id, action, user_id, batch, owner_id),
+            self._logs)
+
+    def putUser(self, user_id: int, name: str, email: str):
+        self._writeKnownId(str(user_id), ['user:%s' % user_id],
+                           lambda: super(ReplicatedDatabase, self).putUser(user_id, name, email))
+
+    def setUserName(self, user_id: int, name: str):
+        self._writeKnownId(str(user_id), ['user:%s' % user_id],
+                           lambda: super(ReplicatedDatabase, self).setUserName(user_id, name))
+
+    def setUserTokenUid(self, user_id: int, token_uid: str):
+        self._writeKnownId(str(user_id), ['user:%s' % user_id],
+                           lambda: super(ReplicatedDatabase, self).setUserTokenUid(user_id, token_uid))
+
+    # Reads
+
+    def getBook(self, isbn: str, owner_id: int|None = None) -> DocumentSnapshot|None:
+        if not self._canServe('isbn:%s' % isbn):
+            return super().getBook(isbn, owner_id)
+        with self._lock:
+            if owner_id is not None:
+                book = self._books.get(bookKey(owner_id, isbn))
+                if book is not None:
+                    return book
+                ids = [i for i in self._books_by_isbn.get(isbn, ())
+                       if str(self._books[i].get('owner_id')) == str(owner_id)]
+            else:
+                ids = self._books_by_isbn.get(isbn)
+            if not ids:
+                return None
+            # Firestore returns query results in document ID order
+            return self._books[min(ids)]
+
+    def getBooksById(self, book_ids: list[str]) -> list[DocumentSnapshot]:
+        if not self.isServing():
+            return super().getBooksById(book_ids)
+        with self._lock:
+            # A book we haven't seen yet may be a pending local write
+            missing = [i for i in book_ids if i not in self._books]
+            books = [self._books[i] for i in book_ids if i in self._books]
+        if missing:
+            books += super().getBooksById(missing)
+        return books
+
+    def listBooks(self, user_id: int, search: str|None = None) -> list[DocumentSnapshot]:
+        if not self._canServe('owner:%s' % user_id):
+            return super().listBooks(user_id, search)
+        with self._lock:
+            ids = sorted(self._books_by_owner.get(str(user_id), ()))
+            books = [self._books[i] for i in ids]
+        if search:
+            books = [book for book in books if self._matches(book, search)]
+        return books
+
+    def getLatestLog(self, book_id: str) -> DocumentSnapshot|None:
+        if not self._canServe('log:%s' % book_id):
+            return super().getLatestLog(book_id)
+        with self._lock:
+            return self._latest_logs.get(book_id)
+
+    def getLatestLogs(self, book_ids: list[str]) -> dict[str, DocumentSnapshot]:
+        servable = [i for i in book_ids if self._canServe('log:%s' % i)]
+        with self._lock:
+            latest = {i: self._latest_logs[i] for i in servable
+                      if i in self._latest_logs}
+        rest = [i for i in book_ids if i not in servable]
+        if rest:
+            latest.update(super().getLatestLogs(rest))
+        return latest
+
+    def getCheckouts(self, book_ids: list[str]) -> dict[str, tuple[int, datetime]]:
+        servable = [i for i in book_ids if self._canServe('log:%s' % i)]
+        checkouts = {}
+        with self._lock:
+            for book_id in servable:
+                log = self._latest_logs.get(book_id)
+                if log is not None and log.get('action') == Action.CHECKOUT.value:
+                    checkouts[book_id] = (int(log.get('user_id')), _logTime(log))
+        rest = [i for i in book_ids if i not in servable]
+        if rest:
+            checkouts.update(super().getCheckouts(rest))
+        return checkouts
+
+    def getUser(self, user_id: int) -> DocumentSnapshot:
+        if not self._canServe('user:%s' % user_id):
+            return super().getUser(user_id)
+        with self._lock:
+            user = self._users.get(str(user_id))
+        if user is None:
+            # Let Firestore produce its usual non-existent snapshot
+            return super().getUser(user_id)
+        return user
+
+
+def _logTime(log: DocumentSnapshot) -> datetime:
+    return log.get('timestamp')
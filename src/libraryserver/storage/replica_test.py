@@ -0,0 +1,220 @@
+from datetime import datetime, timedelta, UTC
+from google.cloud.firestore_v1.watch import ChangeType
+import unittest
+from unittest import mock
+
+from libraryserver.api.models import Action
+from libraryserver.storage.replica import ReplicatedDatabase
+
+T0 = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+class FakeDoc:
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.data = data
+        self.exists = True
+
+    def get(self, field):
+        return self.data[field]
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeChange:
+
+    def __init__(self, doc, change_type=ChangeType.ADDED):
+        self.document = doc
+        self.type = change_type
+
+
+class TestReplicatedDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.cli = mock.MagicMock()
+        self.callbacks = {}
+        def collection(name):
+            ref = mock.MagicMock()
+            ref.on_snapshot.side_effect = (
+                lambda cb: self.callbacks.setdefault(name, cb) and mock.MagicMock(is_active=True))
+            return ref
+        self.cli.collection.side_effect = collection
+        self.db = ReplicatedDatabase(self.cli)
+
+    def push(self, name, *changes, read_time=T0):
+        self.callbacks[name]([], list(changes), read_time)
+
+    def syncAll(self):
+        for name in ['books', 'users', 'actionlogs']:
+            self.push(name)
+
+    def test_notServingUntilSynced(self):
+        self.push('books')
+        self.push('users')
+
+        self.assertIsNone(self.db.watermark())
+        self.assertFalse(self.db.isServing())
+
+    def test_watermarkIsOldestReadTime(self):
+        self.push('books', read_time=T0 + timedelta(seconds=5))
+        self.push('users', read_time=T0)
+        self.push('actionlogs', read_time=T0 + timedelta(seconds=2))
+
+        self.assertEqual(self.db.watermark(), T0)
+
+    def test_getBook_fromReplica(self):
+        self.syncAll()
+        self.push('books', FakeChange(FakeDoc('b1', {'isbn': 'isbn1', 'owner_id': 1})))
+
+        res = self.db.getBook('isbn1')
+
+        self.assertEqual(res.id, 'b1')
+        self.db.books_ref.where.assert_not_called()
+
+    def test_getBook_removed(self):
+        self.syncAll()
+        doc = FakeDoc('b1', {'isbn': 'isbn1', 'owner_id': 1})
+        self.push('books', FakeChange(doc))
+        self.push('books', FakeChange(doc, ChangeType.REMOVED))
+
+        self.assertIsNone(self.db.getBook('isbn1'))
+
+    def test_listBooks_filtersOwnerAndSearch(self):
+        self.syncAll()
+        self.push('books',
+                  FakeChange(FakeDoc('b1', {'isbn': 'i1', 'owner_id': 1, 'title': 'Babel', 'author': 'Kuang'})),
+                  FakeChange(FakeDoc('b2', {'isbn': 'i2', 'owner_id': 1, 'title': 'Paul', 'author': 'Lawlor'})),
+                  FakeChange(FakeDoc('b3', {'isbn': 'i3', 'owner_id': 2, 'title': 'Babel', 'author': 'Kuang'})))
+
+        self.assertEqual([b.id for b in self.db.listBooks(1)], ['b1', 'b2'])
+        self.assertEqual([b.id for b in self.db.listBooks(1, 'babel')], ['b1'])
+
+    def test_getLatestLog_tracksNewest(self):
+        self.syncAll()
+        self.push('actionlogs',
+                  FakeChange(FakeDoc('l2', {'book_id': 'b1', 'timestamp': T0 + timedelta(1), 'action': Action.CHECKOUT.value})),
+                  FakeChange(FakeDoc('l1', {'book_id': 'b1', 'timestamp': T0, 'action': Action.CREATE.value})))
+
+        self.assertEqual(self.db.getLatestLog('b1').id, 'l2')
+
+    def test_getLatestLog_latestRemoved(self):
+        self.syncAll()
+        l1 = FakeDoc('l1', {'book_id': 'b1', 'timestamp': T0, 'action': Action.CREATE.value})
+        l2 = FakeDoc('l2', {'book_id': 'b1', 'timestamp': T0 + timedelta(1), 'action': Action.CHECKOUT.value})
+        self.push('actionlogs', FakeChange(l1), FakeChange(l2))
+        self.push('actionlogs', FakeChange(l2, ChangeType.REMOVED))
+
+        self.assertEqual(self.db.getLatestLog('b1').id, 'l1')
+
+    def test_getLatestLog_pendingWriteFallsThrough(self):
+        self.syncAll()
+        self.db.logs_ref.document.return_value.id = 'l1'
+
+        self.db.putLog('b1', Action.CHECKOUT, 1234)
+        self.db.getLatestLog('b1')
+
+        self.db.logs_ref.where.assert_called()
+
+    def test_getLatestLog_pendingWriteConfirmed(self):
+        self.syncAll()
+        self.db.logs_ref.document.return_value.id = 'l1'
+
+        self.db.putLog('b1', Action.CHECKOUT, 1234)
+        self.push('actionlogs', FakeChange(FakeDoc('l1', {'book_id': 'b1', 'timestamp': T0, 'action': Action.CHECKOUT.value})))
+        res = self.db.getLatestLog('b1')
+
+        self.assertEqual(res.id, 'l1')
+        self.db.logs_ref.where.assert_not_called()
+
+    def test_getLatestLog_pendingUntilEveryWriteConfirmed(self):
+        self.syncAll()
+        self.db.logs_ref.document.return_value.id = 'l1'
+        self.db.putLog('b1', Action.CHECKOUT, 1234)
+        self.db.logs_ref.document.return_value.id = 'l2'
+        self.db.putLog('b1', Action.RETURN, 1234)
+
+        self.push('actionlogs', FakeChange(FakeDoc('l2', {'book_id': 'b1', 'timestamp': T0, 'action': Action.RETURN.value})))
+        self.db.getLatestLog('b1')
+
+        self.db.logs_ref.where.assert_called()
+
+    def test_getLatestLog_pendingExpires(self):
+        self.syncAll()
+        self.db.logs_ref.document.return_value.id = 'l1'
+        self.db.putLog('b1', Action.CHECKOUT, 1234)
+
+        with mock.patch('time.monotonic', return_value=1e12):
+            self.db.getLatestLog('b1')
+
+        self.db.logs_ref.where.assert_not_called()
+
+    def test_getLatestLog_echoBeforeWriteReturns(self):
+        self.syncAll()
+        log = self.db.logs_ref.document.return_value
+        log.id = 'l1'
+        log.set.side_effect = lambda *args, **kwargs: self.push('actionlogs', FakeChange(
+            FakeDoc('l1', {'book_id': 'b1', 'timestamp': T0, 'action': Action.CHECKOUT.value})))
+
+        self.db.putLog('b1', Action.CHECKOUT, 1234)
+        res = self.db.getLatestLog('b1')
+
+        self.assertEqual(res.id, 'l1')
+        self.db.logs_ref.where.assert_not_called()
+
+    def test_getLatestLog_failedWriteNotPending(self):
+        self.syncAll()
+        self.db.logs_ref.document.return_value.set.side_effect = RuntimeError('failed')
+
+        with self.assertRaises(RuntimeError):
+            self.db.putLog('b1', Action.CHECKOUT, 1234)
+        self.db.getLatestLog('b1')
+
+        self.db.logs_ref.where.assert_not_called()
+
+    def test_getBooksById_fetchesOnlyMissing(self):
+        self.syncAll()
+        self.push('books', FakeChange(FakeDoc('b1', {'isbn': 'isbn1', 'owner_id': 1})))
+        self.cli.get_all.return_value = []
+
+        res = self.db.getBooksById(['b1', 'b2'])
+
+        self.assertEqual([b.id for b in res], ['b1'])
+        refs = self.cli.get_all.call_args[0][0]
+        self.assertEqual(len(refs), 1)
+
+    def test_getLatestLogs_fromReplica(self):
+        self.syncAll()
+        self.push('actionlogs',
+                  FakeChange(FakeDoc('l1', {'book_id': 'b1', 'timestamp': T0, 'action': Action.CREATE.value})),
+                  FakeChange(FakeDoc('l2', {'book_id': 'b2', 'timestamp': T0, 'action': Action.CREATE.value})))
+
+        res = self.db.getLatestLogs(['b1', 'b2', 'b3'])
+
+        self.assertEqual({k: v.id for k, v in res.items()}, {'b1': 'l1', 'b2': 'l2'})
+        self.db.logs_ref.where.assert_not_called()
+
+    def test_getCheckouts_fromReplica(self):
+        self.syncAll()
+        self.push('actionlogs',
+                  FakeChange(FakeDoc('l1', {'book_id': 'b1', 'timestamp': T0, 'action': Action.CHECKOUT.value, 'user_id': 1234})),
+                  FakeChange(FakeDoc('l2', {'book_id': 'b2', 'timestamp': T0, 'action': Action.RETURN.value, 'user_id': 1234})))
+
+        res = self.db.getCheckouts(['b1', 'b2', 'b3'])
+
+        self.assertEqual(res, {'b1': (1234, T0)})
+        self.cli.get_all.assert_not_called()
+
+    def test_getUser_fromReplica(self):
+        self.syncAll()
+        self.push('users', FakeChange(FakeDoc('1234', {'name': 'Brian', 'email': 'me@example.com'})))
+
+        res = self.db.getUser(1234)
+
+        self.assertEqual(res.get('name'), 'Brian')
+        self.db.users_ref.document.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
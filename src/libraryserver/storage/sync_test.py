@@ -0,0 +1,41 @@
+import base64
+from datetime import datetime, timedelta, UTC
+import json
+import unittest
+
+from libraryserver.api.errors import InvalidTokenException
+from libraryserver.storage.sync import (
+    HORIZON, SyncPoint, decodeToken, encodeToken, isExpired)
+
+T0 = datetime(2024, 1, 1, tzinfo=UTC)
+
+
+class TestSync(unittest.TestCase):
+
+    def test_roundTrip(self):
+        point = SyncPoint(T0, ('log1', 'log2'))
+
+        self.assertEqual(decodeToken(encodeToken(point)), point)
+
+    def test_decodeToken_invalid(self):
+        for token in ['', 'not a token', encodeToken(SyncPoint(T0))[:-4], 'W10=']:
+            with self.assertRaises(InvalidTokenException):
+                decodeToken(token)
+
+    def test_decodeToken_beforeLogOwners(self):
+        token = base64.urlsafe_b64encode(json.dumps(
+            {"v": 1, "t": T0.isoformat(), "s": []}).encode()).decode()
+
+        self.assertIsNone(decodeToken(token))
+
+    def test_decodeToken_naiveTimestamp(self):
+        with self.assertRaises(InvalidTokenException):
+            decodeToken(encodeToken(SyncPoint(datetime(2024, 1, 1))))
+
+    def test_isExpired(self):
+        self.assertFalse(isExpired(SyncPoint(T0), T0 + HORIZON))
+        self.assertTrue(isExpired(SyncPoint(T0), T0 + HORIZON + timedelta(seconds=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
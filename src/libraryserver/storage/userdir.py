@@ -0,0 +1,93 @@
+import threading
+import time
+
+from libraryserver.api.models import User
+from libraryserver.storage.firestore_client import Database
+
+
+class UserDirectory:
+    """In-memory copy of the user list, shared across requests.
+
+    The copy is tagged with the version counter that `Database` bumps on every
+    user write. At most once per `check_interval` seconds, a read checks that
+    counter (one document read) and reloads the full list only if it moved.
+    Writes made through this process call `invalidate()` so they're visible
+    immediately. Reloads happen outside the lock: while one is running, other
+    requests are served the copy they replace.
+    """
+
+    CHECK_INTERVAL_SECS = 30
+
+    def __init__(self, db: Database, check_interval: float = CHECK_INTERVAL_SECS):
+        self.db = db
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._users: list[User] = []
+        self._version = None
+        self._checked_at = None
+        self._loading = False
+        self._invalidations = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = None
+            self._invalidations += 1
+
+    def listUsers(self, prefix: str|None = None) -> list[User]:
+        """Lists all users. If `prefix` is given, only returns users with a
+        name (or any word of it) starting with `prefix`, ignoring case.
+        """
+        users = self._current()
+        if not prefix:
+            return users
+        return self.filterByPrefix(users, prefix)
+
+    @staticmethod
+    def filterByPrefix(users: list[User], prefix: str) -> list[User]:
+        prefix = prefix.lower()
+        return [u for u in users if _matchesPrefix(u.name, prefix)]
+
+    def _current(self) -> list[User]:
+        with self._lock:
+            now = time.monotonic()
+            if (self._checked_at is not None and
+                    now - self._checked_at < self.check_interval):
+                return self._users
+            if self._loading and self._version is not None:
+                # Another request is already checking; serve what we have
+                return self._users
+            self._loading = True
+            seen_version = self._version
+            seen_invalidations = self._invalidations
+
+        # Read outside the lock, so a slow reload doesn't hold up requests
+        try:
+            version = self.db.getUsersVersion()
+            users = None
+            if version != seen_version:
+                users = [User(int(v.id), v.get("name"), v.get("email"))
+                         for v in self.db.listUsers()]
+        except BaseException:
+            with self._lock:
+                self._loading = False
+            raise
+
+        with self._lock:
+            self._loading = False
+            # Unless a concurrent reload got there first
+            if users is not None and self._version == seen_version:
+                self._users = users
+                self._version = version
+            # A write during the reload may not be in it, so check again
+            # next time
+            if self._invalidations == seen_invalidations:
+                self._checked_at = now
+            return self._users
+
+
+def _matchesPrefix(name: str|None, prefix: str) -> bool:
+    if not name:
+        return False
+    name = name.lower()
+    return name.startswith(prefix) or any(
+        word.startswith(prefix) for word in name.split())
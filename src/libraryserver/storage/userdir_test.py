@@ -0,0 +1,125 @@
+import threading
+import unittest
+
+from libraryserver.api.models import User
+from libraryserver.storage.userdir import UserDirectory
+
+
+class FakeUserDoc:
+
+    def __init__(self, user_id, name, email):
+        self.id = str(user_id)
+        self.vals = {"name": name, "email": email}
+
+    def get(self, field):
+        return self.vals[field]
+
+
+class FakeDatabase:
+
+    def __init__(self):
+        self.version = 0
+        self.users = []
+        self.list_calls = 0
+        self.version_calls = 0
+        self.list_gate = None
+
+    def putUser(self, user_id, name, email):
+        self.users.append(FakeUserDoc(user_id, name, email))
+        self.version += 1
+
+    def getUsersVersion(self):
+        self.version_calls += 1
+        return self.version
+
+    def listUsers(self):
+        self.list_calls += 1
+        users = list(self.users)
+        if self.list_gate is not None:
+            self.list_gate.wait()
+        return users
+
+
+class TestUserDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.db.putUser(1234, 'Brian McSwiggen', 'me@example.com')
+        self.db.putUser(5678, 'Other Person', 'other@example.com')
+
+    def test_listUsers(self):
+        directory = UserDirectory(self.db)
+
+        res = directory.listUsers()
+
+        self.assertEqual(res, [User(1234, 'Brian McSwiggen', 'me@example.com'),
+                               User(5678, 'Other Person', 'other@example.com')])
+
+    def test_listUsers_servedFromMemory(self):
+        directory = UserDirectory(self.db)
+
+        directory.listUsers()
+        directory.listUsers()
+
+        self.assertEqual(self.db.list_calls, 1)
+        self.assertEqual(self.db.version_calls, 1)
+
+    def test_listUsers_reloadsOnNewVersion(self):
+        directory = UserDirectory(self.db, check_interval=0)
+
+        directory.listUsers()
+        self.db.putUser(9999, 'New', 'new@example.com')
+        res = directory.listUsers()
+
+        self.assertEqual(len(res), 3)
+        self.assertEqual(self.db.list_calls, 2)
+
+    def test_listUsers_skipsReloadOnSameVersion(self):
+        directory = UserDirectory(self.db, check_interval=0)
+
+        directory.listUsers()
+        directory.listUsers()
+
+        self.assertEqual(self.db.list_calls, 1)
+        self.assertEqual(self.db.version_calls, 2)
+
+    def test_invalidate(self):
+        directory = UserDirectory(self.db)
+
+        directory.listUsers()
+        self.db.putUser(9999, 'New', 'new@example.com')
+        directory.invalidate()
+        res = directory.listUsers()
+
+        self.assertEqual(len(res), 3)
+
+    def test_listUsers_servedDuringReload(self):
+        directory = UserDirectory(self.db, check_interval=0)
+        directory.listUsers()
+        self.db.putUser(9999, 'New', 'new@example.com')
+        self.db.list_gate = threading.Event()
+        reloaded = []
+        reload = threading.Thread(target=lambda: reloaded.append(directory.listUsers()))
+        reload.start()
+        while self.db.list_calls < 2:
+            pass
+
+        res = directory.listUsers()
+
+        self.assertEqual(len(res), 2)
+        self.db.list_gate.set()
+        reload.join()
+        self.assertEqual(len(reloaded[0]), 3)
+        self.assertEqual(len(directory.listUsers()), 3)
+
+    def test_listUsers_prefix(self):
+        directory = UserDirectory(self.db)
+
+        self.assertEqual([u.user_id for u in directory.listUsers('br')], [1234])
+        self.assertEqual([u.user_id for u in directory.listUsers('MCS')], [1234])
+        self.assertEqual([u.user_id for u in directory.listUsers('p')], [5678])
+        self.assertEqual(directory.listUsers('x'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,6 +21,7 @@ from __future__ import annotations
 
 from collections.abc import Callable
 from functools import wraps
+import logging
 from typing import TypeVar
 
 import firebase_admin
@@ -30,6 +31,8 @@ from flask import request, Response
 
 a = TypeVar("a")
 
+logger = logging.getLogger(__name__)
+
 
 def jwt_authenticated(func: Callable[..., int]) -> Callable[..., int]:
     """Use the Firebase Admin SDK to parse Authorization header to verify the
@@ -0,0 +1,187 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+import hashlib
+from io import BytesIO
+import logging
+import os
+import tempfile
+import threading
+from urllib.parse import urljoin, urlsplit
+
+from PIL import Image
+import requests
+
+from libraryserver.api.errors import InvalidImageException, NotFoundException
+from libraryserver.config import APP_CONFIG
+from libraryserver.outbound.client import HTTP_CLIENT, HttpClient
+
+# Covers are a few hundred pixels across, so anything far bigger is bogus.
+# PIL refuses to decode images over twice this (and warns over it).
+MAX_PIXELS = 4096 * 4096
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+
+class ThumbnailCache:
+    """Local disk cache of book cover images, in a few fixed sizes.
+
+    Image bytes are stored once under the SHA-256 of their content (which also
+    serves as the ETag), and small ref files map (source URL, size) to that
+    hash. Both are written atomically, so concurrent requests and processes
+    can share a cache directory.
+
+    Covers are only fetched from `allowed_hosts`, since their URLs come from
+    users. That includes every redirect along the way. An entry starting with
+    '.' allows any subdomain of what follows. Downloads over `max_bytes` are
+    refused.
+    """
+
+    # Size name -> maximum width in pixels. Everything is stored as JPEG.
+    SIZES = {'small': 64, 'medium': 128, 'large': 256}
+    MAX_BYTES = 5 * 1024 * 1024
+    MAX_REDIRECTS = 3
+
+    def __init__(self, root: str, http: HttpClient = HTTP_CLIENT,
+                 allowed_hosts: set[str]|None = None, max_bytes: int = MAX_BYTES):
+        self.logger = logging.getLogger(__name__)
+        self.root = root
+        self.http = http
+        if allowed_hosts is None:
+            allowed_hosts = APP_CONFIG.thumbnail_hosts()
+        self.allowed_hosts = allowed_hosts
+        self.max_bytes = max_bytes
+        # URL -> (lock, number of threads holding or waiting for it)
+        self._locks: dict[str, tuple[threading.Lock, int]] = {}
+        self._locks_lock = threading.Lock()
+
+    def get(self, url: str, size: str) -> tuple[bytes, str]:
+        """Returns the (image, ETag) for this cover at this size, fetching and
+        caching it first if needed. Raises NotFoundException if the URL isn't
+        from an allowed host, and InvalidImageException if what it points to
+        isn't a usable image.
+        """
+        if size not in self.SIZES:
+            raise ValueError('Unknown thumbnail size %s' % size)
+        digest = self._readRef(url, size)
+        if digest is None:
+            self.prefetch(url)
+            digest = self._readRef(url, size)
+        with open(self._blobPath(digest), 'rb') as f:
+            return f.read(), digest
+
+    def prefetch(self, url: str):
+        """Downloads this cover and stores all of its sizes, unless they're
+        already cached.
+        """
+        self._checkAllowed(url)
+        with self._lockFor(url):
+            if all(self._readRef(url, size) for size in self.SIZES):
+                return
+            original = self._download(url)
+            for size, width in self.SIZES.items():
+                data = self._resize(original, width)
+                self._writeRef(url, size, self._writeBlob(data))
+
+    def _checkAllowed(self, url: str):
+        parts = urlsplit(url)
+        host = parts.hostname or ''
+        if parts.scheme not in ('http', 'https') or not (
+                host in self.allowed_hosts or
+                any(h.startswith('.') and host.endswith(h) for h in self.allowed_hosts)):
+            raise NotFoundException('Thumbnail host of %s is not allowed' % url)
+
+    def _download(self, url: str) -> bytes:
+        # Follows redirects here rather than in requests, so that each hop is
+        # checked against the allowed hosts
+        for _ in range(self.MAX_REDIRECTS + 1):
+            with self.http.get(url, stream=True, allow_redirects=False) as resp:
+                if resp.is_redirect:
+                    url = urljoin(url, resp.headers['Location'])
+                    self._checkAllowed(url)
+                    continue
+                return self._readBody(url, resp)
+        raise InvalidImageException('Too many redirects fetching thumbnail')
+
+    def _readBody(self, url: str, resp: requests.Response) -> bytes:
+        resp.raise_for_status()
+        if int(resp.headers.get('Content-Length') or 0) > self.max_bytes:
+            raise InvalidImageException('Thumbnail %s is too large' % url)
+        data = bytearray()
+        for chunk in resp.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > self.max_bytes:
+                raise InvalidImageException('Thumbnail %s is too large' % url)
+        return bytes(data)
+
+    def prefetchInBackground(self, url: str):
+        def run():
+            try:
+                self.prefetch(url)
+            except Exception as e:
+                self.logger.warning('Could not prefetch thumbnail %s', url, exc_info=e)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _resize(self, data: bytes, width: int) -> bytes:
+        try:
+            img = Image.open(BytesIO(data))
+            # Only the header has been read so far
+            if img.width * img.height > MAX_PIXELS:
+                raise InvalidImageException('Thumbnail has too many pixels')
+            if img.width > width:
+                height = round(img.height * width / img.width)
+                img = img.resize((width, height), Image.LANCZOS)
+            out = BytesIO()
+            img.convert('RGB').save(out, format='JPEG', quality=85)
+        except (OSError, Image.DecompressionBombError) as e:
+            # Includes UnidentifiedImageError and truncated images
+            raise InvalidImageException('Thumbnail is not a usable image') from e
+        return out.getvalue()
+
+    @contextmanager
+    def _lockFor(self, url: str) -> Iterator[None]:
+        # Held while fetching `url`, so each cover is only downloaded once.
+        # Dropped once nobody needs it, so the map doesn't grow with every URL.
+        with self._locks_lock:
+            lock, users = self._locks.get(url, (None, 0))
+            lock = lock or threading.Lock()
+            self._locks[url] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, users = self._locks[url]
+                if users == 1:
+                    del self._locks[url]
+                else:
+                    self._locks[url] = (lock, users - 1)
+
+    def _refPath(self, url: str, size: str) -> str:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'refs', '%s.%s' % (key, size))
+
+    def _blobPath(self, digest: str) -> str:
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def _readRef(self, url: str, size: str) -> str|None:
+        try:
+            with open(self._refPath(url, size), 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _writeRef(self, url: str, size: str, digest: str):
+        self._atomicWrite(self._refPath(url, size), digest.encode('utf-8'))
+
+    def _writeBlob(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blobPath(digest)
+        if not os.path.exists(path):
+            self._atomicWrite(path, data)
+        return digest
+
+    def _atomicWrite(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
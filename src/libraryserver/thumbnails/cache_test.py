@@ -0,0 +1,173 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+import os
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+import requests
+
+from libraryserver.api.errors import InvalidImageException, NotFoundException
+from libraryserver.thumbnails.cache import ThumbnailCache
+
+
+def _png(width, height):
+    out = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(out, format='PNG')
+    return out.getvalue()
+
+
+class _CoverHandler(BaseHTTPRequestHandler):
+    image = _png(128, 192)
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        if self.path == '/cover.png':
+            body = self.image
+        elif self.path == '/text.png':
+            body = b'not an image'
+        elif self.path == '/huge.png':
+            body = _png(5000, 5000)
+        elif self.path.startswith('/redirect?'):
+            self.send_response(302)
+            self.send_header('Location', self.path.split('?', 1)[1])
+            self.end_headers()
+            return
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestThumbnailCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('localhost', 0), _CoverHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = 'http://localhost:%d/cover.png' % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ThumbnailCache(self.dir.name, allowed_hosts={'localhost'})
+        _CoverHandler.hits = 0
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_get_resizes(self):
+        data, _ = self.cache.get(self.url, 'small')
+
+        img = Image.open(BytesIO(data))
+        self.assertEqual(img.format, 'JPEG')
+        self.assertEqual(img.size, (64, 96))
+
+    def test_get_doesNotUpscale(self):
+        data, _ = self.cache.get(self.url, 'large')
+
+        self.assertEqual(Image.open(BytesIO(data)).size, (128, 192))
+
+    def test_get_fetchesOnce(self):
+        self.cache.get(self.url, 'small')
+        self.cache.get(self.url, 'medium')
+        ThumbnailCache(self.dir.name, allowed_hosts={'localhost'}).get(self.url, 'small')
+
+        self.assertEqual(_CoverHandler.hits, 1)
+
+    def test_prefetch(self):
+        self.cache.prefetch(self.url)
+        _, etag = self.cache.get(self.url, 'medium')
+
+        self.assertEqual(_CoverHandler.hits, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, 'blobs', etag[:2], etag)))
+
+    def test_get_etagIsContentHash(self):
+        _, small = self.cache.get(self.url, 'small')
+        _, small_again = self.cache.get(self.url, 'small')
+        _, medium = self.cache.get(self.url, 'medium')
+
+        self.assertEqual(small, small_again)
+        self.assertNotEqual(small, medium)
+
+    def test_get_unknownSize(self):
+        with self.assertRaises(ValueError):
+            self.cache.get(self.url, 'huge')
+
+    def test_get_fetchError(self):
+        with self.assertRaises(requests.HTTPError):
+            self.cache.get(self.url.replace('cover', 'missing'), 'small')
+
+
+    def test_get_disallowedHost(self):
+        cache = ThumbnailCache(self.dir.name, allowed_hosts={'covers.openlibrary.org'})
+
+        for url in [self.url, 'http://metadata.google.internal/computeMetadata/v1/',
+                    'file:///etc/passwd']:
+            with self.assertRaises(NotFoundException):
+                cache.get(url, 'small')
+        self.assertEqual(_CoverHandler.hits, 0)
+
+    def test_get_followsRedirect(self):
+        data, _ = self.cache.get(self.url.replace('cover.png', 'redirect?/cover.png'), 'small')
+
+        self.assertEqual(Image.open(BytesIO(data)).size, (64, 96))
+        self.assertEqual(_CoverHandler.hits, 2)
+
+    def test_get_redirectToDisallowedHost(self):
+        url = self.url.replace(
+            'cover.png', 'redirect?http://metadata.google.internal/computeMetadata/v1/')
+
+        with self.assertRaises(NotFoundException):
+            self.cache.get(url, 'small')
+        self.assertEqual(_CoverHandler.hits, 1)
+
+    def test_get_tooManyRedirects(self):
+        url = self.url.replace('cover.png', 'redirect?/redirect?/redirect?/redirect?/cover.png')
+
+        with self.assertRaises(InvalidImageException):
+            self.cache.get(url, 'small')
+
+    def test_get_subdomainAllowed(self):
+        cache = ThumbnailCache(self.dir.name, allowed_hosts={'.archive.org'})
+
+        with self.assertRaises(NotFoundException):
+            cache.get('https://evilarchive.org/cover.png', 'small')
+        with self.assertRaises(NotFoundException):
+            cache.get('https://archive.org.example.com/cover.png', 'small')
+        self.assertEqual(_CoverHandler.hits, 0)
+
+    def test_get_notAnImage(self):
+        with self.assertRaises(InvalidImageException):
+            self.cache.get(self.url.replace('cover', 'text'), 'small')
+
+    def test_get_tooManyBytes(self):
+        cache = ThumbnailCache(self.dir.name, allowed_hosts={'localhost'}, max_bytes=100)
+
+        with self.assertRaises(InvalidImageException):
+            cache.get(self.url, 'small')
+
+    def test_get_tooManyPixels(self):
+        with self.assertRaises(InvalidImageException):
+            self.cache.get(self.url.replace('cover', 'huge'), 'small')
+
+    def test_locksDropped(self):
+        self.cache.get(self.url, 'small')
+
+        self.assertEqual(self.cache._locks, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+from collections.abc import Callable
+import logging
+import threading
+import time
+
+
+class Warmup:
+    """Runs an instance's start-up steps in the background and reports
+    whether they've all finished.
+
+    Each step is a named callable. Steps run in order; one that raises is
+    retried (with backoff, up to `max_backoff` seconds) until it succeeds, so
+    the instance only becomes ready once everything is actually warm.
+    """
+
+    def __init__(self, steps: list[tuple[str, Callable[[], object]]],
+                 max_backoff: float = 30):
+        self.logger = logging.getLogger(__name__)
+        self.steps = steps
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._status = {name: 'pending' for name, _ in steps}
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        self._thread.start()
+
+    def join(self, timeout: float|None = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        for name, step in self.steps:
+            backoff = min(0.5, self.max_backoff)
+            while True:
+                start = time.monotonic()
+                try:
+                    step()
+                except Exception as e:
+                    self.logger.warning('Warm-up step %s failed, retrying', name,
+                                        exc_info=e)
+                    self._setStatus(name, 'retrying')
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                self.logger.info('Warm-up step %s took %.2fs', name,
+                                 time.monotonic() - start)
+                self._setStatus(name, 'done')
+                break
+
+    def isReady(self) -> bool:
+        with self._lock:
+            return all(s == 'done' for s in self._status.values())
+
+    def status(self) -> dict[str, str]:
+        with self._lock:
+            return dict(self._status)
+
+    def _setStatus(self, name: str, status: str):
+        with self._lock:
+            self._status[name] = status
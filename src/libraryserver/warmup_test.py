@@ -0,0 +1,44 @@
+import unittest
+
+from libraryserver.warmup import Warmup
+
+
+class TestWarmup(unittest.TestCase):
+
+    def test_notReadyUntilRun(self):
+        warmup = Warmup([('a', lambda: None)])
+
+        self.assertFalse(warmup.isReady())
+        self.assertEqual(warmup.status(), {'a': 'pending'})
+
+    def test_runsStepsInOrder(self):
+        calls = []
+        warmup = Warmup([('a', lambda: calls.append('a')),
+                         ('b', lambda: calls.append('b'))])
+
+        warmup.start()
+        warmup.join(5)
+
+        self.assertEqual(calls, ['a', 'b'])
+        self.assertTrue(warmup.isReady())
+        self.assertEqual(warmup.status(), {'a': 'done', 'b': 'done'})
+
+    def test_retriesFailedStep(self):
+        attempts = []
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise ConnectionError()
+        warmup = Warmup([('flaky', flaky)], max_backoff=0.01)
+
+        warmup.run()
+
+        self.assertEqual(len(attempts), 2)
+        self.assertTrue(warmup.isReady())
+
+    def test_noSteps(self):
+        self.assertTrue(Warmup([]).isReady())
+
+
+if __name__ == '__main__':
+    unittest.main()